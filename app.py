@@ -1,20 +1,37 @@
-from flask import Flask, request, jsonify, send_file, render_template_string
+from flask import Flask, Response, request, jsonify, send_file, render_template_string, stream_with_context
 from flask_cors import CORS
 import os
+import re
+import csv
+import hmac
 import json
+import time
+import uuid
+import threading
 from datetime import datetime
 import subprocess
 from ai_analyzer import EnhancedMotivationAnalyzer
-from usage_tracker import UsageTracker
-from job_queue import job_queue
-from async_worker import start_async_job
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_CENTER, TA_LEFT
+from usage_tracker import SQLiteUsageTracker, BufferedUsageTracker, USAGE_WRITE_BEHIND, INCREMENT_FIELDS
+from job_queue import (job_queue, FINISHED_STATUSES, JOB_TTL_COMPLETE_SECONDS, JOB_TTL_ERROR_SECONDS,
+                       JOB_REAPER_INTERVAL_SECONDS)
+from idempotency_store import IdempotencyStore, IDEMPOTENCY_MAX_KEY_LENGTH
+from async_worker import start_async_job, recover_jobs, process_transcript_async
+from batch_queue import batch_queue, BATCH_MAX_ITEMS
+from job_checkpoints import checkpoint_store, STAGE_PROGRESS
+from webhooks import WebhookQueue, validate_callback_url
+from upload_stream import StreamingRequest
+from upload_janitor import UploadJanitor, UPLOAD_MAX_AGE_SECONDS
+from result_store import RESULTS_FOLDER
+from segment_store import SEGMENTS_FOLDER
+from rate_limiter import rate_limiter
+from audio_probe import probe_duration
+from transcription_backends import transcription_backend
+from transcription_cache import transcription_cache
+from segment_store import segment_store
+from werkzeug.exceptions import HTTPException
+from pdf_report import render_report, report_cache
 import io
+import gzip
 
 app = Flask(__name__)
 CORS(app)
@@ -27,11 +44,126 @@ if not os.path.exists(UPLOAD_FOLDER):
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
 
+# Stream uploads in chunks straight into the upload folder (never buffered in memory)
+app.request_class = StreamingRequest
+StreamingRequest.upload_folder = UPLOAD_FOLDER
+
+# Server-Sent Events settings for /api/job-events
+SSE_HEARTBEAT_SECONDS = int(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+SSE_MAX_STREAM_SECONDS = int(os.environ.get('SSE_MAX_STREAM_SECONDS', 300))
+SSE_RETRY_MS = 2000
+
+# Admin usage endpoints (/api/admin/...) are disabled unless a key is configured
+ADMIN_API_KEY = os.environ.get('ADMIN_API_KEY', '')
+ADMIN_PAGE_MAX_LIMIT = 1000
+MONTH_PATTERN = re.compile(r'^\d{4}-(0[1-9]|1[0-2])$')
+
+# user_id values accepted by one /api/usage-stats request
+USAGE_STATS_MAX_USERS = 500
+
 # Initialize enhanced analyzer
 analyzer = EnhancedMotivationAnalyzer()
 
-# Initialize usage tracker
-usage_tracker = UsageTracker()
+# Initialize usage tracker (write-behind keeps usage writes off the request path)
+usage_tracker = BufferedUsageTracker() if USAGE_WRITE_BEHIND else SQLiteUsageTracker()
+
+# Uncompressed 48kHz stereo PCM is ~11MB per minute; no real recording is denser
+MAX_AUDIO_BYTES_PER_MINUTE = 12 * 1024 * 1024
+
+def _remaining_upload_bytes(user_id):
+    """Upper bound on the bytes a user may still upload, from their remaining minutes"""
+    _, remaining = usage_tracker.check_audio_limit(user_id, 0)
+    return max(0, int(remaining * MAX_AUDIO_BYTES_PER_MINUTE))
+
+def _audio_minutes(upload):
+    """
+    Duration of an uploaded file in minutes for quota checks, and the probed seconds
+    Read from the container headers; unknown formats fall back to ~1MB per minute.
+    """
+    duration_seconds = probe_duration(upload.path)
+    if duration_seconds is None:
+        return upload.size / (1024 * 1024), None
+    return duration_seconds / 60, duration_seconds
+
+StreamingRequest.user_byte_limit = staticmethod(_remaining_upload_bytes)
+
+def _upload_user_id():
+    """
+    The user an upload is billed as, and an error message if it can't be used
+    ?user_id= or X-User-Id when sent (the streaming limits were applied to that user, so a
+    user_id form field must name the same one); otherwise the user_id form field, or 'anonymous'.
+    """
+    user_id = request.upload_user_id
+    form_user_id = request.form.get('user_id')
+    if not user_id:
+        return form_user_id or 'anonymous', None
+    if form_user_id and form_user_id != user_id:
+        return None, 'user_id form field does not match the ?user_id= / X-User-Id of the upload'
+    return user_id, None
+
+# Remove uploads left behind by crashes and restarts, and keep the folder under its quota
+upload_janitor = UploadJanitor(UPLOAD_FOLDER)
+upload_janitor.start()
+
+# Spilled results and segment files outlive their job only if the worker holding it crashed
+JOB_FILE_MAX_AGE_SECONDS = (max(UPLOAD_MAX_AGE_SECONDS, JOB_TTL_COMPLETE_SECONDS, JOB_TTL_ERROR_SECONDS)
+                            + JOB_REAPER_INTERVAL_SECONDS)
+job_file_janitors = {
+    'results': UploadJanitor(RESULTS_FOLDER, JOB_FILE_MAX_AGE_SECONDS, quota_bytes=None),
+    'segments': UploadJanitor(SEGMENTS_FOLDER, JOB_FILE_MAX_AGE_SECONDS, quota_bytes=None)
+}
+for janitor in job_file_janitors.values():
+    janitor.start()
+
+# Reap finished and abandoned jobs in the background so memory stays bounded
+job_queue.start_reaper()
+
+# Idempotency keys for audio submissions (shared by all workers)
+idempotency_store = IdempotencyStore()
+
+def _record_idempotent_status(job):
+    """Keep the stored status of keyed jobs current for retries on other workers"""
+    if job['idempotency_key'] and job['status'] in FINISHED_STATUSES:
+        idempotency_store.record_status(job['job_id'], job['status'])
+
+job_queue.add_listener(_record_idempotent_status)
+
+# Completion webhooks (queued in SQLite so deliveries survive restarts)
+webhook_queue = WebhookQueue()
+
+def _enqueue_webhook(job):
+    """Queue a signed callback once a job that registered a callback_url finishes"""
+    if job['callback_url'] and job['status'] in FINISHED_STATUSES:
+        payload = _job_status_payload(job, include_result=True)
+        webhook_queue.enqueue(job['job_id'], job['callback_url'], f"job.{job['status']}", payload)
+
+job_queue.add_listener(_enqueue_webhook)
+webhook_queue.start()
+
+# Load the local transcription model (if configured) without holding up startup
+threading.Thread(target=transcription_backend.preload, name='transcription-preload', daemon=True).start()
+
+# Resume audio jobs interrupted by a restart or crash
+recover_jobs(analyzer, usage_tracker, app.config)
+
+@app.before_request
+def _rate_limit():
+    """Throttle each user_id and each client IP on the routes in RATE_LIMITS / RATE_LIMITS_IP (shared by all workers)"""
+    if request.method == 'OPTIONS':
+        return None
+    # Uploads aren't parsed yet, so for those only ?user_id= or X-User-Id identify the user
+    user_id = request.headers.get('X-User-Id') or request.args.get('user_id')
+    if not user_id and request.is_json:
+        user_id = (request.get_json(silent=True) or {}).get('user_id')
+    # The last hop is the address our proxy saw; earlier X-Forwarded-For entries are client-supplied
+    client_ip = request.access_route[-1] if request.access_route else ''
+    retry_after = rate_limiter.check(request.endpoint, str(user_id) if user_id else None, client_ip)
+    if retry_after:
+        return jsonify({
+            'error': f'Too many requests. Try again in {retry_after} seconds.',
+            'retry_after': retry_after
+        }), 429, {'Retry-After': str(retry_after)}
+    return None
 
 @app.route('/')
 def index():
@@ -48,8 +180,31 @@ def analyze_transcript():
         if not transcript.strip():
             return jsonify({'error': 'No transcript provided'}), 400
         
+        # With a callback_url the analysis runs in the background and the result is POSTed back
+        callback_url = data.get('callback_url')
+        if callback_url:
+            callback_error = validate_callback_url(callback_url)
+            if callback_error:
+                return jsonify({'error': callback_error}), 400
+            
+            user_id = data.get('user_id', 'anonymous')
+            job_id = job_queue.create_job(user_id, callback_url=callback_url)
+            threading.Thread(
+                target=process_transcript_async,
+                args=(job_id, transcript, user_id, analyzer, usage_tracker),
+                daemon=True
+            ).start()
+            
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'status': 'queued',
+                'message': 'Transcript queued. The result will be sent to callback_url.'
+            }), 202
+        
         # Analyze the transcript using enhanced analyzer
         analysis = analyzer.analyze_transcript(transcript)
+        usage_tracker.record_analysis_usage(data.get('user_id', 'anonymous'))
         
         return jsonify({
             'success': True,
@@ -67,7 +222,9 @@ def analyze_audio():
     """Analyze uploaded audio file for seller motivation (ASYNC VERSION)"""
     try:
         # Get user ID from request (from WordPress or session)
-        user_id = request.form.get('user_id', 'anonymous')
+        user_id, user_error = _upload_user_id()
+        if user_error:
+            return jsonify({'error': user_error}), 400
         
         if 'audio' not in request.files:
             return jsonify({'error': 'No audio file provided'}), 400
@@ -76,21 +233,45 @@ def analyze_audio():
         if audio_file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
-        # Save uploaded file temporarily
-        filename = f"audio_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{audio_file.filename.split('.')[-1]}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        audio_file.save(filepath)
+        # Optional URL to POST the result to when the job finishes
+        callback_url = request.form.get('callback_url') or None
+        if callback_url:
+            callback_error = validate_callback_url(callback_url)
+            if callback_error:
+                return jsonify({'error': callback_error}), 400
+        
+        # Retried submissions with the same key get the original job instead of new work
+        idempotency_key = request.headers.get('Idempotency-Key') or request.form.get('request_id')
+        job_id = None
+        if idempotency_key:
+            if len(idempotency_key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+                return jsonify({'error': f'Idempotency-Key must be at most {IDEMPOTENCY_MAX_KEY_LENGTH} characters'}), 400
+            
+            job_id = str(uuid.uuid4())
+            original = idempotency_store.claim(user_id, idempotency_key, job_id)
+            if original:
+                job = job_queue.get_job(original['job_id'])
+                return jsonify({
+                    'success': True,
+                    'job_id': original['job_id'],
+                    'status': job['status'] if job else original['status'],
+                    'message': 'Duplicate request. Returning the original job.',
+                    'idempotent_replay': True
+                }), 202
+        
+        # The upload was already streamed to its final path, hashed and counted
+        upload = audio_file.stream
+        filepath = upload.path
         
         try:
-            # Get audio duration for usage tracking
-            file_size_mb = os.path.getsize(filepath) / (1024 * 1024)
-            # Estimate duration: ~1MB per minute for typical audio
-            estimated_duration_minutes = file_size_mb
+            estimated_duration_minutes, duration_seconds = _audio_minutes(upload)
             
-            # Check usage limits before processing
-            can_proceed, remaining = usage_tracker.check_audio_limit(user_id, estimated_duration_minutes)
+            # Hold the estimated minutes until the job settles them (the unclaimed upload is deleted with the request)
+            job_id = job_id or str(uuid.uuid4())
+            can_proceed, remaining = usage_tracker.reserve_audio_minutes(user_id, estimated_duration_minutes, job_id)
             if not can_proceed:
-                os.remove(filepath)
+                if idempotency_key:
+                    idempotency_store.release(user_id, idempotency_key, job_id)
                 return jsonify({
                     'error': f'Monthly audio limit exceeded. You have {remaining:.1f} minutes remaining this month. Limit: 500 minutes/month.',
                     'limit_exceeded': True,
@@ -98,30 +279,187 @@ def analyze_audio():
                 }), 429
             
             # Start async processing job
-            job_id = start_async_job(filepath, user_id, analyzer, usage_tracker, app.config)
+            upload.claim()
+            job_id = start_async_job(filepath, user_id, analyzer, usage_tracker, app.config,
+                                     job_id=job_id, idempotency_key=idempotency_key,
+                                     callback_url=callback_url, duration_seconds=duration_seconds,
+                                     audio_sha256=upload.sha256)
             
             # Return job ID immediately
             return jsonify({
                 'success': True,
                 'job_id': job_id,
                 'status': 'processing',
-                'message': 'Audio uploaded successfully. Processing in background...'
+                'message': 'Audio uploaded successfully. Processing in background...',
+                'upload': {'bytes': upload.size, 'sha256': upload.sha256, 'duration_seconds': duration_seconds}
             }), 202  # 202 Accepted
         
         except Exception as e:
             if os.path.exists(filepath):
                 os.remove(filepath)
+            if job_id:
+                usage_tracker.release_audio_reservation(job_id)
+            if idempotency_key:
+                idempotency_store.release(user_id, idempotency_key, job_id)
             raise e
     
+    except HTTPException as e:
+        # Upload rejected while streaming (size, allowance or concurrency limit)
+        return jsonify({'error': e.description}), e.code
+    
     except Exception as e:
         print(f"Error analyzing audio: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def _read_batch_transcripts():
+    """Parse JSONL transcripts from the request body or an uploaded .jsonl file"""
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl', 'application/x-jsonlines'):
+        lines = request.get_data(as_text=True).splitlines()
+    elif 'transcripts' in request.files:
+        lines = request.files['transcripts'].read().decode('utf-8').splitlines()
+    else:
+        return []
+    
+    transcripts = []
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            raise ValueError(f'Line {line_number} is not valid JSON')
+        
+        if isinstance(entry, str):
+            entry = {'transcript': entry}
+        if not isinstance(entry, dict) or not str(entry.get('transcript', '')).strip():
+            raise ValueError(f'Line {line_number} has no transcript')
+        
+        transcripts.append({
+            'item_id': str(entry.get('id') or f'transcript-{line_number}'),
+            'transcript': entry['transcript']
+        })
+    
+    return transcripts
+
+@app.route('/api/batch', methods=['POST'])
+def create_batch():
+    """Submit many audio files and/or JSONL transcripts for analysis in one request"""
+    try:
+        user_id, user_error = _upload_user_id()
+        if user_error:
+            return jsonify({'error': user_error}), 400
+        
+        audio_files = [f for f in request.files.getlist('files') if f.filename]
+        try:
+            transcripts = _read_batch_transcripts()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        total = len(audio_files) + len(transcripts)
+        if total == 0:
+            return jsonify({'error': 'No audio files or transcripts provided'}), 400
+        if total > BATCH_MAX_ITEMS:
+            return jsonify({'error': f'Too many items in batch ({total}). Maximum is {BATCH_MAX_ITEMS}.'}), 400
+        
+        # Uploads are already on disk; reserve minutes for every file or for none of them
+        durations = [_audio_minutes(f.stream) for f in audio_files]
+        job_ids = [str(uuid.uuid4()) for _ in audio_files]
+        for index, (job_id, (minutes, _)) in enumerate(zip(job_ids, durations)):
+            can_proceed, remaining = usage_tracker.reserve_audio_minutes(user_id, minutes, job_id)
+            if not can_proceed:
+                for reserved_job_id in job_ids[:index]:
+                    usage_tracker.release_audio_reservation(reserved_job_id)
+                remaining += sum(minutes for minutes, _ in durations[:index])
+                return jsonify({
+                    'error': f'Monthly audio limit exceeded. You have {remaining:.1f} minutes remaining this month. Limit: 500 minutes/month.',
+                    'limit_exceeded': True,
+                    'remaining_minutes': remaining
+                }), 429
+        
+        batch_id = batch_queue.create_batch(user_id)
+        
+        for audio_file, job_id, (_, duration_seconds) in zip(audio_files, job_ids, durations):
+            audio_file.stream.claim()
+            job_id = start_async_job(audio_file.stream.path, user_id, analyzer, usage_tracker, app.config,
+                                     job_id=job_id, batch_id=batch_id, executor=batch_queue.executor,
+                                     duration_seconds=duration_seconds, audio_sha256=audio_file.stream.sha256)
+            batch_queue.add_item(batch_id, audio_file.filename, job_id)
+        
+        for item in transcripts:
+            job_id = job_queue.create_job(user_id, batch_id=batch_id)
+            batch_queue.executor.submit(process_transcript_async, job_id, item['transcript'], user_id, analyzer,
+                                        usage_tracker)
+            batch_queue.add_item(batch_id, item['item_id'], job_id)
+        
+        return jsonify({
+            'success': True,
+            'batch_id': batch_id,
+            'total': total,
+            'status_url': f'/api/batch/{batch_id}',
+            'results_url': f'/api/batch/{batch_id}/results',
+            'message': f'Batch of {total} items accepted. Processing in background...'
+        }), 202
+    
+    except HTTPException as e:
+        # Upload rejected while streaming (size, allowance or concurrency limit)
+        return jsonify({'error': e.description}), e.code
+    
+    except Exception as e:
+        print(f"Error creating batch: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/batch/<batch_id>', methods=['GET'])
+def get_batch_status(batch_id):
+    """Get aggregated progress of a batch"""
+    try:
+        progress = batch_queue.get_progress(batch_id)
+        
+        if not progress:
+            return jsonify({'error': 'Batch not found'}), 404
+        
+        return jsonify(progress)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/batch/<batch_id>/results', methods=['GET'])
+def get_batch_results(batch_id):
+    """Stream batch results as JSONL, one line per item as soon as it finishes"""
+    if not batch_queue.get_batch(batch_id):
+        return jsonify({'error': 'Batch not found'}), 404
+    
+    def generate():
+        for outcome in batch_queue.iter_results(batch_id, heartbeat_seconds=SSE_HEARTBEAT_SECONDS):
+            if outcome is None:
+                # Blank line keeps the connection alive while items are still running
+                yield "\n"
+            else:
+                yield json.dumps(outcome) + "\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            'Content-Disposition': f'attachment; filename="batch_{batch_id}.jsonl"'
+        }
+    )
+
 @app.route('/api/usage-stats', methods=['GET'])
 def get_usage_stats():
-    """Get usage statistics for current user"""
+    """Get usage statistics for current user (repeat user_id for several: stats keyed by user_id)"""
     try:
-        user_id = request.args.get('user_id', 'anonymous')
+        user_ids = request.args.getlist('user_id')
+        if len(user_ids) > 1:
+            if len(user_ids) > USAGE_STATS_MAX_USERS:
+                return jsonify({'error': f'At most {USAGE_STATS_MAX_USERS} user_id values per request'}), 400
+            return jsonify({
+                'success': True,
+                'stats': usage_tracker.get_usage_stats_many(user_ids)
+            })
+        
+        user_id = user_ids[0] if user_ids else 'anonymous'
         stats = usage_tracker.get_usage_stats(user_id)
         return jsonify({
             'success': True,
@@ -130,6 +468,187 @@ def get_usage_stats():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _admin_error():
+    """Error response unless the request carries the admin key in X-Admin-Key, else None"""
+    if not ADMIN_API_KEY:
+        return jsonify({'error': 'Admin API is not enabled'}), 404
+    supplied = request.headers.get('X-Admin-Key', '').encode('utf-8')
+    if not hmac.compare_digest(supplied, ADMIN_API_KEY.encode('utf-8')):
+        return jsonify({'error': 'Invalid admin key'}), 401
+    return None
+
+def _month_range():
+    """(start, end) from ?start=YYYY-MM&end=YYYY-MM (each defaults to this month), or None if malformed"""
+    current_month = datetime.now().strftime('%Y-%m')
+    start = request.args.get('start', current_month)
+    end = request.args.get('end', start if 'start' in request.args else current_month)
+    if not MONTH_PATTERN.match(start) or not MONTH_PATTERN.match(end) or start > end:
+        return None
+    return start, end
+
+def _page_limit(default):
+    """?limit= clamped to 1..ADMIN_PAGE_MAX_LIMIT"""
+    return min(max(request.args.get('limit', default, type=int), 1), ADMIN_PAGE_MAX_LIMIT)
+
+@app.route('/api/admin/usage', methods=['GET'])
+def admin_usage():
+    """Per-user usage over a month range, paginated by user_id (?after=<last user_id>)"""
+    error = _admin_error()
+    if error:
+        return error
+    months = _month_range()
+    if not months:
+        return jsonify({'error': 'start and end must be YYYY-MM months, start <= end'}), 400
+    
+    try:
+        limit = _page_limit(100)
+        usage = usage_tracker.get_usage_page(*months, limit=limit, after=request.args.get('after'))
+        return jsonify({
+            'success': True,
+            'start': months[0],
+            'end': months[1],
+            'usage': usage,
+            # None on the last page
+            'next_after': usage[-1]['user_id'] if len(usage) == limit else None
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/usage/top', methods=['GET'])
+def admin_top_users():
+    """Top users over a month range (?by=audio_minutes|analysis_count|..., ?limit=, ?offset=)"""
+    error = _admin_error()
+    if error:
+        return error
+    months = _month_range()
+    if not months:
+        return jsonify({'error': 'start and end must be YYYY-MM months, start <= end'}), 400
+    order_by = request.args.get('by', 'audio_minutes')
+    if order_by not in INCREMENT_FIELDS:
+        return jsonify({'error': f"by must be one of {', '.join(INCREMENT_FIELDS)}"}), 400
+    
+    try:
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        users = usage_tracker.get_top_users(*months, order_by=order_by, limit=_page_limit(10), offset=offset)
+        return jsonify({'success': True, 'start': months[0], 'end': months[1], 'by': order_by, 'users': users})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/usage/months', methods=['GET'])
+def admin_monthly_totals():
+    """Precomputed usage totals per month"""
+    error = _admin_error()
+    if error:
+        return error
+    months = _month_range()
+    if not months:
+        return jsonify({'error': 'start and end must be YYYY-MM months, start <= end'}), 400
+    
+    try:
+        return jsonify({'success': True, 'months': usage_tracker.get_monthly_totals(*months)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/usage/plans', methods=['GET'])
+def admin_plan_totals():
+    """Usage totals per plan over a month range"""
+    error = _admin_error()
+    if error:
+        return error
+    months = _month_range()
+    if not months:
+        return jsonify({'error': 'start and end must be YYYY-MM months, start <= end'}), 400
+    
+    try:
+        plans = usage_tracker.get_plan_totals(*months)
+        return jsonify({'success': True, 'start': months[0], 'end': months[1], 'plans': plans})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/users/<user_id>/plan', methods=['PUT'])
+def admin_set_plan(user_id):
+    """Assign a user's plan (JSON {"plan": "..."})"""
+    error = _admin_error()
+    if error:
+        return error
+    plan = (request.get_json(silent=True) or {}).get('plan')
+    if not isinstance(plan, str) or not plan.strip():
+        return jsonify({'error': 'No plan provided'}), 400
+    
+    try:
+        usage_tracker.set_user_plan(user_id, plan.strip())
+        return jsonify({'success': True, 'user_id': user_id, 'plan': plan.strip()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/usage.csv', methods=['GET'])
+def admin_usage_csv():
+    """Stream per-user usage over a month range as CSV, read a page at a time"""
+    error = _admin_error()
+    if error:
+        return error
+    months = _month_range()
+    if not months:
+        return jsonify({'error': 'start and end must be YYYY-MM months, start <= end'}), 400
+    
+    columns = ['user_id', 'plan', 'audio_minutes', 'analysis_count', 'trimmed_minutes', 'cached_minutes',
+               'last_updated']
+    
+    def generate():
+        line = io.StringIO()
+        writer = csv.DictWriter(line, fieldnames=columns)
+        
+        def take():
+            value = line.getvalue()
+            line.seek(0)
+            line.truncate()
+            return value
+        
+        writer.writeheader()
+        yield take()
+        for row in usage_tracker.iter_usage(*months):
+            writer.writerow(row)
+            yield take()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            'Content-Disposition': f'attachment; filename="usage_{months[0]}_{months[1]}.csv"'
+        }
+    )
+
+def _job_status_payload(job, include_result=False):
+    """Build the public status payload for a job (the result is fetched separately)"""
+    response = {
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'message': job['message'],
+        'created_at': job['created_at'].isoformat(),
+        'updated_at': job['updated_at'].isoformat()
+    }
+    
+    if job['duration_seconds'] is not None:
+        response['duration_seconds'] = round(job['duration_seconds'], 2)
+    
+    if job['status'] == 'complete':
+        response['result_url'] = f"/api/job-result/{job['job_id']}"
+        
+        # Only pushed once, on the final SSE event
+        if include_result:
+            result = job_queue.get_result(job['job_id'])
+            if result:
+                response['result'] = result
+    
+    # Include error if failed or timed out
+    if job['status'] in ('error', 'timeout') and job['error']:
+        response['error'] = job['error']
+    
+    return response
+
 @app.route('/api/job-status/<job_id>', methods=['GET'])
 def get_job_status(job_id):
     """Get status of async processing job"""
@@ -137,243 +656,219 @@ def get_job_status(job_id):
         job = job_queue.get_job(job_id)
         
         if not job:
+            # Job may be owned by another worker or waiting to be resumed after a restart
+            checkpoint = checkpoint_store.load(job_id)
+            if checkpoint:
+                return jsonify({
+                    'job_id': job_id,
+                    'status': 'processing',
+                    'progress': STAGE_PROGRESS.get(checkpoint['stage'], 0),
+                    'message': 'Processing...'
+                })
             return jsonify({'error': 'Job not found'}), 404
         
-        # Return job status
-        response = {
-            'job_id': job['job_id'],
-            'status': job['status'],
-            'progress': job['progress'],
-            'message': job['message'],
-            'created_at': job['created_at'].isoformat(),
-            'updated_at': job['updated_at'].isoformat()
-        }
-        
-        # Include result if complete
-        if job['status'] == 'complete' and job['result']:
-            response['result'] = job['result']
+        # Payload only changes when the job's version does, so clients can revalidate cheaply
+        response = jsonify(_job_status_payload(job))
+        response.set_etag(f"{job_id}-{job['version']}")
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/job-result/<job_id>', methods=['GET'])
+def get_job_result(job_id):
+    """Get the full result (transcript and analysis) of a completed job"""
+    try:
+        job = job_queue.get_job(job_id)
         
-        # Include error if failed
-        if job['status'] == 'error' and job['error']:
-            response['error'] = job['error']
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
         
-        return jsonify(response)
+        stored = job_queue.get_stored_result(job_id)
+        if job['status'] != 'complete' or stored is None:
+            return jsonify({
+                'error': 'Job has no result yet',
+                'status': job['status']
+            }), 409
+        
+        # Results are stored gzip-compressed, so gzip clients get the bytes as they are
+        body = stored.compressed_bytes()
+        gzip_accepted = request.accept_encodings['gzip'] > 0
+        if not gzip_accepted:
+            body = gzip.decompress(body)
+        
+        response = Response(body, mimetype='application/json')
+        if gzip_accepted:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+        
+        # A finished job's result never changes; each encoding is its own representation with its own ETag
+        response.set_etag(f"{job_id}-{job['version']}{'-gz' if gzip_accepted else ''}")
+        response.headers['Cache-Control'] = f"private, max-age={JOB_TTL_COMPLETE_SECONDS}, immutable"
+        return response.make_conditional(request)
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/export-pdf', methods=['POST'])
-def export_pdf():
-    """Generate and download PDF report of analysis"""
+@app.route('/api/job-segments/<job_id>', methods=['GET'])
+def get_job_segments(job_id):
+    """
+    Timed transcript segments of a completed job
+    ?start=&end= (seconds) returns the segments overlapping that range; ?char= maps a
+    character offset in the concatenated segment text to a timestamp.
+    """
     try:
-        data = request.get_json()
-        analysis = data.get('analysis', {})
-        transcript = data.get('transcript', '')
+        job = job_queue.get_job(job_id)
         
-        if not analysis:
-            return jsonify({'error': 'No analysis data provided'}), 400
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
         
-        # Create PDF in memory
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.5*inch, bottomMargin=0.5*inch)
-        story = []
-        styles = getSampleStyleSheet()
-        
-        # Custom styles
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor=colors.HexColor('#3d5a4a'),
-            spaceAfter=12,
-            alignment=TA_CENTER,
-            fontName='Helvetica-Bold'
-        )
+        segments = segment_store.open(job_id) if job['status'] == 'complete' else None
+        if segments is None:
+            return jsonify({
+                'error': 'Job has no segments yet',
+                'status': job['status']
+            }), 409
         
-        heading_style = ParagraphStyle(
-            'CustomHeading',
-            parent=styles['Heading2'],
-            fontSize=16,
-            textColor=colors.HexColor('#3d5a4a'),
-            spaceAfter=10,
-            spaceBefore=15,
-            fontName='Helvetica-Bold'
-        )
+        start = request.args.get('start', 0.0, type=float)
+        end = request.args.get('end', float('inf'), type=float)
+        char_offset = request.args.get('char', type=int)
         
-        subheading_style = ParagraphStyle(
-            'CustomSubHeading',
-            parent=styles['Heading3'],
-            fontSize=13,
-            textColor=colors.HexColor('#5d7a68'),
-            spaceAfter=8,
-            spaceBefore=10,
-            fontName='Helvetica-Bold'
-        )
+        with segments:
+            if char_offset is not None:
+                return jsonify({
+                    'success': True,
+                    'job_id': job_id,
+                    'char': char_offset,
+                    'time': segments.time_at_char(char_offset)
+                })
+            
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'total_segments': len(segments),
+                'segments': segments.slice_time(start, end)
+            })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/job/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or processing job"""
+    try:
+        job = job_queue.get_job(job_id)
         
-        body_style = ParagraphStyle(
-            'CustomBody',
-            parent=styles['BodyText'],
-            fontSize=10,
-            leading=14,
-            textColor=colors.HexColor('#2d4a3a')
-        )
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
         
-        # Title
-        story.append(Paragraph('Seller Motivation Analysis Report', title_style))
-        story.append(Paragraph(f'Generated: {datetime.now().strftime("%B %d, %Y at %I:%M %p")}', body_style))
-        story.append(Spacer(1, 0.3*inch))
-        
-        # Motivation Score
-        score_data = [[
-            Paragraph('<b>Motivation Score</b>', heading_style),
-            Paragraph(f'<b>{analysis.get("overall_score", "N/A")}/10</b>', heading_style)
-        ], [
-            Paragraph('Motivation Level', body_style),
-            Paragraph(analysis.get('motivation_level', 'N/A'), body_style)
-        ], [
-            Paragraph('Confidence', body_style),
-            Paragraph(f'{analysis.get("confidence", "N/A")}%', body_style)
-        ]]
-        
-        score_table = Table(score_data, colWidths=[3*inch, 3*inch])
-        score_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#5d7a68')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#f0f5f0')),
-            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#c8d4c8')),
-            ('PADDING', (0, 0), (-1, -1), 12),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ]))
-        story.append(score_table)
-        story.append(Spacer(1, 0.2*inch))
-        
-        # Deal Numbers Summary
-        if 'deal_numbers' in analysis and analysis['deal_numbers'].get('fields_extracted', 0) > 0:
-            story.append(Paragraph('Deal Numbers Summary', heading_style))
-            deal_numbers = analysis['deal_numbers']
-            extracted = deal_numbers.get('extracted', {})
-            calculated = deal_numbers.get('calculated', {})
-            
-            deal_data = []
-            
-            # Financial Obligations
-            if any([extracted.get('mortgage_balance'), extracted.get('arrears'), extracted.get('monthly_payment')]):
-                deal_data.append([Paragraph('<b>Financial Obligations</b>', subheading_style), ''])
-                if extracted.get('mortgage_balance'):
-                    deal_data.append(['Mortgage Balance', f"${extracted['mortgage_balance']:,}"])
-                if extracted.get('arrears'):
-                    deal_data.append(['Arrears', f"${extracted['arrears']:,}"])
-                if extracted.get('monthly_payment'):
-                    deal_data.append(['Monthly Payment', f"${extracted['monthly_payment']:,}/mo"])
-                if calculated.get('total_payoff'):
-                    deal_data.append([Paragraph('<b>Total Payoff</b>', body_style), Paragraph(f"<b>${calculated['total_payoff']:,}</b>", body_style)])
+        if not job_queue.cancel_job(job_id):
+            return jsonify({
+                'error': f"Job already finished with status '{job['status']}'",
+                'status': job['status']
+            }), 409
+        
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status': 'cancelled'
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/job-events/<job_id>', methods=['GET'])
+def get_job_events(job_id):
+    """Stream job progress and the final result as Server-Sent Events"""
+    if not job_queue.get_job(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+    
+    # Event IDs are job versions, so a reconnecting client only gets what it missed
+    try:
+        last_version = int(request.headers.get('Last-Event-ID', -1))
+    except ValueError:
+        last_version = -1
+    
+    def generate():
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        version = last_version
+        stream_deadline = time.monotonic() + SSE_MAX_STREAM_SECONDS
+        
+        while time.monotonic() < stream_deadline:
+            job = job_queue.wait_for_change(job_id, version, timeout=SSE_HEARTBEAT_SECONDS)
             
-            # Property Details
-            if any([extracted.get('bedrooms'), extracted.get('bathrooms'), extracted.get('square_feet'), extracted.get('estimated_value')]):
-                deal_data.append([Paragraph('<b>Property Details</b>', subheading_style), ''])
-                if extracted.get('bedrooms'):
-                    deal_data.append(['Bedrooms', str(extracted['bedrooms'])])
-                if extracted.get('bathrooms'):
-                    deal_data.append(['Bathrooms', str(extracted['bathrooms'])])
-                if extracted.get('square_feet'):
-                    deal_data.append(['Square Feet', f"{extracted['square_feet']:,} sq ft"])
-                if extracted.get('estimated_value'):
-                    deal_data.append(['Estimated Value', f"${extracted['estimated_value']:,}"])
+            if job is None:
+                yield f"event: failed\ndata: {json.dumps({'job_id': job_id, 'status': 'error', 'error': 'Job not found'})}\n\n"
+                return
             
-            # Seller Requirements
-            if extracted.get('seller_net_desired'):
-                deal_data.append([Paragraph('<b>Seller Requirements</b>', subheading_style), ''])
-                deal_data.append(['Net Proceeds Desired', f"${extracted['seller_net_desired']:,}"])
+            finished = job['status'] in FINISHED_STATUSES
+            if job['version'] == version and not finished:
+                # Comment line keeps proxies from closing an idle connection
+                yield ": heartbeat\n\n"
+                continue
             
-            # Quick Math
-            if calculated.get('equity_available') is not None:
-                deal_data.append([Paragraph('<b>Quick Math</b>', subheading_style), ''])
-                if calculated.get('minimum_offer'):
-                    deal_data.append(['Minimum Offer', f"${calculated['minimum_offer']:,}"])
-                deal_data.append([Paragraph('<b>Equity Available</b>', body_style), Paragraph(f"<b>${calculated['equity_available']:,}</b>", body_style)])
+            version = job['version']
+            if job['status'] == 'complete':
+                event = 'complete'
+            elif finished:
+                event = 'failed'
+            else:
+                event = 'progress'
             
-            if deal_data:
-                deal_table = Table(deal_data, colWidths=[3*inch, 3*inch])
-                deal_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, -1), colors.white),
-                    ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#e8ede8')),
-                    ('PADDING', (0, 0), (-1, -1), 10),
-                    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                ]))
-                story.append(deal_table)
-                story.append(Spacer(1, 0.2*inch))
-        
-        # Key Insights
-        if analysis.get('insights'):
-            story.append(Paragraph('Key Insights', heading_style))
-            for insight in analysis['insights']:
-                story.append(Paragraph(f'• {insight}', body_style))
-                story.append(Spacer(1, 0.1*inch))
-            story.append(Spacer(1, 0.1*inch))
-        
-        # Timeline Urgency
-        if analysis.get('timeline_urgency'):
-            story.append(Paragraph('Timeline Urgency', heading_style))
-            story.append(Paragraph(analysis['timeline_urgency'], body_style))
-            story.append(Spacer(1, 0.2*inch))
-        
-        # Pain Points
-        if analysis.get('pain_points'):
-            story.append(Paragraph('Pain Points', heading_style))
-            for point in analysis['pain_points']:
-                story.append(Paragraph(f'• {point}', body_style))
-                story.append(Spacer(1, 0.1*inch))
-            story.append(Spacer(1, 0.1*inch))
-        
-        # Negotiation Strategy
-        if analysis.get('negotiation_strategy'):
-            story.append(Paragraph('Negotiation Strategy', heading_style))
-            for strategy in analysis['negotiation_strategy']:
-                story.append(Paragraph(f'• {strategy}', body_style))
-                story.append(Spacer(1, 0.1*inch))
-            story.append(Spacer(1, 0.1*inch))
-        
-        # Recommended Offer Approach
-        if analysis.get('recommended_offer_approach'):
-            story.append(Paragraph('Recommended Offer Approach', heading_style))
-            offer = analysis['recommended_offer_approach']
-            offer_data = []
-            if offer.get('offer_range'):
-                offer_data.append(['Offer Range', offer['offer_range']])
-            if offer.get('closing_timeline'):
-                offer_data.append(['Closing Timeline', offer['closing_timeline']])
-            if offer.get('terms'):
-                offer_data.append(['Terms', offer['terms']])
-            if offer.get('presentation_style'):
-                offer_data.append(['Presentation Style', offer['presentation_style']])
+            yield f"id: {version}\nevent: {event}\ndata: {json.dumps(_job_status_payload(job, include_result=True))}\n\n"
             
-            if offer_data:
-                offer_table = Table(offer_data, colWidths=[2*inch, 4*inch])
-                offer_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f0f8f0')),
-                    ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#c8d4c8')),
-                    ('PADDING', (0, 0), (-1, -1), 10),
-                    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                ]))
-                story.append(offer_table)
-                story.append(Spacer(1, 0.2*inch))
-        
-        # Red Flags
-        if analysis.get('red_flags'):
-            story.append(Paragraph('Red Flags & Concerns', heading_style))
-            for flag in analysis['red_flags']:
-                story.append(Paragraph(f'⚠ {flag}', body_style))
-                story.append(Spacer(1, 0.1*inch))
-        
-        # Build PDF
-        doc.build(story)
-        buffer.seek(0)
+            if finished:
+                return
+        
+        # Stream is recycled periodically; the client reconnects with Last-Event-ID
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Get in-process service metrics (job queue size and memory held)"""
+    try:
+        return jsonify({
+            'success': True,
+            'jobs': job_queue.get_stats(),
+            'webhooks': webhook_queue.get_stats(),
+            'uploads': dict(StreamingRequest.limiter.get_stats(), disk=upload_janitor.get_stats()),
+            'job_files': {name: janitor.get_stats() for name, janitor in job_file_janitors.items()},
+            'transcription_cache': transcription_cache.get_stats(),
+            'usage': usage_tracker.get_stats(),
+            'rate_limits': rate_limiter.get_stats(),
+            'pdf_cache': report_cache.get_stats()
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/export-pdf', methods=['POST'])
+def export_pdf():
+    """Generate and download PDF report of analysis"""
+    try:
+        data = request.get_json()
+        analysis = data.get('analysis', {})
+        transcript = data.get('transcript', '')
+        
+        if not analysis:
+            return jsonify({'error': 'No analysis data provided'}), 400
+        
+        # Styles are shared and repeat exports of the same analysis within a minute come from the report cache
+        pdf = render_report(analysis)
         
         # Generate filename
         filename = f"seller_motivation_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
         
         return send_file(
-            buffer,
+            io.BytesIO(pdf),
             mimetype='application/pdf',
             as_attachment=True,
             download_name=filename
@@ -1109,6 +1604,71 @@ Seller: We need to close within 30 days if possible. The house needs some work b
             }
         }
         
+        function applyJobUpdate(job) {
+            // Show job progress; returns true/false once the job has finished, null while it is running
+            const loadingText = document.querySelector('#loading p');
+            if (loadingText) {
+                loadingText.textContent = `${job.message} (${job.progress}%)`;
+            }
+            
+            if (job.status === 'complete' && job.result) {
+                // Job finished successfully
+                const result = job.result;
+                displayResults(result.analysis, result.transcript);
+                
+                if (result.usage_stats) {
+                    updateUsageDisplay(result.usage_stats);
+                }
+                
+                if (result.audio_duration_minutes) {
+                    console.log(`Audio transcribed: ${result.audio_duration_minutes.toFixed(1)} minutes`);
+                }
+                
+                return true;
+            } else if (job.status === 'error' || job.status === 'timeout') {
+                // Job failed
+                alert('Error: ' + (job.error || 'Unknown error occurred'));
+                return false;
+            } else if (job.status === 'cancelled') {
+                return false;
+            }
+            
+            return null;
+        }
+        
+        function watchJob(jobId) {
+            // Receive progress pushed by the server; fall back to polling if streaming is unavailable
+            if (!window.EventSource) {
+                return pollJobStatus(jobId);
+            }
+            
+            return new Promise(resolve => {
+                const source = new EventSource(`/api/job-events/${jobId}`);
+                let finished = false;
+                
+                const onJobEvent = (event) => {
+                    const outcome = applyJobUpdate(JSON.parse(event.data));
+                    if (outcome !== null) {
+                        finished = true;
+                        source.close();
+                        resolve(outcome);
+                    }
+                };
+                
+                source.addEventListener('progress', onJobEvent);
+                source.addEventListener('complete', onJobEvent);
+                source.addEventListener('failed', onJobEvent);
+                
+                source.onerror = () => {
+                    // The browser reconnects by itself (sending Last-Event-ID); poll only if it gave up
+                    if (!finished && source.readyState === EventSource.CLOSED) {
+                        finished = true;
+                        pollJobStatus(jobId).then(resolve);
+                    }
+                };
+            });
+        }
+        
         async function pollJobStatus(jobId) {
             // Poll job status every 3 seconds
             const maxAttempts = 120; // 6 minutes max
@@ -1119,30 +1679,15 @@ Seller: We need to close within 30 days if possible. The house needs some work b
                     const response = await fetch(`/api/job-status/${jobId}`);
                     const job = await response.json();
                     
-                    // Update loading message with progress
-                    const loadingText = document.querySelector('#loading p');
-                    if (loadingText) {
-                        loadingText.textContent = `${job.message} (${job.progress}%)`;
+                    // Status polls are lightweight; the result is downloaded once
+                    if (job.status === 'complete' && job.result_url) {
+                        const resultResponse = await fetch(job.result_url);
+                        job.result = await resultResponse.json();
                     }
                     
-                    if (job.status === 'complete' && job.result) {
-                        // Job finished successfully
-                        const result = job.result;
-                        displayResults(result.analysis, result.transcript);
-                        
-                        if (result.usage_stats) {
-                            updateUsageDisplay(result.usage_stats);
-                        }
-                        
-                        if (result.audio_duration_minutes) {
-                            console.log(`Audio transcribed: ${result.audio_duration_minutes.toFixed(1)} minutes`);
-                        }
-                        
-                        return true;
-                    } else if (job.status === 'error') {
-                        // Job failed
-                        alert('Error: ' + (job.error || 'Unknown error occurred'));
-                        return false;
+                    const outcome = applyJobUpdate(job);
+                    if (outcome !== null) {
+                        return outcome;
                     }
                     
                     // Job still processing, wait and try again
@@ -1161,6 +1706,15 @@ Seller: We need to close within 30 days if possible. The house needs some work b
             return false;
         }
         
+        // Job currently being processed, cancelled if the user leaves the page
+        let activeJobId = null;
+        
+        window.addEventListener('pagehide', function() {
+            if (activeJobId) {
+                fetch(`/api/job/${activeJobId}`, { method: 'DELETE', keepalive: true });
+            }
+        });
+        
         async function analyzeMotivation() {
             const audioFile = document.getElementById('audioFile').files[0];
             const transcript = document.getElementById('transcriptText').value.trim();
@@ -1182,10 +1736,11 @@ Seller: We need to close within 30 days if possible. The house needs some work b
                 if (audioFile) {
                     // Upload and analyze audio (async)
                     const formData = new FormData();
-                    formData.append('audio', audioFile);
                     formData.append('user_id', userId);
+                    formData.append('audio', audioFile);
                     
-                    response = await fetch('/api/analyze-audio', {
+                    // user_id also goes in the URL so upload limits apply while the file streams
+                    response = await fetch(`/api/analyze-audio?user_id=${encodeURIComponent(userId)}`, {
                         method: 'POST',
                         body: formData
                     });
@@ -1198,8 +1753,10 @@ Seller: We need to close within 30 days if possible. The house needs some work b
                     }
                     
                     if (response.status === 202 && data.job_id) {
-                        // Audio processing started, poll for results
-                        await pollJobStatus(data.job_id);
+                        // Audio processing started, wait for results
+                        activeJobId = data.job_id;
+                        await watchJob(data.job_id);
+                        activeJobId = null;
                     } else if (data.success) {
                         // Immediate success (shouldn't happen with new async flow)
                         displayResults(data.analysis, data.transcript);
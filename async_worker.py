@@ -2,11 +2,134 @@
 Async worker for processing audio files in background
 """
 import os
+import copy
+import time
 import threading
 from datetime import datetime
+from functools import partial
+
+import httpx
+
+from cancellable_http import CancellableTransport
+from job_checkpoints import (checkpoint_store, STAGE_UPLOADED, STAGE_TRIMMED, STAGE_COMPRESSED,
+                             STAGE_TRANSCRIBED, STAGE_ANALYZED)
+from audio_processing import VAD_ENABLED, trim_silence, remap_segments, transcode_for_upload, transcode_output_path
+from transcription import should_chunk, transcribe_chunked, chunk_dir
+from transcription_backends import transcription_backend
+from transcription_cache import transcription_cache
+from segment_store import segment_store
+from upload_janitor import track_upload_file
 from job_queue import job_queue
 
-def process_audio_async(job_id, filepath, user_id, analyzer, usage_tracker, app_config):
+# Hard deadline per processing stage, in seconds
+STAGE_TIMEOUTS = {
+    'trim': int(os.environ.get('STAGE_TIMEOUT_TRIM_SECONDS', 300)),
+    'compress': int(os.environ.get('STAGE_TIMEOUT_COMPRESS_SECONDS', 300)),
+    'transcribe': int(os.environ.get('STAGE_TIMEOUT_TRANSCRIBE_SECONDS', 300)),
+    'analyze': int(os.environ.get('STAGE_TIMEOUT_ANALYZE_SECONDS', 180)),
+}
+
+# How often a waiting worker re-checks for cancellation
+CANCEL_CHECK_INTERVAL_SECONDS = 0.5
+
+MAX_FILE_SIZE_MB = 24  # Stay under 25MB limit with buffer
+
+
+class JobCancelled(Exception):
+    """Raised in the worker when its job has been cancelled"""
+
+
+class StageTimeout(Exception):
+    """Raised in the worker when a stage runs past its deadline"""
+
+
+def run_stage(job_id, stage, func, *args, abort=None, **kwargs):
+    """
+    Run one processing stage, giving up on cancellation or when its deadline passes
+    
+    The stage runs in a helper thread so the worker is freed immediately. If it is
+    abandoned, abort() is called (e.g. to cut in-flight HTTP requests).
+    """
+    cancel_event = job_queue.get_cancel_event(job_id)
+    if cancel_event is None or cancel_event.is_set():
+        raise JobCancelled()
+    
+    outcome = {}
+    done = threading.Event()
+    
+    def target():
+        try:
+            outcome['value'] = func(*args, **kwargs)
+        except BaseException as e:
+            outcome['error'] = e
+        finally:
+            done.set()
+    
+    threading.Thread(target=target, name=f"{stage}-{job_id[:8]}", daemon=True).start()
+    
+    deadline = time.monotonic() + STAGE_TIMEOUTS[stage]
+    while not done.wait(CANCEL_CHECK_INTERVAL_SECONDS):
+        if cancel_event.is_set():
+            if abort:
+                abort()
+            raise JobCancelled()
+        if time.monotonic() > deadline:
+            if abort:
+                abort()
+            raise StageTimeout(f"{stage} stage exceeded {STAGE_TIMEOUTS[stage]}s")
+    
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['value']
+
+
+def _trim_audio(job_id, filepath):
+    """
+    Cut long silences out of the upload before it is sent to Whisper
+    Returns the path to transcribe and the trim summary (None if nothing was cut).
+    Trimming only saves time and money, so a failure falls back to the original file;
+    cancellation and the stage deadline still end the job.
+    """
+    trimmed_filepath = f"{os.path.splitext(filepath)[0]}_trimmed.wav"
+    # Registered up front so the janitor finds them if this process dies mid-stage
+    track_upload_file(trimmed_filepath)
+    track_upload_file(f"{trimmed_filepath}.pcm")
+    stop = threading.Event()
+    try:
+        trim = run_stage(job_id, 'trim', trim_silence, filepath, trimmed_filepath, stop, abort=stop.set)
+    except (JobCancelled, StageTimeout):
+        if os.path.exists(trimmed_filepath):
+            os.remove(trimmed_filepath)
+        raise
+    except Exception as e:
+        if os.path.exists(trimmed_filepath):
+            os.remove(trimmed_filepath)
+        print(f"Silence trimming skipped for job {job_id}: {str(e)}")
+        return filepath, None
+    
+    if trim is None:
+        return filepath, None
+    
+    os.remove(filepath)
+    return trimmed_filepath, trim
+
+
+def _compress_audio(job_id, filepath, duration_seconds=None):
+    """Re-encode audio at a lower bitrate so it fits the Whisper upload limit"""
+    track_upload_file(transcode_output_path(filepath))
+    stop = threading.Event()
+    transcoded = run_stage(job_id, 'compress', transcode_for_upload, filepath,
+                           MAX_FILE_SIZE_MB * 1024 * 1024, duration_seconds, stop, abort=stop.set)
+    print(f"Compressed job {job_id} to {transcoded['codec']} {transcoded['bitrate_kbps']}k "
+          f"({transcoded['bytes'] / (1024 * 1024):.1f}MB)")
+    
+    # Remove original, use compressed
+    os.remove(filepath)
+    return transcoded['path']
+
+
+def process_audio_async(job_id, filepath, user_id, analyzer, usage_tracker, app_config,
+                        checkpoint=None, lock=None):
     """
     Process audio file asynchronously in background thread
     
@@ -17,83 +140,212 @@ def process_audio_async(job_id, filepath, user_id, analyzer, usage_tracker, app_
         analyzer: EnhancedMotivationAnalyzer instance
         usage_tracker: UsageTracker instance
         app_config: Flask app config dict
+        checkpoint: Saved stage checkpoint to resume from (after a restart)
+        lock: Ownership lock from checkpoint_store.acquire(), released when done
     """
+    checkpoint = checkpoint or {
+        'job_id': job_id,
+        'user_id': user_id,
+        'stage': STAGE_UPLOADED,
+        'filepath': filepath
+    }
+    filepath = checkpoint['filepath']
+    
+    # Give this job its own HTTP transport so cancellation can abort its requests
+    transport = CancellableTransport()
+    job_analyzer = copy.copy(analyzer)
+    job_analyzer.client = analyzer.client.with_options(http_client=httpx.Client(transport=transport))
+    
     try:
-        # Update job status to processing
-        job_queue.update_job(job_id, status='processing', progress=10, 
-                            message='Checking file size and preparing audio...')
-        
-        # Get file size
-        file_size_mb = os.path.getsize(filepath) / (1024 * 1024)
-        
-        # Check if compression needed
-        MAX_FILE_SIZE_MB = 24  # Stay under 25MB limit with buffer
-        if file_size_mb > MAX_FILE_SIZE_MB:
-            job_queue.update_job(job_id, progress=20, 
-                                message='Compressing audio file...')
-            
-            from pydub import AudioSegment
-            filename = os.path.basename(filepath)
-            compressed_filepath = filepath.replace(filename, f"compressed_{filename}").replace(filepath.split('.')[-1], 'mp3')
+        if checkpoint['stage'] == STAGE_UPLOADED:
+            # Update job status to processing
+            job_queue.update_job(job_id, status='processing', progress=10, 
+                                message='Checking file size and preparing audio...')
+        
+            # The same recording was transcribed before: skip trimming, compression and Whisper
+            cached = transcription_cache.get(checkpoint.get('audio_sha256'), transcription_backend.name)
+            if cached:
+                checkpoint.update(
+                    stage=STAGE_TRANSCRIBED,
+                    transcript=cached['transcript'],
+                    segments=cached['segments'],
+                    duration_minutes=cached['duration_minutes'],
+                    cached=True,
+                    usage_recorded=False
+                )
+                checkpoint_store.save(job_id, checkpoint)
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+        
+        if checkpoint['stage'] == STAGE_UPLOADED:
+            trim = None
+            if VAD_ENABLED:
+                job_queue.update_job(job_id, progress=15, message='Removing silence and dead air...')
+                filepath, trim = _trim_audio(job_id, filepath)
             
-            # Load audio and export with lower bitrate
-            audio = AudioSegment.from_file(filepath)
-            duration_seconds = len(audio) / 1000
-            target_bitrate = int((MAX_FILE_SIZE_MB * 1024 * 8) / duration_seconds)
-            target_bitrate = min(target_bitrate, 64)
+            checkpoint.update(stage=STAGE_TRIMMED, filepath=filepath, trim=trim)
+            checkpoint_store.save(job_id, checkpoint)
+        
+        if checkpoint['stage'] == STAGE_TRIMMED:
+            # Get file size
+            file_size_mb = os.path.getsize(filepath) / (1024 * 1024)
+            trim = checkpoint.get('trim')
+            duration_seconds = trim['trimmed_seconds'] if trim else checkpoint.get('duration_seconds')
             
-            audio.export(compressed_filepath, format="mp3", bitrate=f"{target_bitrate}k")
+            # Long recordings are split and transcribed in parallel rather than squeezed into one request
+            # (a local model takes any length, so this only applies to the API)
+            if transcription_backend.size_limited and should_chunk(duration_seconds, file_size_mb, MAX_FILE_SIZE_MB):
+                checkpoint['chunked'] = True
+        
+            # Check if compression needed
+            elif transcription_backend.size_limited and file_size_mb > MAX_FILE_SIZE_MB:
+                job_queue.update_job(job_id, progress=20, 
+                                    message='Compressing audio file...')
             
-            # Remove original, use compressed
-            os.remove(filepath)
-            filepath = compressed_filepath
+                filepath = _compress_audio(job_id, filepath, duration_seconds)
         
-        # Transcribe audio
-        job_queue.update_job(job_id, progress=30, 
-                            message='Transcribing audio with AI... This may take 1-2 minutes.')
+            checkpoint.update(stage=STAGE_COMPRESSED, filepath=filepath)
+            checkpoint_store.save(job_id, checkpoint)
         
-        with open(filepath, 'rb') as audio_data:
-            transcription = analyzer.client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_data,
-                response_format="verbose_json"
+        if checkpoint['stage'] == STAGE_COMPRESSED:
+            # Transcribe audio
+            job_queue.update_job(job_id, status='processing', progress=30, 
+                                message='Transcribing audio with AI... This may take 1-2 minutes.')
+        
+            stop = threading.Event()
+            
+            def abort_transcription():
+                stop.set()
+                transport.cancel()
+            
+            if checkpoint.get('chunked'):
+                track_upload_file(chunk_dir(filepath))
+                
+                def on_chunk(done, total):
+                    job_queue.update_job(job_id, progress=30 + 40 * done // total,
+                                         message=f'Transcribing audio with AI... ({done}/{total} parts done)')
+                
+                transcription = run_stage(job_id, 'transcribe', transcribe_chunked,
+                                          partial(transcription_backend.transcribe, client=job_analyzer.client),
+                                          filepath, on_chunk, stop, abort=abort_transcription)
+            else:
+                transcription = run_stage(job_id, 'transcribe', transcription_backend.transcribe, filepath,
+                                          job_analyzer.client, stop, abort=abort_transcription)
+        
+            # Timestamps refer to the trimmed audio; put them back on the original timeline
+            trim = checkpoint.get('trim')
+            segments = [
+                {'start': segment.start, 'end': segment.end, 'text': segment.text}
+                for segment in (transcription.segments or [])
+            ]
+            segments = remap_segments(segments, trim['offset_map'] if trim else None)
+            # Chunked transcriptions bill every chunk in full, overlaps included
+            billed_minutes = getattr(transcription, 'billed_duration', transcription.duration) / 60
+            
+            # Persist the transcript first so a restart never pays for Whisper twice
+            checkpoint.update(
+                stage=STAGE_TRANSCRIBED,
+                transcript=transcription.text,
+                segments=segments,
+                duration_minutes=billed_minutes,
+                usage_recorded=False
             )
+            checkpoint_store.save(job_id, checkpoint)
+            transcription_cache.put(checkpoint.get('audio_sha256'), transcription_backend.name, {
+                'transcript': transcription.text,
+                'segments': segments,
+                'duration_minutes': billed_minutes
+            })
         
-        transcript = transcription.text
-        actual_duration_minutes = transcription.duration / 60
+            # Clean up audio file
+            if os.path.exists(filepath):
+                os.remove(filepath)
         
-        # Record usage
-        usage_tracker.record_audio_usage(user_id, actual_duration_minutes)
+        transcript = checkpoint['transcript']
+        # What Whisper billed: the trimmed duration, with chunk overlaps counted twice
+        actual_duration_minutes = checkpoint['duration_minutes']
+        trim = checkpoint.get('trim')
+        saved_minutes = (trim['original_seconds'] - trim['trimmed_seconds']) / 60 if trim else 0.0
         
-        # Clean up audio file
-        if os.path.exists(filepath):
-            os.remove(filepath)
+        if not checkpoint['usage_recorded']:
+            # Settle the minutes reserved at submit to what was actually transcribed
+            # (a cached transcript cost nothing, so nothing is billed)
+            if checkpoint.get('cached'):
+                usage_tracker.commit_audio_reservation(job_id, user_id, 0.0, cached_minutes=actual_duration_minutes)
+            else:
+                usage_tracker.commit_audio_reservation(job_id, user_id, actual_duration_minutes,
+                                                       trimmed_minutes=saved_minutes)
+            checkpoint['usage_recorded'] = True
+            checkpoint_store.save(job_id, checkpoint)
         
-        # Analyze transcript
-        job_queue.update_job(job_id, progress=70, 
-                            message='Analyzing seller motivation...')
+        if checkpoint['stage'] == STAGE_TRANSCRIBED:
+            # Analyze transcript
+            job_queue.update_job(job_id, status='processing', progress=70, 
+                                message='Analyzing seller motivation...')
+            
+            analysis = run_stage(job_id, 'analyze', job_analyzer.analyze_transcript, transcript,
+                                 abort=transport.cancel)
+            
+            checkpoint.update(stage=STAGE_ANALYZED, analysis=analysis)
+            checkpoint_store.save(job_id, checkpoint)
         
-        analysis = analyzer.analyze_transcript(transcript)
+        analysis = checkpoint['analysis']
+        
+        # Timings are served from a compact, memory-mappable file (/api/job-segments), not the result
+        segments = checkpoint.get('segments', [])
+        segment_store.save(job_id, segments)
         
         # Get usage stats
         usage_stats = usage_tracker.get_usage_stats(user_id)
         
+        result = {
+            'success': True,
+            'transcript': transcript,
+            'segments_url': f"/api/job-segments/{job_id}",
+            'segment_count': len(segments),
+            'analysis': analysis,
+            'audio_duration_minutes': round(actual_duration_minutes, 2),
+            'transcription_cached': bool(checkpoint.get('cached')),
+            'usage_stats': usage_stats,
+            'timestamp': datetime.now().isoformat()
+        }
+        if trim:
+            result['audio_trim'] = {
+                'original_minutes': round(trim['original_seconds'] / 60, 2),
+                'trimmed_minutes': round(trim['trimmed_seconds'] / 60, 2),
+                'saved_minutes': round(saved_minutes, 2)
+            }
+        
         # Job complete
         job_queue.update_job(
             job_id, 
             status='complete', 
             progress=100,
-            message='Analysis complete!',
-            result={
-                'success': True,
-                'transcript': transcript,
-                'analysis': analysis,
-                'audio_duration_minutes': round(actual_duration_minutes, 2),
-                'usage_stats': usage_stats,
-                'timestamp': datetime.now().isoformat()
-            }
+            message=f'Analysis complete! Skipped {saved_minutes:.1f} minutes of silence.' if trim else 'Analysis complete!',
+            result=result
+        )
+        
+    except JobCancelled:
+        # Job status was already set to cancelled by whoever cancelled it
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        
+        print(f"Job {job_id} cancelled")
+    
+    except StageTimeout as e:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        
+        job_queue.update_job(
+            job_id,
+            status='timeout',
+            progress=0,
+            message='Processing took too long and was stopped',
+            error=str(e)
         )
         
+        print(f"Timeout in async worker for job {job_id}: {str(e)}")
+    
     except Exception as e:
         # Clean up file on error
         if os.path.exists(filepath):
@@ -109,24 +361,160 @@ def process_audio_async(job_id, filepath, user_id, analyzer, usage_tracker, app_
         )
         
         print(f"Error in async worker for job {job_id}: {str(e)}")
+    
+    finally:
+        transport.close()
+        # Failed or cancelled before usage was settled: give the reserved minutes back
+        usage_tracker.release_audio_reservation(job_id)
+        # Finished one way or another; nothing left to resume
+        checkpoint_store.delete(job_id)
+        checkpoint_store.release(lock)
 
 
-def start_async_job(filepath, user_id, analyzer, usage_tracker, app_config):
+def process_transcript_async(job_id, transcript, user_id, analyzer, usage_tracker=None):
+    """
+    Analyze a text transcript in the background (used for batch items)
+    
+    Args:
+        job_id: Unique job identifier
+        transcript: Conversation transcript text
+        user_id: User identifier
+        analyzer: EnhancedMotivationAnalyzer instance
+        usage_tracker: UsageTracker instance the analysis is recorded with (optional)
+    """
+    transport = CancellableTransport()
+    job_analyzer = copy.copy(analyzer)
+    job_analyzer.client = analyzer.client.with_options(http_client=httpx.Client(transport=transport))
+    
+    try:
+        job_queue.update_job(job_id, status='processing', progress=50,
+                             message='Analyzing seller motivation...')
+        
+        analysis = run_stage(job_id, 'analyze', job_analyzer.analyze_transcript, transcript,
+                             abort=transport.cancel)
+        if usage_tracker:
+            usage_tracker.record_analysis_usage(user_id)
+        
+        job_queue.update_job(
+            job_id,
+            status='complete',
+            progress=100,
+            message='Analysis complete!',
+            result={
+                'success': True,
+                'transcript': transcript,
+                'analysis': analysis,
+                'timestamp': datetime.now().isoformat()
+            }
+        )
+    
+    except JobCancelled:
+        print(f"Job {job_id} cancelled")
+    
+    except StageTimeout as e:
+        job_queue.update_job(job_id, status='timeout', progress=0,
+                             message='Processing took too long and was stopped', error=str(e))
+    
+    except Exception as e:
+        job_queue.update_job(job_id, status='error', progress=0,
+                             message='Error analyzing transcript', error=str(e))
+        
+        print(f"Error in async worker for job {job_id}: {str(e)}")
+    
+    finally:
+        transport.close()
+
+
+def start_async_job(filepath, user_id, analyzer, usage_tracker, app_config,
+                    job_id=None, idempotency_key=None, batch_id=None, executor=None,
+                    callback_url=None, duration_seconds=None, audio_sha256=None):
     """
     Start a new async processing job
     
+    Args:
+        job_id: Pre-allocated job ID (e.g. one already claimed for an idempotency key)
+        idempotency_key: Client-supplied key the job was submitted with
+        batch_id: Batch the job belongs to, if any
+        executor: Worker pool to run the job on (default: a dedicated thread)
+        callback_url: URL notified by webhook when the job finishes
+        duration_seconds: Audio duration probed at upload, if known
+        audio_sha256: SHA-256 of the uploaded bytes, used to reuse earlier transcripts
+    
     Returns:
         job_id: Unique job identifier
     """
     # Create job
-    job_id = job_queue.create_job(user_id)
+    job_id = job_queue.create_job(user_id, job_id=job_id, idempotency_key=idempotency_key,
+                                  batch_id=batch_id, callback_url=callback_url,
+                                  duration_seconds=duration_seconds)
+    
+    # Checkpoint the upload before returning so the job survives a restart
+    checkpoint = {
+        'job_id': job_id,
+        'user_id': user_id,
+        'idempotency_key': idempotency_key,
+        'callback_url': callback_url,
+        'duration_seconds': duration_seconds,
+        'audio_sha256': audio_sha256,
+        'stage': STAGE_UPLOADED,
+        'filepath': filepath
+    }
+    lock = checkpoint_store.acquire(job_id)
+    checkpoint_store.save(job_id, checkpoint)
+    
+    if executor is not None:
+        executor.submit(process_audio_async, job_id, filepath, user_id, analyzer,
+                        usage_tracker, app_config, checkpoint, lock)
+        return job_id
     
     # Start background thread
     thread = threading.Thread(
         target=process_audio_async,
-        args=(job_id, filepath, user_id, analyzer, usage_tracker, app_config),
+        args=(job_id, filepath, user_id, analyzer, usage_tracker, app_config, checkpoint, lock),
         daemon=True
     )
     thread.start()
     
     return job_id
+
+
+def recover_jobs(analyzer, usage_tracker, app_config):
+    """
+    Requeue jobs left unfinished by a previous process, from their last completed stage
+    
+    Safe to call from every worker: a job is only taken by the process that wins its lock.
+    
+    Returns:
+        List of recovered job IDs
+    """
+    recovered = []
+    
+    for job_id in checkpoint_store.list_job_ids():
+        lock = checkpoint_store.acquire(job_id)
+        if lock is None:
+            # Still owned by a live process
+            continue
+        
+        checkpoint = checkpoint_store.load(job_id)
+        if checkpoint is None or job_queue.get_job(job_id):
+            checkpoint_store.release(lock)
+            continue
+        
+        job_queue.create_job(checkpoint['user_id'], job_id=job_id,
+                             idempotency_key=checkpoint.get('idempotency_key'),
+                             callback_url=checkpoint.get('callback_url'),
+                             duration_seconds=checkpoint.get('duration_seconds'))
+        job_queue.update_job(job_id, message='Resuming after restart...')
+        
+        thread = threading.Thread(
+            target=process_audio_async,
+            args=(job_id, checkpoint['filepath'], checkpoint['user_id'], analyzer,
+                  usage_tracker, app_config, checkpoint, lock),
+            daemon=True
+        )
+        thread.start()
+        
+        recovered.append(job_id)
+        print(f"Recovered job {job_id} from stage '{checkpoint['stage']}'")
+    
+    return recovered
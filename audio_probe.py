@@ -0,0 +1,286 @@
+"""
+Fast audio duration probing
+Reads the duration from container/codec headers (WAV, MP3, M4A/MP4, OGG/Opus,
+WebM/Matroska, FLAC) without decoding any audio. Falls back to ffprobe, which
+also only reads headers, for anything the parsers don't understand.
+"""
+import os
+import json
+import struct
+import subprocess
+from typing import BinaryIO, Optional
+
+FFPROBE_TIMEOUT_SECONDS = 10
+
+# How far from the end of an Ogg file to look for the last page
+OGG_TAIL_BYTES = 64 * 1024
+
+MP3_BITRATES = {
+    # (MPEG version 1?, layer) -> kbps by bitrate index
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+}
+MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def probe_duration(filepath: str) -> Optional[float]:
+    """
+    Duration of an audio file in seconds, or None if it can't be determined
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            head = f.read(12)
+            f.seek(0)
+            file_size = os.fstat(f.fileno()).st_size
+            
+            if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+                duration = _wav_duration(f, file_size)
+            elif head[4:8] == b'ftyp':
+                duration = _mp4_duration(f, file_size)
+            elif head[:4] == b'OggS':
+                duration = _ogg_duration(f, file_size)
+            elif head[:4] == b'\x1a\x45\xdf\xa3':
+                duration = _matroska_duration(f, file_size)
+            elif head[:4] == b'fLaC':
+                duration = _flac_duration(f)
+            elif head[:3] == b'ID3' or (head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+                duration = _mp3_duration(f, file_size)
+            else:
+                duration = None
+    except (OSError, struct.error, ValueError, IndexError):
+        duration = None
+    
+    if duration is None or duration <= 0:
+        duration = _ffprobe_duration(filepath)
+    return duration
+
+
+def _wav_duration(f: BinaryIO, file_size: int) -> Optional[float]:
+    f.seek(12)
+    byte_rate = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack('<4sI', header)
+        if chunk_id == b'fmt ':
+            fmt = f.read(chunk_size)
+            byte_rate = struct.unpack('<I', fmt[8:12])[0]
+            f.seek(chunk_size % 2, 1)
+        elif chunk_id == b'data':
+            if not byte_rate:
+                return None
+            # Streaming writers leave the size unset; use what's actually there
+            data_size = min(chunk_size, file_size - f.tell())
+            return data_size / byte_rate
+        else:
+            f.seek(chunk_size + chunk_size % 2, 1)
+
+
+def _mp4_duration(f: BinaryIO, file_size: int) -> Optional[float]:
+    # moov may sit at the end of the file; top-level atoms are skipped by size
+    moov = _find_atom(f, 0, file_size, b'moov')
+    if moov is None:
+        return None
+    mvhd = _find_atom(f, moov[0], moov[1], b'mvhd')
+    if mvhd is None:
+        return None
+    
+    f.seek(mvhd[0])
+    version = f.read(4)[0]
+    if version == 1:
+        _, _, timescale, duration = struct.unpack('>QQIQ', f.read(28))
+    else:
+        _, _, timescale, duration = struct.unpack('>IIII', f.read(16))
+    return duration / timescale if timescale else None
+
+
+def _find_atom(f: BinaryIO, start: int, end: int, name: bytes) -> Optional[tuple]:
+    """(payload start, payload end) of the first atom called name in [start, end)"""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        size, atom_type = struct.unpack('>I4s', f.read(8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return None
+        if atom_type == name:
+            return offset + header_size, offset + size
+        offset += size
+    return None
+
+
+def _ogg_duration(f: BinaryIO, file_size: int) -> Optional[float]:
+    first_page = f.read(512)
+    # Codec identification packet follows the 27-byte page header and segment table
+    segments = first_page[26]
+    packet = first_page[27 + segments:]
+    if packet.startswith(b'OpusHead'):
+        sample_rate = 48000
+        pre_skip = struct.unpack('<H', packet[10:12])[0]
+    elif packet.startswith(b'\x01vorbis'):
+        sample_rate = struct.unpack('<I', packet[12:16])[0]
+        pre_skip = 0
+    elif packet.startswith(b'\x7fFLAC'):
+        sample_rate = struct.unpack('>I', packet[27:31])[0] >> 12
+        pre_skip = 0
+    else:
+        return None
+    
+    f.seek(max(0, file_size - OGG_TAIL_BYTES))
+    tail = f.read()
+    last_page = tail.rfind(b'OggS')
+    if last_page < 0 or not sample_rate:
+        return None
+    granule = struct.unpack('<q', tail[last_page + 6:last_page + 14])[0]
+    return max(0, granule - pre_skip) / sample_rate
+
+
+def _read_ebml_id(f: BinaryIO) -> Optional[int]:
+    first = f.read(1)
+    if not first:
+        return None
+    value = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 4 and not value & mask:
+        mask >>= 1
+        length += 1
+    if length > 4:
+        raise ValueError('Invalid EBML ID')
+    return int.from_bytes(first + f.read(length - 1), 'big')
+
+
+def _read_ebml_size(f: BinaryIO) -> Optional[int]:
+    first = f.read(1)
+    if not first:
+        raise ValueError('Truncated EBML size')
+    value = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not value & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError('Invalid EBML size')
+    size = int.from_bytes(bytes([value & (mask - 1)]) + f.read(length - 1), 'big')
+    # All ones means "unknown size" (live recordings)
+    if size == (1 << (7 * length)) - 1:
+        return None
+    return size
+
+
+def _matroska_duration(f: BinaryIO, file_size: int) -> Optional[float]:
+    SEGMENT, INFO, TIMECODE_SCALE, DURATION = 0x18538067, 0x1549A966, 0x2AD7B1, 0x4489
+    
+    def children(end):
+        while f.tell() < end:
+            element_id = _read_ebml_id(f)
+            if element_id is None:
+                return
+            size = _read_ebml_size(f)
+            start = f.tell()
+            yield element_id, start, size
+            if size is None:
+                return
+            f.seek(start + size)
+    
+    for element_id, start, size in children(file_size):
+        if element_id != SEGMENT:
+            continue
+        segment_end = file_size if size is None else start + size
+        for child_id, child_start, child_size in children(segment_end):
+            if child_id != INFO or child_size is None:
+                continue
+            timecode_scale = 1000000
+            duration = None
+            for info_id, info_start, info_size in children(child_start + child_size):
+                value = f.read(info_size)
+                f.seek(info_start)
+                if info_id == TIMECODE_SCALE:
+                    timecode_scale = int.from_bytes(value, 'big')
+                elif info_id == DURATION:
+                    duration = struct.unpack('>f' if info_size == 4 else '>d', value)[0]
+            # MediaRecorder output has no Duration; leave it to ffprobe
+            return duration * timecode_scale / 1e9 if duration else None
+    return None
+
+
+def _flac_duration(f: BinaryIO) -> Optional[float]:
+    f.seek(4)
+    header = f.read(4)
+    if header[0] & 0x7F != 0:
+        return None
+    info = f.read(18)
+    sample_rate = int.from_bytes(info[10:13], 'big') >> 4
+    total_samples = int.from_bytes(info[13:18], 'big') & 0xFFFFFFFFF
+    return total_samples / sample_rate if sample_rate and total_samples else None
+
+
+def _mp3_duration(f: BinaryIO, file_size: int) -> Optional[float]:
+    offset = 0
+    header = f.read(10)
+    if header[:3] == b'ID3':
+        # Synchsafe tag size, plus the optional footer
+        tag_size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        offset = 10 + tag_size + (10 if header[5] & 0x10 else 0)
+    
+    # Find the first frame sync within a small window
+    f.seek(offset)
+    window = f.read(64 * 1024)
+    for i in range(len(window) - 4):
+        if window[i] == 0xFF and window[i + 1] & 0xE0 == 0xE0:
+            frame = window[i:]
+            frame_offset = offset + i
+            version_bits = (frame[1] >> 3) & 0x03
+            layer = 4 - ((frame[1] >> 1) & 0x03)
+            bitrate_index = frame[2] >> 4
+            rate_index = (frame[2] >> 2) & 0x03
+            if version_bits == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+                continue
+            break
+    else:
+        return None
+    
+    mpeg1 = version_bits == 3
+    bitrate = MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version_bits][rate_index]
+    samples_per_frame = 384 if layer == 1 else (1152 if mpeg1 or layer == 2 else 576)
+    
+    # VBR files carry a Xing/Info or VBRI header with the frame count
+    channel_mode = frame[3] >> 6
+    side_info = (32 if channel_mode != 3 else 17) if mpeg1 else (17 if channel_mode != 3 else 9)
+    xing = frame[4 + side_info:4 + side_info + 12]
+    if xing[:4] in (b'Xing', b'Info') and struct.unpack('>I', xing[4:8])[0] & 0x01:
+        frames = struct.unpack('>I', xing[8:12])[0]
+        return frames * samples_per_frame / sample_rate
+    if frame[36:40] == b'VBRI':
+        frames = struct.unpack('>I', frame[50:54])[0]
+        return frames * samples_per_frame / sample_rate
+    
+    # Constant bitrate: duration follows from the audio payload size
+    audio_bytes = file_size - frame_offset
+    f.seek(-128, 2)
+    if f.read(3) == b'TAG':
+        audio_bytes -= 128
+    return audio_bytes * 8 / bitrate
+
+
+def _ffprobe_duration(filepath: str) -> Optional[float]:
+    try:
+        output = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'json', filepath],
+            capture_output=True, timeout=FFPROBE_TIMEOUT_SECONDS, check=True
+        ).stdout
+        return float(json.loads(output)['format']['duration'])
+    except (OSError, subprocess.SubprocessError, ValueError, KeyError, TypeError):
+        return None
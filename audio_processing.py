@@ -0,0 +1,326 @@
+"""
+Silence trimming and speech transcoding before transcription
+Audio is decoded by ffmpeg to a stream of 16 kHz mono PCM frames, scored with
+an energy-based voice activity detector, and long non-speech spans are cut out.
+An offset map records where each kept span came from so transcript timestamps
+can be mapped back to the original recording.
+Oversized uploads are re-encoded file-to-file by ffmpeg into a low-bitrate
+speech codec, so no decoded audio ever passes through Python.
+"""
+import os
+import sys
+import math
+import wave
+import bisect
+import operator
+import threading
+import subprocess
+import tempfile
+import warnings
+from array import array
+from typing import BinaryIO, Dict, List, Optional
+
+from audio_probe import probe_duration
+
+try:
+    with warnings.catch_warnings():
+        # Deprecated in 3.11 and gone from 3.13, where the audioop-lts package provides it
+        warnings.simplefilter('ignore', DeprecationWarning)
+        import audioop
+except ImportError:
+    audioop = None
+
+VAD_ENABLED = os.environ.get('VAD_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# Silences shorter than this are natural pauses and are kept
+VAD_MIN_SILENCE_MS = int(os.environ.get('VAD_MIN_SILENCE_MS', 1000))
+# Audio kept on each side of a cut so word onsets and endings aren't clipped
+VAD_PADDING_MS = int(os.environ.get('VAD_PADDING_MS', 250))
+# A frame is speech when its energy is this many times the noise floor
+VAD_THRESHOLD_RATIO = float(os.environ.get('VAD_THRESHOLD_RATIO', 3.0))
+# Energy below which a frame is always silence (16-bit RMS)
+VAD_MIN_RMS = int(os.environ.get('VAD_MIN_RMS', 150))
+# Not worth re-encoding the file to save less than this
+VAD_MIN_SAVED_SECONDS = float(os.environ.get('VAD_MIN_SAVED_SECONDS', 5))
+
+# Codec for re-encoding oversized uploads: opus (Ogg) or mp3
+TRANSCODE_CODEC = os.environ.get('TRANSCODE_CODEC', 'opus').lower()
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+FRAME_MS = 30
+FRAME_BYTES = SAMPLE_RATE * FRAME_MS // 1000 * SAMPLE_WIDTH
+
+# Percentile of frame energies taken as the background noise level
+NOISE_FLOOR_PERCENTILE = 0.15
+
+# Speech bitrate range; 32k is transparent for 16 kHz mono, below 8k words get lost
+TRANSCODE_MIN_KBPS = 8
+TRANSCODE_MAX_KBPS = 32
+# Share of the size budget given to audio; the rest covers container overhead
+TRANSCODE_SIZE_HEADROOM = 0.95
+# Bitrate used when the duration can't be determined
+TRANSCODE_FALLBACK_KBPS = 16
+
+TRANSCODE_CODECS = {
+    # codec -> (extension, ffmpeg encoder arguments)
+    'opus': ('ogg', ['-c:a', 'libopus', '-vbr', 'constrained', '-application', 'voip']),
+    'mp3': ('mp3', ['-c:a', 'libmp3lame'])
+}
+
+
+class TrimCancelled(Exception):
+    pass
+
+
+class TranscodeCancelled(Exception):
+    pass
+
+
+def trim_silence(filepath: str, output_path: str, stop: Optional[threading.Event] = None) -> Optional[Dict]:
+    """
+    Write a copy of filepath with long silences removed to output_path (16 kHz mono WAV)
+    
+    Returns a summary with the offset map, or None when there is too little
+    silence to be worth it (output_path is not left behind in that case).
+    """
+    raw_path = f"{output_path}.pcm"
+    try:
+        energies = decode_frames(filepath, raw_path, stop)
+        keep = _speech_spans(energies)
+        
+        total_frames = len(energies)
+        kept_frames = sum(end - start for start, end in keep)
+        original_seconds = total_frames * FRAME_MS / 1000
+        trimmed_seconds = kept_frames * FRAME_MS / 1000
+        # All silence is left alone too; Whisper rejects empty audio
+        if not kept_frames or original_seconds - trimmed_seconds < VAD_MIN_SAVED_SECONDS:
+            return None
+        
+        offset_map = _write_spans(raw_path, output_path, keep, stop)
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+    
+    return {
+        'original_seconds': original_seconds,
+        'trimmed_seconds': trimmed_seconds,
+        'offset_map': offset_map
+    }
+
+
+def decode_frames(filepath: str, raw_path: str, stop: Optional[threading.Event] = None) -> array:
+    """Stream 16 kHz mono PCM from ffmpeg to raw_path, returning each frame's RMS"""
+    # Diagnostics go to a file: a pipe nobody reads until stdout ends would stall ffmpeg once it filled
+    errors = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        ['ffmpeg', '-v', 'error', '-nostdin', '-i', filepath,
+         '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), '-'],
+        stdout=subprocess.PIPE, stderr=errors
+    )
+    energies = array('H')
+    try:
+        with open(raw_path, 'wb') as raw:
+            while True:
+                if stop is not None and stop.is_set():
+                    raise TrimCancelled()
+                # Read many frames per syscall; score them one at a time
+                block = process.stdout.read(FRAME_BYTES * 256)
+                if not block:
+                    break
+                raw.write(block)
+                for offset in range(0, len(block) - FRAME_BYTES + 1, FRAME_BYTES):
+                    energies.append(min(_frame_rms(block[offset:offset + FRAME_BYTES]), 65535))
+                # The final partial frame is dropped from scoring and from the output
+                if len(block) % FRAME_BYTES:
+                    break
+        process.wait()
+        if process.returncode != 0:
+            errors.seek(0)
+            # A corrupt input can log an error per packet; the last ones say why it stopped
+            message = errors.read().decode(errors='replace').strip()[-2000:]
+            raise RuntimeError(f"ffmpeg failed to decode audio: {message}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        errors.close()
+    
+    return energies
+
+
+def _frame_rms(frame: bytes) -> int:
+    """RMS of 16-bit little-endian PCM, as audioop.rms computes it (in C, when audioop is available)"""
+    if audioop is not None:
+        return audioop.rms(frame, SAMPLE_WIDTH)
+    samples = array('h', frame)
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return math.isqrt(sum(map(operator.mul, samples, samples)) // len(samples)) if samples else 0
+
+
+def speech_threshold(energies: array) -> float:
+    """Frame energy above which a frame counts as speech for this recording"""
+    noise_floor = sorted(energies)[int(len(energies) * NOISE_FLOOR_PERCENTILE)]
+    return max(VAD_MIN_RMS, noise_floor * VAD_THRESHOLD_RATIO)
+
+
+def _speech_spans(energies: array) -> List[tuple]:
+    """[(start_frame, end_frame)] to keep: everything except padded long silences"""
+    if not energies:
+        return []
+    
+    threshold = speech_threshold(energies)
+    
+    padding = VAD_PADDING_MS // FRAME_MS
+    # A cut needs room for the padding on both sides
+    min_silence = max(VAD_MIN_SILENCE_MS // FRAME_MS, 2 * padding + 1)
+    
+    keep = []
+    span_start = 0
+    silence_start = None
+    for index, energy in enumerate(energies):
+        if energy < threshold:
+            if silence_start is None:
+                silence_start = index
+            continue
+        if silence_start is not None and index - silence_start >= min_silence:
+            # Cut the middle of the silence, leaving padding on each side
+            cut_start = silence_start + padding if silence_start else 0
+            if cut_start > span_start:
+                keep.append((span_start, cut_start))
+            span_start = index - padding
+        silence_start = None
+    
+    # Trailing silence (dead air after hang-up) goes too
+    end = len(energies)
+    if silence_start is not None and end - silence_start >= min_silence:
+        end = silence_start + padding if silence_start else 0
+    if end > span_start:
+        keep.append((span_start, end))
+    
+    return keep
+
+
+def _write_spans(raw_path: str, output_path: str, keep: List[tuple],
+                 stop: Optional[threading.Event]) -> List[List[float]]:
+    """Copy the kept frames into a WAV and return the offset map"""
+    offset_map = []
+    trimmed_frames = 0
+    with open(raw_path, 'rb') as raw, open_wav_writer(output_path) as out:
+        for start, end in keep:
+            if stop is not None and stop.is_set():
+                raise TrimCancelled()
+            copy_frames(raw, out, start, end)
+            
+            # [trimmed start, original start, length] in seconds
+            offset_map.append([
+                trimmed_frames * FRAME_MS / 1000,
+                start * FRAME_MS / 1000,
+                (end - start) * FRAME_MS / 1000
+            ])
+            trimmed_frames += end - start
+    
+    return offset_map
+
+
+def copy_frames(raw: BinaryIO, out: wave.Wave_write, start: int, end: int):
+    """Append frames [start, end) of a raw PCM file to an open WAV writer"""
+    raw.seek(start * FRAME_BYTES)
+    remaining = (end - start) * FRAME_BYTES
+    while remaining:
+        chunk = raw.read(min(remaining, 1024 * 1024))
+        if not chunk:
+            break
+        out.writeframes(chunk)
+        remaining -= len(chunk)
+
+
+def open_wav_writer(path: str) -> wave.Wave_write:
+    """WAV writer in the decoder's format (16 kHz mono 16-bit)"""
+    out = wave.open(path, 'wb')
+    out.setnchannels(1)
+    out.setsampwidth(SAMPLE_WIDTH)
+    out.setframerate(SAMPLE_RATE)
+    return out
+
+
+def transcode_bitrate(duration_seconds: Optional[float], max_bytes: int) -> int:
+    """Highest speech bitrate (kbps) at which duration_seconds of audio fits in max_bytes"""
+    if not duration_seconds:
+        return TRANSCODE_FALLBACK_KBPS
+    kbps = int(max_bytes * TRANSCODE_SIZE_HEADROOM * 8 / duration_seconds / 1000)
+    return max(TRANSCODE_MIN_KBPS, min(kbps, TRANSCODE_MAX_KBPS))
+
+
+def transcode_output_path(filepath: str) -> str:
+    """Where transcode_for_upload() writes its output for filepath"""
+    extension = TRANSCODE_CODECS.get(TRANSCODE_CODEC, TRANSCODE_CODECS['opus'])[0]
+    return f"{os.path.splitext(filepath)[0]}_compressed.{extension}"
+
+
+def transcode_for_upload(filepath: str, max_bytes: int, duration_seconds: Optional[float] = None,
+                         stop: Optional[threading.Event] = None) -> Dict:
+    """
+    Re-encode filepath as 16 kHz mono speech sized to fit max_bytes, in one ffmpeg pass
+    
+    ffmpeg reads the source and writes the output itself, so memory use stays
+    flat whatever the length of the recording. Returns the output path, codec,
+    bitrate and size; the source file is left in place.
+    """
+    codec = TRANSCODE_CODEC if TRANSCODE_CODEC in TRANSCODE_CODECS else 'opus'
+    encoder_args = TRANSCODE_CODECS[codec][1]
+    if duration_seconds is None:
+        duration_seconds = probe_duration(filepath)
+    bitrate = transcode_bitrate(duration_seconds, max_bytes)
+    output_path = transcode_output_path(filepath)
+    
+    process = subprocess.Popen(
+        ['ffmpeg', '-v', 'error', '-nostdin', '-y', '-i', filepath,
+         '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE), *encoder_args, '-b:a', f"{bitrate}k", output_path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    try:
+        while True:
+            if stop is not None and stop.is_set():
+                raise TranscodeCancelled()
+            try:
+                _, errors = process.communicate(timeout=0.5)
+                break
+            except subprocess.TimeoutExpired:
+                continue
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed to transcode audio: {errors.decode(errors='replace').strip()}")
+    except BaseException:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    
+    return {
+        'path': output_path,
+        'codec': codec,
+        'bitrate_kbps': bitrate,
+        'bytes': os.path.getsize(output_path)
+    }
+
+
+def remap_time(offset_map: List[List[float]], seconds: float) -> float:
+    """Map a time in the trimmed audio back to the original recording"""
+    if not offset_map:
+        return seconds
+    index = max(0, bisect.bisect_right([span[0] for span in offset_map], seconds) - 1)
+    trimmed_start, original_start, length = offset_map[index]
+    return original_start + min(max(0.0, seconds - trimmed_start), length)
+
+
+def remap_segments(segments: List[Dict], offset_map: Optional[List[List[float]]]) -> List[Dict]:
+    """Rewrite Whisper segment start/end times onto the original recording's timeline"""
+    if not offset_map:
+        return segments
+    return [
+        dict(segment, start=remap_time(offset_map, segment['start']), end=remap_time(offset_map, segment['end']))
+        for segment in segments
+    ]
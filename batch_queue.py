@@ -0,0 +1,149 @@
+"""
+Batch submission support
+Groups many audio/transcript jobs under one batch ID and runs them on a bounded worker pool
+"""
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from job_queue import job_queue, FINISHED_STATUSES
+
+# How many batch items are processed at the same time (per worker process)
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', 4))
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 200))
+
+
+class BatchQueue:
+    def __init__(self, max_workers: int = BATCH_MAX_WORKERS):
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch-worker')
+    
+    def create_batch(self, user_id: str = "anonymous") -> str:
+        """Create an empty batch and return batch ID"""
+        batch_id = str(uuid.uuid4())
+        
+        with self.lock:
+            self._prune()
+            self.batches[batch_id] = {
+                'batch_id': batch_id,
+                'user_id': user_id,
+                'created_at': datetime.now(),
+                'items': []
+            }
+        
+        return batch_id
+    
+    def add_item(self, batch_id: str, item_id: str, job_id: str):
+        """Record that a job belongs to a batch"""
+        with self.lock:
+            self.batches[batch_id]['items'].append({'item_id': item_id, 'job_id': job_id})
+    
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Get batch details by ID"""
+        with self.lock:
+            return self.batches.get(batch_id)
+    
+    def get_progress(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Aggregate the status and progress of every item in a batch"""
+        batch = self.get_batch(batch_id)
+        if batch is None:
+            return None
+        
+        counts: Dict[str, int] = {}
+        total_progress = 0
+        items = []
+        for item in batch['items']:
+            job = job_queue.get_job(item['job_id'])
+            status = job['status'] if job else 'expired'
+            progress = job['progress'] if job else 0
+            # Failed items count as done for overall progress
+            if status in FINISHED_STATUSES or status == 'expired':
+                progress = 100
+            
+            counts[status] = counts.get(status, 0) + 1
+            total_progress += progress
+            items.append({
+                'item_id': item['item_id'],
+                'job_id': item['job_id'],
+                'status': status,
+                'progress': job['progress'] if job else 0
+            })
+        
+        total = len(batch['items'])
+        finished = sum(n for status, n in counts.items() if status in FINISHED_STATUSES or status == 'expired')
+        
+        return {
+            'batch_id': batch_id,
+            'status': 'complete' if finished == total else 'processing',
+            'total': total,
+            'finished': finished,
+            'progress': round(total_progress / total) if total else 100,
+            'counts': counts,
+            'items': items,
+            'created_at': batch['created_at'].isoformat()
+        }
+    
+    def iter_results(self, batch_id: str, heartbeat_seconds: float = 15) -> Iterator[Optional[Dict[str, Any]]]:
+        """
+        Yield each item's outcome as soon as it finishes (completion order)
+        Yields None when heartbeat_seconds pass with nothing new, so callers can keep connections alive
+        """
+        batch = self.get_batch(batch_id)
+        if batch is None:
+            return
+        
+        pending: List[Dict[str, str]] = list(batch['items'])
+        last_sent = time.monotonic()
+        
+        while pending:
+            # Read the change count before checking so no update is missed while we look
+            change_count = job_queue.change_count
+            
+            still_pending = []
+            for item in pending:
+                job = job_queue.get_job(item['job_id'])
+                if job is None:
+                    yield {'item_id': item['item_id'], 'job_id': item['job_id'], 'status': 'expired'}
+                    last_sent = time.monotonic()
+                elif job['status'] in FINISHED_STATUSES:
+                    yield self._item_outcome(item, job)
+                    last_sent = time.monotonic()
+                else:
+                    still_pending.append(item)
+            
+            pending = still_pending
+            if not pending:
+                break
+            
+            if time.monotonic() - last_sent >= heartbeat_seconds:
+                yield None
+                last_sent = time.monotonic()
+            
+            job_queue.wait_for_any_change(change_count, timeout=heartbeat_seconds)
+    
+    def _item_outcome(self, item: Dict[str, str], job: Dict[str, Any]) -> Dict[str, Any]:
+        outcome = {
+            'item_id': item['item_id'],
+            'job_id': item['job_id'],
+            'status': job['status']
+        }
+        if job['status'] == 'complete':
+            outcome['result'] = job_queue.get_result(item['job_id'])
+        elif job['error']:
+            outcome['error'] = job['error']
+        return outcome
+    
+    def _prune(self):
+        """Drop batches whose jobs have all been reaped (lock held)"""
+        for batch_id in list(self.batches):
+            items = self.batches[batch_id]['items']
+            if items and not any(job_queue.get_job(item['job_id']) for item in items):
+                del self.batches[batch_id]
+
+# Global batch queue instance
+batch_queue = BatchQueue()
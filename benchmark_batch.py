@@ -0,0 +1,160 @@
+"""
+Throughput benchmark for POST /api/batch
+
+Usage:
+    python benchmark_batch.py [--items 100] [--latency-ms 50]
+
+Runs the app in-process against a fake OpenAI API on localhost that answers
+every transcription and chat completion after --latency-ms. Times --items
+transcripts analysed one request at a time through /api/analyze-transcript,
+then the same number submitted as one JSONL batch, then --items audio files
+uploaded in one multipart batch, each batch until every item has finished.
+Everything runs in a scratch folder.
+
+Fails (exit status 1) if a batch is not accepted or any item does not complete.
+"""
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# What the fake Whisper reports for every upload
+AUDIO_SECONDS = 30.0
+
+
+class FakeOpenAI(BaseHTTPRequestHandler):
+    """Answers transcription and chat completion calls after a fixed delay"""
+    latency = 0.05
+    peak_concurrency = 0
+    active = 0
+    lock = threading.Lock()
+    
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        kind = 'transcriptions' if self.path.endswith('/audio/transcriptions') else 'chat'
+        with FakeOpenAI.lock:
+            FakeOpenAI.active += 1
+            FakeOpenAI.peak_concurrency = max(FakeOpenAI.peak_concurrency, FakeOpenAI.active)
+        try:
+            time.sleep(FakeOpenAI.latency)
+        finally:
+            with FakeOpenAI.lock:
+                FakeOpenAI.active -= 1
+        
+        if kind == 'transcriptions':
+            body = {'text': 'We are behind on payments and need to sell quickly.',
+                    'duration': AUDIO_SECONDS, 'language': 'english',
+                    'segments': [{'id': 0, 'start': 0.0, 'end': 4.0,
+                                  'text': 'We are behind on payments and need to sell quickly.'}]}
+        else:
+            body = {'id': 'chatcmpl-bench', 'object': 'chat.completion', 'created': 0, 'model': 'gpt-4',
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': '{}'}}]}
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+def _wait_for_batch(client, batch_id, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        progress = client.get(f'/api/batch/{batch_id}').get_json()
+        if progress['status'] == 'complete' or time.monotonic() > deadline:
+            return progress
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time /api/batch against one-at-a-time requests')
+    parser.add_argument('--items', type=int, default=100)
+    parser.add_argument('--latency-ms', type=float, default=50, help='fake OpenAI response time')
+    parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for a batch')
+    args = parser.parse_args()
+    FakeOpenAI.latency = args.latency_ms / 1000
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOpenAI)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    
+    folder = tempfile.mkdtemp(prefix='benchmark_batch_')
+    os.chdir(folder)
+    os.environ.update(OPENAI_API_KEY='sk-benchmark',
+                      OPENAI_BASE_URL=f"http://127.0.0.1:{server.server_address[1]}/v1",
+                      TRANSCRIPTION_BACKEND='openai',
+                      TRANSCRIPTION_CACHE_ENABLED='false',
+                      VAD_ENABLED='false',
+                      # The benchmark measures the pipeline, not the request limits
+                      RATE_LIMITS='',
+                      RATE_LIMITS_IP='')
+    sys.path.insert(0, HERE)
+    from app import app
+    from batch_queue import BATCH_MAX_WORKERS
+    client = app.test_client()
+    
+    with open(os.path.join(HERE, 'sample_transcripts.md')) as f:
+        sample = f.read()[:2000]
+    transcripts = [f"Call {i}.\n{sample}" for i in range(args.items)]
+    failures = []
+    
+    started = time.perf_counter()
+    for transcript in transcripts:
+        response = client.post('/api/analyze-transcript', json={'user_id': 'bench-sequential', 'transcript': transcript})
+        if response.status_code != 200:
+            failures.append(f"sequential transcript: {response.status_code} {response.get_json()}")
+            break
+    sequential = time.perf_counter() - started
+    
+    results = {}
+    for kind in ('transcripts', 'audio'):
+        FakeOpenAI.peak_concurrency = 0
+        started = time.perf_counter()
+        if kind == 'transcripts':
+            body = '\n'.join(json.dumps({'id': f't{i}', 'transcript': text}) for i, text in enumerate(transcripts))
+            response = client.post('/api/batch?user_id=bench-batch-transcripts', data=body,
+                                   content_type='application/x-ndjson')
+        else:
+            files = [(io.BytesIO(b'\0' * 4096), f'call_{i:03d}.mp3') for i in range(args.items)]
+            response = client.post('/api/batch?user_id=bench-batch-audio', data={'files': files},
+                                   content_type='multipart/form-data')
+        submitted = time.perf_counter() - started
+        if response.status_code != 202:
+            failures.append(f"{kind} batch was not accepted: {response.status_code} {response.get_json()}")
+            continue
+        
+        progress = _wait_for_batch(client, response.get_json()['batch_id'], args.timeout)
+        results[kind] = (submitted, time.perf_counter() - started, progress['counts'], FakeOpenAI.peak_concurrency)
+        if progress['counts'].get('complete', 0) != args.items:
+            failures.append(f"{kind} batch finished with {progress['counts']}")
+    server.shutdown()
+    os.chdir(HERE)
+    shutil.rmtree(folder, ignore_errors=True)
+    
+    print(f"{args.items} items, fake OpenAI latency {args.latency_ms:g}ms, BATCH_MAX_WORKERS={BATCH_MAX_WORKERS}")
+    print(f"transcripts one at a time: {sequential:6.2f}s  ({args.items / sequential:6.1f} items/s)")
+    for kind, (submitted, elapsed, counts, peak) in results.items():
+        print(f"{kind + ' batch:':<27}{elapsed:6.2f}s  ({args.items / elapsed:6.1f} items/s, "
+              f"submitted in {submitted:.2f}s, peak {peak} concurrent API calls, {counts})")
+    
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Micro-benchmark for the per-user rate limiter
+
+Usage:
+    python benchmark_rate_limiter.py [--checks 200000] [--users 10000] [--processes 2] [--threads 8] [--ips 1]
+
+Times RateLimiter.check against a scratch bucket file, with every process and
+thread contending for the same file lock as gunicorn workers would. Reports
+the mean and tail wall-clock time of one check, and the CPU time the checking
+thread spent in it. With the default --ips 1 every check also hits the same
+client IP bucket, as traffic from one office NAT or integration does.
+
+Threads only give up the GIL inside check() (at the lock calls), so a thread
+waiting for the GIL or a CPU is timed as if it were in a check: with every
+thread busy, the wall-clock mean is close to threads / throughput per CPU
+however short the locked section is. The CPU time leaves that wait out.
+"""
+import os
+import time
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+from rate_limiter import RateLimiter
+
+
+def _run(path, checks, users, ips, threads, results):
+    # Generous limit: the benchmark measures the bookkeeping, not rejections
+    limiter = RateLimiter(path, rules={'bench': (1000000, 1)})
+    timings = []
+    cpu_timings = []
+    lock = threading.Lock()
+    
+    def work(offset):
+        mine = []
+        mine_cpu = []
+        for i in range(checks // threads):
+            user_id = f"user{(offset + i) % users}"
+            client_ip = f"203.0.{(offset + i) % ips // 256}.{(offset + i) % ips % 256}"
+            started = time.perf_counter()
+            started_cpu = time.thread_time()
+            limiter.check('bench', user_id, client_ip)
+            mine_cpu.append(time.thread_time() - started_cpu)
+            mine.append(time.perf_counter() - started)
+        with lock:
+            timings.extend(mine)
+            cpu_timings.extend(mine_cpu)
+    
+    workers = [threading.Thread(target=work, args=(n * 7919,)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results.put((timings, cpu_timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time RateLimiter.check under contention')
+    parser.add_argument('--checks', type=int, default=200000, help='checks per process')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ips', type=int, default=1, help='distinct client IPs')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'rate_limits.bin')
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=_run, args=(path, args.checks, args.users, args.ips, args.threads, results))
+                     for _ in range(args.processes)]
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        timings = []
+        cpu_timings = []
+        for _ in processes:
+            wall, cpu = results.get()
+            timings.extend(wall)
+            cpu_timings.extend(cpu)
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+    
+    def summary(values):
+        values.sort()
+    
+        def us(fraction):
+            return values[int(fraction * (len(values) - 1))] * 1e6
+    
+        return (f"mean {sum(values) / len(values) * 1e6:.1f}us  p50 {us(0.5):.1f}us  p99 {us(0.99):.1f}us  "
+                f"max {values[-1] * 1e6:.0f}us")
+    
+    print(f"{len(timings)} checks, {args.processes} processes x {args.threads} threads, {args.users} users, "
+          f"{args.ips} IPs, {os.cpu_count()} CPUs")
+    print(f"wall {summary(timings)}  ({len(timings) / elapsed:.0f} checks/s)")
+    print(f"cpu  {summary(cpu_timings)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Realtime-factor benchmark for the transcription backends
+
+Usage:
+    python benchmark_transcription.py recording.m4a --backend local [--threads 4] [--repeat 3]
+    OPENAI_API_KEY=... python benchmark_transcription.py recording.m4a --backend openai
+
+Realtime factor is processing time divided by audio duration (below 1 is
+faster than realtime). For the local backend the model load is timed
+separately, since workers preload it at startup.
+"""
+import os
+import time
+import argparse
+
+from audio_probe import probe_duration
+import transcription_backends
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time a transcription backend on one recording')
+    parser.add_argument('filepath')
+    parser.add_argument('--backend', default=transcription_backends.TRANSCRIPTION_BACKEND,
+                        choices=sorted(transcription_backends.BACKENDS))
+    parser.add_argument('--threads', type=int, default=transcription_backends.LOCAL_WHISPER_THREADS,
+                        help='CPU threads for the local backend (0 = all cores)')
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+    
+    duration_seconds = probe_duration(args.filepath)
+    if not duration_seconds:
+        parser.error(f"Could not read the duration of {args.filepath}")
+    
+    client = None
+    if args.backend == 'local':
+        backend = transcription_backends.LocalWhisperBackend(cpu_threads=args.threads)
+        started = time.perf_counter()
+        backend.preload()
+        print(f"Model load: {time.perf_counter() - started:.1f}s")
+    else:
+        from openai import OpenAI
+        backend = transcription_backends.create_backend(args.backend)
+        client = OpenAI(api_key=os.environ['OPENAI_API_KEY'])
+    
+    print(f"{args.filepath}: {duration_seconds / 60:.1f} min, backend={args.backend}")
+    for run in range(1, args.repeat + 1):
+        started = time.perf_counter()
+        transcription = backend.transcribe(args.filepath, client)
+        elapsed = time.perf_counter() - started
+        print(f"Run {run}: {elapsed:.1f}s, realtime factor {elapsed / duration_seconds:.3f}, "
+              f"{len(transcription.segments or [])} segments, {len(transcription.text)} chars")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+HTTP transport whose in-flight requests can be aborted from another thread
+Used so a cancelled or timed-out job also stops its pending OpenAI calls
+"""
+import socket
+import threading
+from typing import List
+
+import httpcore
+import httpx
+
+_ssl_context = None
+_ssl_context_lock = threading.Lock()
+
+
+def _shared_ssl_context():
+    """Loading the CA bundle takes ~40ms of CPU, so every transport shares one context"""
+    global _ssl_context
+    with _ssl_context_lock:
+        if _ssl_context is None:
+            _ssl_context = httpx.create_ssl_context()
+        return _ssl_context
+
+class _TrackedStream(httpcore.NetworkStream):
+    """Network stream that stays reachable after TLS so its socket can be shut down"""
+    
+    def __init__(self, stream: httpcore.NetworkStream, backend: '_TrackingBackend'):
+        self.stream = stream
+        self.backend = backend
+    
+    def read(self, max_bytes: int, timeout: float = None) -> bytes:
+        return self.stream.read(max_bytes, timeout)
+    
+    def write(self, buffer: bytes, timeout: float = None):
+        self.stream.write(buffer, timeout)
+    
+    def close(self):
+        self.backend.forget(self)
+        self.stream.close()
+    
+    def start_tls(self, ssl_context, server_hostname: str = None, timeout: float = None):
+        self.stream = self.stream.start_tls(ssl_context, server_hostname, timeout)
+        return self
+    
+    def get_extra_info(self, info: str):
+        return self.stream.get_extra_info(info)
+    
+    def shutdown(self):
+        """Wake up any thread blocked reading or writing this stream"""
+        sock = self.stream.get_extra_info('socket')
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class _TrackingBackend(httpcore.SyncBackend):
+    """Network backend that remembers open streams so they can be aborted"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams: List[_TrackedStream] = []
+        self.cancelled = False
+    
+    def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        if self.cancelled:
+            raise httpcore.ConnectError('Request cancelled')
+        
+        stream = _TrackedStream(
+            super().connect_tcp(host, port, timeout=timeout, local_address=local_address,
+                                socket_options=socket_options),
+            self
+        )
+        with self.lock:
+            self.streams.append(stream)
+            cancelled = self.cancelled
+        
+        # Cancelled while we were connecting
+        if cancelled:
+            stream.shutdown()
+        return stream
+    
+    def forget(self, stream: _TrackedStream):
+        with self.lock:
+            if stream in self.streams:
+                self.streams.remove(stream)
+    
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            streams = list(self.streams)
+        
+        for stream in streams:
+            stream.shutdown()
+
+
+class CancellableTransport(httpx.BaseTransport):
+    """httpx transport with a cancel() that aborts every request in flight"""
+    
+    def __init__(self):
+        self.backend = _TrackingBackend()
+        self.pool = httpcore.ConnectionPool(
+            ssl_context=_shared_ssl_context(),
+            network_backend=self.backend
+        )
+    
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        core_request = httpcore.Request(
+            method=request.method,
+            url=httpcore.URL(
+                scheme=request.url.raw_scheme,
+                host=request.url.raw_host,
+                port=request.url.port,
+                target=request.url.raw_path
+            ),
+            headers=request.headers.raw,
+            content=request.stream,
+            extensions=request.extensions
+        )
+        
+        try:
+            core_response = self.pool.handle_request(core_request)
+            try:
+                # API responses are small JSON bodies, so read them eagerly
+                content = core_response.read()
+            finally:
+                core_response.close()
+        except httpcore.TimeoutException as e:
+            raise httpx.TimeoutException(str(e), request=request)
+        except httpcore.ConnectError as e:
+            raise httpx.ConnectError(str(e), request=request)
+        except (httpcore.NetworkError, httpcore.ProtocolError) as e:
+            raise httpx.TransportError(str(e), request=request)
+        
+        return httpx.Response(
+            status_code=core_response.status,
+            headers=core_response.headers,
+            content=content,
+            extensions=core_response.extensions
+        )
+    
+    def cancel(self):
+        """Abort in-flight requests and refuse new ones"""
+        self.backend.cancel()
+    
+    def close(self):
+        self.pool.close()
@@ -0,0 +1,88 @@
+"""
+Idempotency key store for audio submissions
+Backed by SQLite so retries are recognised by every gunicorn worker
+"""
+import os
+import time
+import sqlite3
+import threading
+from typing import Dict, Optional
+
+IDEMPOTENCY_DB = os.environ.get('IDEMPOTENCY_DB', 'idempotency.db')
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 3600))
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+
+
+class IdempotencyStore:
+    def __init__(self, db_path: str = IDEMPOTENCY_DB, ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS):
+        """Initialize the store and create its table if needed"""
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                scope_key TEXT PRIMARY KEY,
+                job_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_job ON idempotency_keys (job_id)")
+    
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread; WAL lets workers read while another writes"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def claim(self, user_id: str, key: str, job_id: str) -> Optional[Dict]:
+        """
+        Atomically claim an idempotency key for a new job
+        Returns None if the key is now ours, otherwise the original job record
+        """
+        scope_key = f"{user_id}:{key}"
+        now = time.time()
+        conn = self._connect()
+        
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM idempotency_keys WHERE created_at < ?",
+                (now - self.ttl_seconds,)
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO idempotency_keys (scope_key, job_id, status, created_at) VALUES (?, ?, 'processing', ?)",
+                (scope_key, job_id, now)
+            )
+            row = conn.execute(
+                "SELECT job_id, status, created_at FROM idempotency_keys WHERE scope_key = ?",
+                (scope_key,)
+            ).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        
+        if row[0] == job_id:
+            return None
+        return {'job_id': row[0], 'status': row[1], 'created_at': row[2]}
+    
+    def release(self, user_id: str, key: str, job_id: str):
+        """Forget a claim whose job was never started, so the client can retry"""
+        self._connect().execute(
+            "DELETE FROM idempotency_keys WHERE scope_key = ? AND job_id = ?",
+            (f"{user_id}:{key}", job_id)
+        )
+    
+    def record_status(self, job_id: str, status: str):
+        """Remember a job's latest status for retries answered by another worker"""
+        self._connect().execute(
+            "UPDATE idempotency_keys SET status = ? WHERE job_id = ?",
+            (status, job_id)
+        )
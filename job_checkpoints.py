@@ -0,0 +1,96 @@
+"""
+Durable per-job stage checkpoints so audio jobs survive process restarts
+Each job has a small JSON file recording the last completed stage
+"""
+import os
+import json
+import fcntl
+from typing import Dict, List, Optional
+
+CHECKPOINT_FOLDER = os.environ.get('CHECKPOINT_FOLDER', 'job_checkpoints')
+
+# Stages in order; a job resumes after the last one it completed
+STAGE_UPLOADED = 'uploaded'
+STAGE_TRIMMED = 'trimmed'
+STAGE_COMPRESSED = 'compressed'
+STAGE_TRANSCRIBED = 'transcribed'
+STAGE_ANALYZED = 'analyzed'
+
+# Progress reported for a job known only from its checkpoint
+STAGE_PROGRESS = {
+    STAGE_UPLOADED: 10,
+    STAGE_TRIMMED: 20,
+    STAGE_COMPRESSED: 30,
+    STAGE_TRANSCRIBED: 70,
+    STAGE_ANALYZED: 90
+}
+
+
+class CheckpointStore:
+    def __init__(self, folder: str = CHECKPOINT_FOLDER):
+        """Initialize checkpoint storage in the given folder"""
+        self.folder = folder
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+    
+    def _path(self, job_id: str, suffix: str) -> str:
+        return os.path.join(self.folder, f"{job_id}.{suffix}")
+    
+    def save(self, job_id: str, checkpoint: Dict):
+        """Atomically write a job's checkpoint (fsync'd so it survives a crash)"""
+        path = self._path(job_id, 'json')
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    
+    def load(self, job_id: str) -> Optional[Dict]:
+        """Load a job's checkpoint, or None if it has none"""
+        try:
+            with open(self._path(job_id, 'json'), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+    
+    def delete(self, job_id: str):
+        """Remove a job's checkpoint once it no longer needs resuming"""
+        for suffix in ('json', 'lock'):
+            try:
+                os.remove(self._path(job_id, suffix))
+            except FileNotFoundError:
+                pass
+    
+    def acquire(self, job_id: str) -> Optional[int]:
+        """
+        Take the job's ownership lock without blocking
+        Returns a handle to pass to release(), or None if a live process owns the job.
+        The OS drops the lock when the owning process dies, which marks the job orphaned.
+        """
+        fd = os.open(self._path(job_id, 'lock'), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+    
+    def release(self, handle: Optional[int]):
+        """Release a lock taken with acquire()"""
+        if handle is None:
+            return
+        try:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+        finally:
+            os.close(handle)
+    
+    def list_job_ids(self) -> List[str]:
+        """IDs of all jobs that still have a checkpoint"""
+        return [
+            name[:-len('.json')] for name in os.listdir(self.folder)
+            if name.endswith('.json')
+        ]
+
+# Global checkpoint store instance
+checkpoint_store = CheckpointStore()
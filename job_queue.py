@@ -2,69 +2,211 @@
 Simple in-memory job queue for async audio processing
 Stores job status and results temporarily
 """
+import os
 import uuid
 import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Dict, Optional, Any
+from typing import Callable, Dict, List, Optional, Any
+from result_store import StoredResult, store_result
+from segment_store import segment_store
+
+# How long finished/abandoned jobs are kept before the reaper removes them
+JOB_TTL_COMPLETE_SECONDS = int(os.environ.get('JOB_TTL_COMPLETE_SECONDS', 3600))
+JOB_TTL_ERROR_SECONDS = int(os.environ.get('JOB_TTL_ERROR_SECONDS', 3600))
+JOB_TTL_QUEUED_SECONDS = int(os.environ.get('JOB_TTL_QUEUED_SECONDS', 1800))
+
+# Global budget for finished jobs held in memory (LRU eviction beyond this)
+JOB_MAX_ENTRIES = int(os.environ.get('JOB_MAX_ENTRIES', 500))
+JOB_MAX_BYTES = int(os.environ.get('JOB_MAX_BYTES', 64 * 1024 * 1024))
+
+JOB_REAPER_INTERVAL_SECONDS = int(os.environ.get('JOB_REAPER_INTERVAL_SECONDS', 60))
+
+# Statuses after which a job will not change again
+FINISHED_STATUSES = ('complete', 'error', 'cancelled', 'timeout')
+
+# Rough fixed cost of a job entry without its result
+JOB_BASE_BYTES = 1024
+
 
 class JobQueue:
     def __init__(self):
-        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.jobs: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self.job_sizes: Dict[str, int] = {}
+        self.total_bytes = 0
         self.lock = threading.Lock()
+        # Notified on every update so waiters (e.g. SSE streams) wake immediately
+        self.changed = threading.Condition(self.lock)
+        self.change_count = 0
+        self.cancel_events: Dict[str, threading.Event] = {}
+        self.listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._reaper_thread = None
+        self._reaper_stop = threading.Event()
         
-    def create_job(self, user_id: str = "anonymous") -> str:
+    def create_job(self, user_id: str = "anonymous", job_id: str = None,
+                   idempotency_key: str = None, batch_id: str = None,
+                   callback_url: str = None, duration_seconds: float = None) -> str:
         """Create a new job and return job ID"""
-        job_id = str(uuid.uuid4())
+        job_id = job_id or str(uuid.uuid4())
         
         with self.lock:
             self.jobs[job_id] = {
                 'job_id': job_id,
                 'user_id': user_id,
-                'status': 'queued',  # queued, processing, complete, error
+                'status': 'queued',  # queued, processing, complete, error, cancelled, timeout
                 'progress': 0,
                 'message': 'Job queued for processing',
                 'created_at': datetime.now(),
                 'updated_at': datetime.now(),
                 'result': None,
-                'error': None
+                'error': None,
+                'version': 0,
+                'idempotency_key': idempotency_key,
+                'batch_id': batch_id,
+                'callback_url': callback_url,
+                'duration_seconds': duration_seconds  # probed from the file headers
             }
+            self.cancel_events[job_id] = threading.Event()
+            self._set_size(job_id, JOB_BASE_BYTES)
         
         return job_id
     
     def update_job(self, job_id: str, status: str = None, progress: int = None, 
                    message: str = None, result: Any = None, error: str = None):
         """Update job status and details"""
+        # Serialize and compress outside the lock
+        stored = store_result(job_id, result) if result is not None else None
+        
         with self.lock:
             if job_id not in self.jobs:
+                if stored is not None:
+                    stored.discard()
                 return False
             
             job = self.jobs[job_id]
             
+            # A finished job never changes again (e.g. a stage finishing after cancellation)
+            if job['status'] in FINISHED_STATUSES:
+                if stored is not None:
+                    stored.discard()
+                return False
+            
             if status:
                 job['status'] = status
             if progress is not None:
                 job['progress'] = progress
             if message:
                 job['message'] = message
-            if result is not None:
-                job['result'] = result
+            if stored is not None:
+                if job['result'] is not None and job['result'].path != stored.path:
+                    job['result'].discard()
+                job['result'] = stored
             if error:
                 job['error'] = error
             
             job['updated_at'] = datetime.now()
+            job['version'] += 1
+            self.change_count += 1
+            self.changed.notify_all()
             
+            if stored is not None or error:
+                result_bytes = job['result'].memory_bytes if job['result'] is not None else 0
+                self._set_size(job_id, JOB_BASE_BYTES + result_bytes + len(job['error'] or ''))
+            
+            snapshot = self._snapshot(job)
+            
+            # Most recently finished jobs are the last to be evicted
+            if job['status'] in FINISHED_STATUSES:
+                self.jobs.move_to_end(job_id)
+                self._enforce_budget()
+        
+        for listener in self.listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                print(f"Error in job listener for job {job_id}: {str(e)}")
+        
+        return True
+    
+    def cancel_job(self, job_id: str) -> bool:
+        """
+        Cancel a queued or processing job
+        Returns False if the job does not exist or has already finished
+        """
+        if not self.update_job(job_id, status='cancelled', message='Job cancelled'):
+            return False
+        
+        # Wake the worker; it stops at its next check and aborts in-flight calls
+        with self.lock:
+            cancel_event = self.cancel_events.get(job_id)
+        if cancel_event is not None:
+            cancel_event.set()
         return True
     
+    def get_cancel_event(self, job_id: str) -> Optional[threading.Event]:
+        """Get the event that is set when the job is cancelled"""
+        with self.lock:
+            return self.cancel_events.get(job_id)
+    
+    def add_listener(self, listener: Callable[[Dict[str, Any]], None]):
+        """Register a callback invoked with a job snapshot after every update"""
+        self.listeners.append(listener)
+    
     def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
         """Get job details by ID"""
         with self.lock:
-            return self.jobs.get(job_id)
+            job = self.jobs.get(job_id)
+            if job is not None:
+                self.jobs.move_to_end(job_id)
+            return job
+    
+    def wait_for_change(self, job_id: str, version: int, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Block until the job moves past the given version, is finished, or timeout expires
+        Returns a snapshot of the job's status fields, or None if the job is gone
+        """
+        with self.changed:
+            self.changed.wait_for(
+                lambda: job_id not in self.jobs
+                or self.jobs[job_id]['version'] != version
+                or self.jobs[job_id]['status'] in FINISHED_STATUSES,
+                timeout=timeout
+            )
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            return self._snapshot(job)
+    
+    def wait_for_any_change(self, since_count: int, timeout: float) -> int:
+        """
+        Block until any job changes after change_count was since_count, or timeout expires
+        Returns the current change count to pass to the next call
+        """
+        with self.changed:
+            self.changed.wait_for(lambda: self.change_count != since_count, timeout=timeout)
+            return self.change_count
+    
+    def get_result(self, job_id: str) -> Optional[Any]:
+        """Get the decompressed result of a job (None if missing or not finished)"""
+        stored = self.get_stored_result(job_id)
+        if stored is None:
+            return None
+        try:
+            return stored.load()
+        except FileNotFoundError:
+            return None
+    
+    def get_stored_result(self, job_id: str) -> Optional[StoredResult]:
+        """Get the compressed result of a job without decoding it"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job['result'] if job is not None else None
     
     def delete_job(self, job_id: str):
         """Delete a job from queue"""
         with self.lock:
             if job_id in self.jobs:
-                del self.jobs[job_id]
+                self._remove(job_id)
     
     def cleanup_old_jobs(self, hours: int = 24):
         """Remove jobs older than specified hours"""
@@ -77,9 +219,115 @@ class JobQueue:
             ]
             
             for job_id in jobs_to_delete:
-                del self.jobs[job_id]
+                self._remove(job_id)
+        
+        return len(jobs_to_delete)
+    
+    def reap_expired_jobs(self) -> int:
+        """Remove finished and abandoned queued jobs past their per-status TTL"""
+        now = datetime.now()
+        
+        with self.lock:
+            jobs_to_delete = []
+            for job_id, job in self.jobs.items():
+                ttl = self._ttl_for(job)
+                if ttl is not None and job['updated_at'] < now - timedelta(seconds=ttl):
+                    jobs_to_delete.append(job_id)
+            
+            for job_id in jobs_to_delete:
+                self._remove(job_id)
         
         return len(jobs_to_delete)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Report how many jobs are held and approximately how many bytes"""
+        with self.lock:
+            by_status: Dict[str, int] = {}
+            spilled_results = 0
+            spilled_bytes = 0
+            for job in self.jobs.values():
+                by_status[job['status']] = by_status.get(job['status'], 0) + 1
+                if job['result'] is not None and job['result'].path:
+                    spilled_results += 1
+                    spilled_bytes += job['result'].compressed_size
+            
+            return {
+                'entries': len(self.jobs),
+                'approx_bytes': self.total_bytes,
+                'by_status': by_status,
+                'spilled_results': spilled_results,
+                'spilled_bytes': spilled_bytes,
+                'max_entries': JOB_MAX_ENTRIES,
+                'max_bytes': JOB_MAX_BYTES
+            }
+    
+    def start_reaper(self, interval: int = JOB_REAPER_INTERVAL_SECONDS):
+        """Start the background thread that reaps expired jobs (idempotent)"""
+        if self._reaper_thread and self._reaper_thread.is_alive():
+            return
+        
+        self._reaper_stop.clear()
+        self._reaper_thread = threading.Thread(
+            target=self._reaper_loop,
+            args=(interval,),
+            name='job-reaper',
+            daemon=True
+        )
+        self._reaper_thread.start()
+    
+    def stop_reaper(self):
+        """Stop the background reaper thread"""
+        self._reaper_stop.set()
+        if self._reaper_thread:
+            self._reaper_thread.join()
+            self._reaper_thread = None
+    
+    def _reaper_loop(self, interval: int):
+        while not self._reaper_stop.wait(interval):
+            try:
+                self.reap_expired_jobs()
+            except Exception as e:
+                print(f"Error reaping jobs: {str(e)}")
+    
+    def _snapshot(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Copy of a job's fields without its (possibly large) result"""
+        return {key: value for key, value in job.items() if key != 'result'}
+    
+    def _ttl_for(self, job: Dict[str, Any]) -> Optional[int]:
+        status = job['status']
+        if status == 'complete':
+            return JOB_TTL_COMPLETE_SECONDS
+        if status in FINISHED_STATUSES:
+            return JOB_TTL_ERROR_SECONDS
+        # Batch items wait their turn in the worker pool; they are not abandoned
+        if status == 'queued' and not job['batch_id']:
+            return JOB_TTL_QUEUED_SECONDS
+        # Jobs being processed are never reaped from under their worker
+        return None
+    
+    def _set_size(self, job_id: str, size: int):
+        self.total_bytes += size - self.job_sizes.get(job_id, 0)
+        self.job_sizes[job_id] = size
+    
+    def _remove(self, job_id: str):
+        job = self.jobs.pop(job_id)
+        self.cancel_events.pop(job_id, None)
+        self.change_count += 1
+        if job['result'] is not None:
+            job['result'].discard()
+        segment_store.delete(job_id)
+        self.changed.notify_all()
+        self.total_bytes -= self.job_sizes.pop(job_id, 0)
+    
+    def _enforce_budget(self):
+        """Evict least recently used finished jobs while over budget (lock held)"""
+        if len(self.jobs) <= JOB_MAX_ENTRIES and self.total_bytes <= JOB_MAX_BYTES:
+            return
+        
+        for job_id in [job_id for job_id, job in self.jobs.items() if job['status'] in FINISHED_STATUSES]:
+            if len(self.jobs) <= JOB_MAX_ENTRIES and self.total_bytes <= JOB_MAX_BYTES:
+                break
+            self._remove(job_id)
 
 # Global job queue instance
 job_queue = JobQueue()
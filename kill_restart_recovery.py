@@ -0,0 +1,194 @@
+"""
+Kill-and-restart check for audio job checkpoints
+
+Usage:
+    python kill_restart_recovery.py
+
+Runs a fake OpenAI API on localhost and submits one audio job in a child
+process. Once the transcript is checkpointed and the analysis request is in
+flight, the child is killed with SIGKILL. A second child then calls
+recover_jobs(), as a restarted worker does, and waits for the job to finish.
+
+Passes (exit status 0) if the resumed job completes under the same job_id,
+Whisper was called exactly once, usage was settled once for the transcribed
+minutes, and the checkpoint is gone. Everything runs in a scratch folder.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# What the fake Whisper reports for every upload
+AUDIO_SECONDS = 120.0
+USER_ID = 'recovery-check'
+
+
+class FakeOpenAI(BaseHTTPRequestHandler):
+    """Answers the transcription and chat completion calls made by one audio job"""
+    calls = {'transcriptions': 0, 'chat': 0}
+    # Chat completions wait on this, so the first process is killed mid-analysis
+    release_analysis = threading.Event()
+    
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.endswith('/audio/transcriptions'):
+            FakeOpenAI.calls['transcriptions'] += 1
+            body = {'text': 'We are behind on payments and need to sell quickly.',
+                    'duration': AUDIO_SECONDS, 'language': 'english',
+                    'segments': [{'id': 0, 'start': 0.0, 'end': 4.0,
+                                  'text': 'We are behind on payments and need to sell quickly.'}]}
+        else:
+            FakeOpenAI.calls['chat'] += 1
+            FakeOpenAI.release_analysis.wait()
+            body = {'id': 'chatcmpl-check', 'object': 'chat.completion', 'created': 0, 'model': 'gpt-4',
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': '{}'}}]}
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The request held while its process was killed
+            pass
+    
+    def log_message(self, format, *args):
+        pass
+
+
+def _child(mode):
+    """Run inside a child process whose working directory is the scratch folder"""
+    sys.path.insert(0, HERE)
+    from ai_analyzer import EnhancedMotivationAnalyzer
+    from usage_tracker import SQLiteUsageTracker
+    from async_worker import start_async_job, recover_jobs
+    from job_queue import job_queue
+    
+    analyzer = EnhancedMotivationAnalyzer()
+    usage_tracker = SQLiteUsageTracker(data_file='usage_data.json', db_path='usage.db')
+    
+    if mode == 'start':
+        os.makedirs('uploads', exist_ok=True)
+        filepath = os.path.join('uploads', 'call.mp3')
+        with open(filepath, 'wb') as f:
+            f.write(b'\0' * 4096)
+        job_id = 'recovery-check-job'
+        usage_tracker.reserve_audio_minutes(USER_ID, AUDIO_SECONDS / 60, job_id)
+        start_async_job(filepath, USER_ID, analyzer, usage_tracker, {}, job_id=job_id)
+        print(json.dumps({'job_id': job_id}), flush=True)
+        # Wait to be killed
+        time.sleep(600)
+        return
+    
+    recovered = recover_jobs(analyzer, usage_tracker, {})
+    job = None
+    for _ in range(600):
+        job = job_queue.get_job(recovered[0]) if recovered else None
+        if job is None or job['status'] not in ('queued', 'processing'):
+            break
+        time.sleep(0.1)
+    result = job_queue.get_result(recovered[0]) if job and job['status'] == 'complete' else None
+    print(json.dumps({
+        'recovered': recovered,
+        'status': job['status'] if job else None,
+        'error': job['error'] if job else None,
+        'transcript': result['transcript'] if result else None,
+        'usage': usage_tracker.get_usage_stats(USER_ID)
+    }), flush=True)
+
+
+def _spawn(mode, folder, port):
+    env = dict(os.environ,
+               OPENAI_API_KEY='sk-recovery-check',
+               OPENAI_BASE_URL=f"http://127.0.0.1:{port}/v1",
+               TRANSCRIPTION_BACKEND='openai',
+               TRANSCRIPTION_CACHE_ENABLED='false',
+               VAD_ENABLED='false')
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child', mode],
+                            cwd=folder, env=env, stdout=subprocess.PIPE, text=True)
+
+
+def _wait_for(condition, timeout, what):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise SystemExit(f"FAIL: timed out waiting for {what}")
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Kill a worker mid-job and check the job resumes after restart')
+    parser.add_argument('--child', choices=('start', 'resume'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        _child(args.child)
+        return
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOpenAI)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    
+    with tempfile.TemporaryDirectory() as folder:
+        checkpoint_path = os.path.join(folder, 'job_checkpoints', 'recovery-check-job.json')
+        
+        def checkpoint():
+            try:
+                with open(checkpoint_path) as f:
+                    return json.load(f)
+            except (FileNotFoundError, ValueError):
+                return None
+        
+        first = _spawn('start', folder, port)
+        try:
+            _wait_for(lambda: FakeOpenAI.calls['chat'] > 0, 30, 'the analysis request')
+            saved = checkpoint()
+            print(f"Killing worker at stage '{saved['stage']}' (usage_recorded={saved.get('usage_recorded')})")
+            os.kill(first.pid, signal.SIGKILL)
+            first.wait()
+        finally:
+            if first.poll() is None:
+                first.kill()
+        
+        FakeOpenAI.release_analysis.set()
+        second = _spawn('resume', folder, port)
+        output, _ = second.communicate(timeout=120)
+        outcome = json.loads(output.strip().splitlines()[-1])
+        leftover = checkpoint()
+    server.shutdown()
+    
+    print(f"Recovered {outcome['recovered']}: status {outcome['status']}"
+          + (f" ({outcome['error']})" if outcome['error'] else ''))
+    print(f"Whisper calls: {FakeOpenAI.calls['transcriptions']}, chat calls: {FakeOpenAI.calls['chat']}")
+    print(f"Audio minutes recorded: {outcome['usage']['audio_minutes_used']}")
+    
+    failures = []
+    if outcome['recovered'] != ['recovery-check-job'] or outcome['status'] != 'complete':
+        failures.append('job was not resumed to completion')
+    if saved['stage'] != 'transcribed':
+        failures.append(f"worker was killed at stage '{saved['stage']}', expected 'transcribed'")
+    if FakeOpenAI.calls['transcriptions'] != 1:
+        failures.append('Whisper was called more than once')
+    if abs(outcome['usage']['audio_minutes_used'] - AUDIO_SECONDS / 60) > 1e-6:
+        failures.append('usage was not recorded exactly once')
+    if leftover is not None:
+        failures.append('checkpoint was left behind')
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
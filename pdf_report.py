@@ -0,0 +1,318 @@
+"""
+PDF reports of an analysis
+The paragraph and table styles are built once, on first use, and shared by every
+render (they are only read while a document is built). Rendered reports are kept
+in an in-memory LRU cache keyed by a hash of the analysis and the "Generated"
+time printed on them, which has minute resolution, so exporting the same analysis
+again within that minute returns the stored bytes without laying the document out,
+and a report never shows an earlier render's time. Older entries are never hit
+again and are the first to be evicted.
+"""
+import io
+import os
+import json
+import hashlib
+import threading
+import collections
+from datetime import datetime
+from typing import Dict, Optional
+
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+
+PDF_CACHE_MAX_BYTES = int(os.environ.get('PDF_CACHE_MAX_MB', 32)) * 1024 * 1024
+
+
+class ReportStyles:
+    """Every style a report uses"""
+    
+    def __init__(self):
+        sample = getSampleStyleSheet()
+        
+        self.title = ParagraphStyle(
+            'CustomTitle',
+            parent=sample['Heading1'],
+            fontSize=24,
+            textColor=colors.HexColor('#3d5a4a'),
+            spaceAfter=12,
+            alignment=TA_CENTER,
+            fontName='Helvetica-Bold'
+        )
+        
+        self.heading = ParagraphStyle(
+            'CustomHeading',
+            parent=sample['Heading2'],
+            fontSize=16,
+            textColor=colors.HexColor('#3d5a4a'),
+            spaceAfter=10,
+            spaceBefore=15,
+            fontName='Helvetica-Bold'
+        )
+        
+        self.subheading = ParagraphStyle(
+            'CustomSubHeading',
+            parent=sample['Heading3'],
+            fontSize=13,
+            textColor=colors.HexColor('#5d7a68'),
+            spaceAfter=8,
+            spaceBefore=10,
+            fontName='Helvetica-Bold'
+        )
+        
+        self.body = ParagraphStyle(
+            'CustomBody',
+            parent=sample['BodyText'],
+            fontSize=10,
+            leading=14,
+            textColor=colors.HexColor('#2d4a3a')
+        )
+        
+        self.score_table = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#5d7a68')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#f0f5f0')),
+            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#c8d4c8')),
+            ('PADDING', (0, 0), (-1, -1), 12),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ])
+        
+        self.deal_table = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, -1), colors.white),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#e8ede8')),
+            ('PADDING', (0, 0), (-1, -1), 10),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ])
+        
+        self.offer_table = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f0f8f0')),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#c8d4c8')),
+            ('PADDING', (0, 0), (-1, -1), 10),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ])
+
+
+_styles: Optional[ReportStyles] = None
+_styles_lock = threading.Lock()
+
+
+def report_styles() -> ReportStyles:
+    """The shared styles, built by whichever render needs them first"""
+    global _styles
+    if _styles is None:
+        with _styles_lock:
+            if _styles is None:
+                _styles = ReportStyles()
+    return _styles
+
+
+def build_report(analysis: Dict, generated: str) -> bytes:
+    """Lay out and render the report for one analysis, stamped with the generated time"""
+    styles = report_styles()
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.5*inch, bottomMargin=0.5*inch)
+    story = []
+    
+    # Title
+    story.append(Paragraph('Seller Motivation Analysis Report', styles.title))
+    story.append(Paragraph(f'Generated: {generated}', styles.body))
+    story.append(Spacer(1, 0.3*inch))
+    
+    # Motivation Score
+    score_data = [[
+        Paragraph('<b>Motivation Score</b>', styles.heading),
+        Paragraph(f'<b>{analysis.get("overall_score", "N/A")}/10</b>', styles.heading)
+    ], [
+        Paragraph('Motivation Level', styles.body),
+        Paragraph(analysis.get('motivation_level', 'N/A'), styles.body)
+    ], [
+        Paragraph('Confidence', styles.body),
+        Paragraph(f'{analysis.get("confidence", "N/A")}%', styles.body)
+    ]]
+    
+    score_table = Table(score_data, colWidths=[3*inch, 3*inch])
+    score_table.setStyle(styles.score_table)
+    story.append(score_table)
+    story.append(Spacer(1, 0.2*inch))
+    
+    # Deal Numbers Summary
+    if 'deal_numbers' in analysis and analysis['deal_numbers'].get('fields_extracted', 0) > 0:
+        story.append(Paragraph('Deal Numbers Summary', styles.heading))
+        deal_numbers = analysis['deal_numbers']
+        extracted = deal_numbers.get('extracted', {})
+        calculated = deal_numbers.get('calculated', {})
+        
+        deal_data = []
+        
+        # Financial Obligations
+        if any([extracted.get('mortgage_balance'), extracted.get('arrears'), extracted.get('monthly_payment')]):
+            deal_data.append([Paragraph('<b>Financial Obligations</b>', styles.subheading), ''])
+            if extracted.get('mortgage_balance'):
+                deal_data.append(['Mortgage Balance', f"${extracted['mortgage_balance']:,}"])
+            if extracted.get('arrears'):
+                deal_data.append(['Arrears', f"${extracted['arrears']:,}"])
+            if extracted.get('monthly_payment'):
+                deal_data.append(['Monthly Payment', f"${extracted['monthly_payment']:,}/mo"])
+            if calculated.get('total_payoff'):
+                deal_data.append([Paragraph('<b>Total Payoff</b>', styles.body), Paragraph(f"<b>${calculated['total_payoff']:,}</b>", styles.body)])
+        
+        # Property Details
+        if any([extracted.get('bedrooms'), extracted.get('bathrooms'), extracted.get('square_feet'), extracted.get('estimated_value')]):
+            deal_data.append([Paragraph('<b>Property Details</b>', styles.subheading), ''])
+            if extracted.get('bedrooms'):
+                deal_data.append(['Bedrooms', str(extracted['bedrooms'])])
+            if extracted.get('bathrooms'):
+                deal_data.append(['Bathrooms', str(extracted['bathrooms'])])
+            if extracted.get('square_feet'):
+                deal_data.append(['Square Feet', f"{extracted['square_feet']:,} sq ft"])
+            if extracted.get('estimated_value'):
+                deal_data.append(['Estimated Value', f"${extracted['estimated_value']:,}"])
+        
+        # Seller Requirements
+        if extracted.get('seller_net_desired'):
+            deal_data.append([Paragraph('<b>Seller Requirements</b>', styles.subheading), ''])
+            deal_data.append(['Net Proceeds Desired', f"${extracted['seller_net_desired']:,}"])
+        
+        # Quick Math
+        if calculated.get('equity_available') is not None:
+            deal_data.append([Paragraph('<b>Quick Math</b>', styles.subheading), ''])
+            if calculated.get('minimum_offer'):
+                deal_data.append(['Minimum Offer', f"${calculated['minimum_offer']:,}"])
+            deal_data.append([Paragraph('<b>Equity Available</b>', styles.body), Paragraph(f"<b>${calculated['equity_available']:,}</b>", styles.body)])
+        
+        if deal_data:
+            deal_table = Table(deal_data, colWidths=[3*inch, 3*inch])
+            deal_table.setStyle(styles.deal_table)
+            story.append(deal_table)
+            story.append(Spacer(1, 0.2*inch))
+    
+    # Key Insights
+    if analysis.get('insights'):
+        story.append(Paragraph('Key Insights', styles.heading))
+        for insight in analysis['insights']:
+            story.append(Paragraph(f'• {insight}', styles.body))
+            story.append(Spacer(1, 0.1*inch))
+        story.append(Spacer(1, 0.1*inch))
+    
+    # Timeline Urgency
+    if analysis.get('timeline_urgency'):
+        story.append(Paragraph('Timeline Urgency', styles.heading))
+        story.append(Paragraph(analysis['timeline_urgency'], styles.body))
+        story.append(Spacer(1, 0.2*inch))
+    
+    # Pain Points
+    if analysis.get('pain_points'):
+        story.append(Paragraph('Pain Points', styles.heading))
+        for point in analysis['pain_points']:
+            story.append(Paragraph(f'• {point}', styles.body))
+            story.append(Spacer(1, 0.1*inch))
+        story.append(Spacer(1, 0.1*inch))
+    
+    # Negotiation Strategy
+    if analysis.get('negotiation_strategy'):
+        story.append(Paragraph('Negotiation Strategy', styles.heading))
+        for strategy in analysis['negotiation_strategy']:
+            story.append(Paragraph(f'• {strategy}', styles.body))
+            story.append(Spacer(1, 0.1*inch))
+        story.append(Spacer(1, 0.1*inch))
+    
+    # Recommended Offer Approach
+    if analysis.get('recommended_offer_approach'):
+        story.append(Paragraph('Recommended Offer Approach', styles.heading))
+        offer = analysis['recommended_offer_approach']
+        offer_data = []
+        if offer.get('offer_range'):
+            offer_data.append(['Offer Range', offer['offer_range']])
+        if offer.get('closing_timeline'):
+            offer_data.append(['Closing Timeline', offer['closing_timeline']])
+        if offer.get('terms'):
+            offer_data.append(['Terms', offer['terms']])
+        if offer.get('presentation_style'):
+            offer_data.append(['Presentation Style', offer['presentation_style']])
+        
+        if offer_data:
+            offer_table = Table(offer_data, colWidths=[2*inch, 4*inch])
+            offer_table.setStyle(styles.offer_table)
+            story.append(offer_table)
+            story.append(Spacer(1, 0.2*inch))
+    
+    # Red Flags
+    if analysis.get('red_flags'):
+        story.append(Paragraph('Red Flags & Concerns', styles.heading))
+        for flag in analysis['red_flags']:
+            story.append(Paragraph(f'⚠ {flag}', styles.body))
+            story.append(Spacer(1, 0.1*inch))
+    
+    doc.build(story)
+    return buffer.getvalue()
+
+
+def analysis_key(analysis: Dict) -> str:
+    """Stable hash of an analysis (key order doesn't matter)"""
+    payload = json.dumps(analysis, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ReportCache:
+    """Rendered reports by analysis hash, least recently used evicted past max_bytes"""
+    
+    def __init__(self, max_bytes: int = PDF_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.reports: collections.OrderedDict = collections.OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            pdf = self.reports.get(key)
+            if pdf is None:
+                self.misses += 1
+                return None
+            self.reports.move_to_end(key)
+            self.hits += 1
+            return pdf
+    
+    def put(self, key: str, pdf: bytes):
+        if len(pdf) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.reports.pop(key, None)
+            if previous is not None:
+                self.bytes -= len(previous)
+            self.reports[key] = pdf
+            self.bytes += len(pdf)
+            while self.bytes > self.max_bytes:
+                _, evicted = self.reports.popitem(last=False)
+                self.bytes -= len(evicted)
+    
+    def get_stats(self) -> Dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.reports),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None
+            }
+
+
+def render_report(analysis: Dict) -> bytes:
+    """The report PDF for an analysis, from the cache when it was exported earlier this minute"""
+    generated = datetime.now().strftime("%B %d, %Y at %I:%M %p")
+    key = f"{analysis_key(analysis)}:{generated}"
+    pdf = report_cache.get(key)
+    if pdf is None:
+        pdf = build_report(analysis, generated)
+        report_cache.put(key, pdf)
+    return pdf
+
+
+# Global report cache instance
+report_cache = ReportCache()
@@ -0,0 +1,253 @@
+"""
+Per-user request rate limiting shared by every gunicorn worker
+Each route has two token buckets per caller, one for the user_id and one for the
+client IP, and a request is refused when either is empty, so neither a fresh
+user_id nor a fresh address gets a caller a new allowance. The IP bucket has its
+own, higher limit (RATE_LIMITS_IP), since an office NAT or a server-side
+integration puts many users behind one address; callers without a user_id get the
+per-user limit for their IP as well. `count` requests may be made at once, and
+tokens refill at count/period per second. Buckets live in a small memory-mapped
+file, so a check is a hash, a lock and a few struct operations on shared memory,
+with no database round trip.
+
+A bucket is stored as the time it will be full again (GCRA), which needs no
+per-rule state to tell an idle, full bucket from a busy one. Slots come in groups
+of GROUP_SLOTS, and a key's bucket lives in the group its hash picks; a slot held
+by another key is only taken over once that key's bucket is idle and full, so a
+hash collision never hands out a fresh bucket. A check locks only the groups it
+touches, with byte-range locks owned by the thread's own descriptor (Linux open
+file description locks), which exclude other threads and other workers alike.
+Elsewhere the whole file is locked.
+"""
+import os
+import math
+import mmap
+import time
+import fcntl
+import struct
+import hashlib
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# endpoint=count/seconds, comma separated (endpoints are the Flask view function names)
+RATE_LIMITS = os.environ.get('RATE_LIMITS', 'analyze_transcript=30/60')
+# Same format, per client IP; endpoints only in RATE_LIMITS get IP_LIMIT_FACTOR times their per-user count
+RATE_LIMITS_IP = os.environ.get('RATE_LIMITS_IP', 'analyze_transcript=300/60')
+RATE_LIMIT_FILE = os.environ.get('RATE_LIMIT_FILE', 'rate_limits.bin')
+RATE_LIMIT_SLOTS = int(os.environ.get('RATE_LIMIT_SLOTS', 65536))
+
+IP_LIMIT_FACTOR = 10
+# Slots a key may occupy: the group its hash picks
+GROUP_SLOTS = 8
+# Callers whose buckets are remembered; the cache starts over once it is full
+PLAN_CACHE_KEYS = 16384
+
+# File format marker and slot count
+HEADER = struct.Struct('<8sQ')
+MAGIC = b'RATELIM3'
+# A group holds its slots' key fingerprints (0 = empty), then the times their buckets are full again
+OWNERS = struct.Struct(f'<{GROUP_SLOTS}Q')
+FULL_ATS = struct.Struct(f'<{GROUP_SLOTS}d')
+OWNER = struct.Struct('<Q')
+FULL_AT = struct.Struct('<d')
+GROUP_SIZE = OWNERS.size + FULL_ATS.size
+# struct flock: type, whence, start, length, pid
+FLOCK = struct.Struct('hhqqi')
+# Per-process fcntl locks can't tell threads apart (and report false deadlocks between workers)
+OFD_LOCKS = hasattr(fcntl, 'F_OFD_SETLKW')
+
+
+def parse_rate_limits(spec: str) -> Dict[str, Tuple[int, float]]:
+    """'analyze_transcript=30/60,export_pdf=10/60' -> {endpoint: (count, period_seconds)}"""
+    rules = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        endpoint, _, rate = item.partition('=')
+        count, _, period = rate.partition('/')
+        try:
+            rules[endpoint.strip()] = (int(count), float(period or 1))
+        except ValueError:
+            raise ValueError(f"Invalid rate limit {item.strip()!r} (expected endpoint=count/seconds)")
+    return rules
+
+
+class RateLimiter:
+    """Token buckets in a memory-mapped file; slots are claimed by the hash of their key"""
+    
+    def __init__(self, path: str = RATE_LIMIT_FILE, rules: Optional[Dict[str, Tuple[int, float]]] = None,
+                 slots: int = RATE_LIMIT_SLOTS, ip_rules: Optional[Dict[str, Tuple[int, float]]] = None):
+        self.path = path
+        self.rules = parse_rate_limits(RATE_LIMITS) if rules is None else rules
+        if ip_rules is None:
+            ip_rules = parse_rate_limits(RATE_LIMITS_IP) if rules is None else {}
+        self.ip_rules = {endpoint: (count * IP_LIMIT_FACTOR, period) for endpoint, (count, period) in self.rules.items()}
+        self.ip_rules.update(ip_rules)
+        self.groups = max(1, slots // GROUP_SLOTS)
+        # Each thread's own descriptor for the file, so its locks are its own
+        self._local = threading.local()
+        # Without OFD locks threads share the whole-file flock, so they need a lock too
+        self.file_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+        # Refused because every slot of a key's group holds another key's busy bucket
+        self.crowded = 0
+        # Buckets of recent callers, so a repeat request skips formatting and hashing keys
+        self._plans: Dict[Tuple, Tuple] = {}
+        
+        size = HEADER.size + self.groups * GROUP_SIZE
+        self.fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self.fd, HEADER.size, 0)
+            if len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, self.groups * GROUP_SLOTS):
+                # New file, an older layout or a different slot count: start with empty buckets
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, size)
+                os.pwrite(self.fd, HEADER.pack(MAGIC, self.groups * GROUP_SLOTS), 0)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self.fd, size)
+    
+    def check(self, endpoint: Optional[str], user_id: Optional[str], client_ip: str) -> int:
+        """
+        Take a token from the user's and the client IP's bucket for this request
+        Returns 0 if it may proceed, else the seconds until both have a token.
+        Without a user_id the per-user limit applies to the client IP.
+        """
+        plan = self._plans.get((endpoint, user_id, client_ip))
+        if plan is None:
+            plan = self._plan(endpoint, user_id, client_ip)
+        buckets, ranges = plan
+        if not buckets:
+            return 0
+        
+        if OFD_LOCKS:
+            fd = self._thread_fd()
+            for lock, _ in ranges:
+                fcntl.fcntl(fd, fcntl.F_OFD_SETLKW, lock)
+            try:
+                allowed, wait, crowded = self._take(buckets, time.time())
+            finally:
+                for _, unlock in ranges:
+                    fcntl.fcntl(fd, fcntl.F_OFD_SETLK, unlock)
+        else:
+            with self.file_lock:
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+                try:
+                    allowed, wait, crowded = self._take(buckets, time.time())
+                finally:
+                    fcntl.flock(self.fd, fcntl.LOCK_UN)
+        
+        with self.lock:
+            self.crowded += crowded
+            if allowed:
+                self.allowed += 1
+            else:
+                self.limited += 1
+        return 0 if allowed else max(1, math.ceil(wait))
+    
+    def _plan(self, endpoint: Optional[str], user_id: Optional[str], client_ip: str) -> Tuple:
+        """
+        (buckets, group lock ranges) for a caller, remembered for the next request
+        Buckets are (fingerprint, group offset, seconds per token, seconds a bucket may run
+        ahead of now and still hold a token: count - 1 tokens' worth). Ranges are (lock, unlock)
+        arguments in file order, so two checks never wait on each other in turn.
+        """
+        keys = []
+        rule = self.rules.get(endpoint)
+        if rule is not None:
+            keys.append((f"{endpoint}\0user\0{user_id}" if user_id else f"{endpoint}\0anonymous\0{client_ip}", rule))
+        ip_rule = self.ip_rules.get(endpoint)
+        if ip_rule is not None:
+            keys.append((f"{endpoint}\0ip\0{client_ip}", ip_rule))
+        
+        buckets = []
+        for key, (count, period) in keys:
+            fingerprint = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+            # 0 marks an empty slot
+            fingerprint = fingerprint or 1
+            group = fingerprint % self.groups
+            interval = period / count
+            buckets.append((fingerprint, HEADER.size + group * GROUP_SIZE, interval, (count - 1) * interval))
+        ranges = tuple((FLOCK.pack(fcntl.F_WRLCK, os.SEEK_SET, offset, GROUP_SIZE, 0),
+                        FLOCK.pack(fcntl.F_UNLCK, os.SEEK_SET, offset, GROUP_SIZE, 0))
+                       for offset in sorted({offset for _, offset, _, _ in buckets}))
+        
+        plan = (tuple(buckets), ranges)
+        if len(self._plans) >= PLAN_CACHE_KEYS:
+            self._plans.clear()
+        self._plans[(endpoint, user_id, client_ip)] = plan
+        return plan
+    
+    def _thread_fd(self) -> int:
+        fd = getattr(self._local, 'fd', None)
+        if fd is None:
+            # A new open file description; os.dup() would share this one's locks
+            fd = self._local.fd = os.open(f"/proc/self/fd/{self.fd}", os.O_RDWR)
+        return fd
+    
+    def _take(self, buckets: Tuple, now: float) -> Tuple[bool, float, int]:
+        """(allowed, seconds to wait, buckets without a slot), spending a token from each bucket only if all have one"""
+        shared = self._map
+        wait = 0.0
+        crowded = 0
+        found = []
+        for fingerprint, group_offset, interval, burst in buckets:
+            owners = OWNERS.unpack_from(shared, group_offset)
+            if fingerprint in owners:
+                offset = group_offset + 8 * owners.index(fingerprint)
+                full_at = FULL_AT.unpack_from(shared, offset + OWNERS.size)[0]
+                if full_at < now:
+                    full_at = now
+                # Already ours: only the time needs writing
+                owner = 0
+            else:
+                offset, full_at = self._free_slot(owners, group_offset, now, found)
+                if offset is None:
+                    # Every slot in its group is busy: refuse rather than share or reset a bucket
+                    crowded += 1
+                    wait = max(wait, full_at - now)
+                    continue
+                owner = fingerprint
+            if full_at - now - burst > wait:
+                wait = full_at - now - burst
+            found.append((offset, owner, full_at + interval))
+        
+        allowed = wait <= 0
+        if allowed:
+            for offset, owner, full_at in found:
+                if owner:
+                    OWNER.pack_into(shared, offset, owner)
+                FULL_AT.pack_into(shared, offset + OWNERS.size, full_at)
+        return allowed, wait, crowded
+    
+    def _free_slot(self, owners: Tuple, group_offset: int, now: float, found: List) -> Tuple[Optional[int], float]:
+        """
+        (offset, full_at) of a slot a key new to its group can take: an empty one, or one whose
+        bucket is idle and full (nothing is lost by resetting it), and not already picked by this
+        check. Returns (None, soonest full_at) when every slot in the group holds a busy bucket.
+        """
+        full_ats = FULL_ATS.unpack_from(self._map, group_offset + OWNERS.size)
+        picked = {offset for offset, _, _ in found}
+        for slot, (owner, full_at) in enumerate(zip(owners, full_ats)):
+            offset = group_offset + 8 * slot
+            if offset not in picked and (owner == 0 or full_at <= now):
+                return offset, now
+        return None, min(full_ats)
+    
+    def get_stats(self) -> Dict:
+        """Decisions made by this worker, and the configured limits"""
+        with self.lock:
+            return {
+                'allowed': self.allowed,
+                'limited': self.limited,
+                'crowded': self.crowded,
+                'rules': {endpoint: f"{count}/{period:g}s" for endpoint, (count, period) in self.rules.items()},
+                'ip_rules': {endpoint: f"{count}/{period:g}s" for endpoint, (count, period) in self.ip_rules.items()}
+            }
+
+
+# Global rate limiter instance
+rate_limiter = RateLimiter()
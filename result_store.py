@@ -0,0 +1,72 @@
+"""
+Compact storage for finished job results
+Results are kept as gzip-compressed JSON, and large ones are spilled to disk
+"""
+import os
+import gzip
+import json
+from typing import Any
+
+from upload_janitor import track_upload_file
+
+RESULTS_FOLDER = os.environ.get('RESULTS_FOLDER', 'results')
+
+# Compressed results larger than this are written to RESULTS_FOLDER
+RESULT_SPILL_BYTES = int(os.environ.get('RESULT_SPILL_BYTES', 32 * 1024))
+
+# Small fixed overhead of a StoredResult object itself
+STORED_RESULT_BASE_BYTES = 200
+
+
+class StoredResult:
+    """A serialized job result, held compressed in memory or in a file on disk"""
+    __slots__ = ('data', 'path', 'raw_size', 'compressed_size')
+    
+    def __init__(self, data: bytes = None, path: str = None, raw_size: int = 0, compressed_size: int = 0):
+        self.data = data
+        self.path = path
+        self.raw_size = raw_size
+        self.compressed_size = compressed_size
+    
+    @property
+    def memory_bytes(self) -> int:
+        """Bytes this result keeps resident in memory"""
+        return STORED_RESULT_BASE_BYTES + (len(self.data) if self.data is not None else 0)
+    
+    def compressed_bytes(self) -> bytes:
+        """Return the gzip-compressed JSON body"""
+        if self.data is not None:
+            return self.data
+        with open(self.path, 'rb') as f:
+            return f.read()
+    
+    def load(self) -> Any:
+        """Decompress and decode the result"""
+        return json.loads(gzip.decompress(self.compressed_bytes()))
+    
+    def discard(self):
+        """Remove the spill file, if any"""
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def store_result(job_id: str, result: Any) -> StoredResult:
+    """Serialize and compress a result, spilling it to disk if it is large"""
+    raw = json.dumps(result, default=str).encode('utf-8')
+    compressed = gzip.compress(raw, compresslevel=6, mtime=0)
+    
+    if len(compressed) <= RESULT_SPILL_BYTES:
+        return StoredResult(data=compressed, raw_size=len(raw), compressed_size=len(compressed))
+    
+    if not os.path.exists(RESULTS_FOLDER):
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+    
+    path = os.path.join(RESULTS_FOLDER, f"{job_id}.json.gz")
+    tmp_path = f"{path}.tmp"
+    # Collected by the janitor if this process dies before the job is reaped
+    track_upload_file(path)
+    with open(tmp_path, 'wb') as f:
+        f.write(compressed)
+    os.replace(tmp_path, path)
+    
+    return StoredResult(path=path, raw_size=len(raw), compressed_size=len(compressed))
@@ -0,0 +1,155 @@
+"""
+Compact on-disk store for transcript segments
+Each job's segments are one file: start and end times as float32 arrays, byte
+and character offsets as uint32 arrays, and the segment texts as a single
+UTF-8 blob. Files are memory-mapped and the arrays read in place, so slicing a
+long call by time or mapping a character offset to a timestamp touches only
+the pages it needs.
+
+Layout (little-endian):
+    header   b'SEG1', segment count n, text blob size
+    starts   float32[n]
+    ends     float32[n]
+    bytes    uint32[n + 1]  byte offset of each segment's text in the blob
+    chars    uint32[n + 1]  character offset of each segment's text
+    text     UTF-8 blob
+"""
+import os
+import mmap
+import bisect
+import struct
+from array import array
+from typing import Dict, List, Optional
+
+from upload_janitor import track_upload_file
+
+SEGMENTS_FOLDER = os.environ.get('SEGMENTS_FOLDER', 'segments')
+
+MAGIC = b'SEG1'
+HEADER = struct.Struct('<4sII')
+
+
+class Segments:
+    """Read-only view of one job's segments, backed by a memory map"""
+    
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, text_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"Not a segment file: {path}")
+        
+        # Arrays are cast straight from the map (the format is little-endian, like our hosts)
+        view = self._view = memoryview(self._map)
+        offset = HEADER.size
+        self.starts = view[offset:offset + 4 * count].cast('f')
+        offset += 4 * count
+        self.ends = view[offset:offset + 4 * count].cast('f')
+        offset += 4 * count
+        self.byte_offsets = view[offset:offset + 4 * (count + 1)].cast('I')
+        offset += 4 * (count + 1)
+        self.char_offsets = view[offset:offset + 4 * (count + 1)].cast('I')
+        offset += 4 * (count + 1)
+        self._text_start = offset
+        self.count = count
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    def text(self, index: int) -> str:
+        start = self._text_start + self.byte_offsets[index]
+        end = self._text_start + self.byte_offsets[index + 1]
+        return self._map[start:end].decode('utf-8')
+    
+    def __getitem__(self, index: int) -> Dict:
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return {
+            'start': round(self.starts[index], 3),
+            'end': round(self.ends[index], 3),
+            'text': self.text(index)
+        }
+    
+    def slice_time(self, start: float, end: float) -> List[Dict]:
+        """Segments overlapping [start, end) seconds"""
+        # Segments are in time order, so both ends are a binary search
+        first = bisect.bisect_right(self.ends, start)
+        last = bisect.bisect_left(self.starts, end, lo=first)
+        return [self[index] for index in range(first, last)]
+    
+    def time_at_char(self, char_offset: int) -> Optional[float]:
+        """
+        Timestamp of a character offset in the concatenated segment text
+        Interpolated within the segment it falls in.
+        """
+        if not self.count:
+            return None
+        index = min(max(0, bisect.bisect_right(self.char_offsets, char_offset) - 1), self.count - 1)
+        length = self.char_offsets[index + 1] - self.char_offsets[index]
+        fraction = min(1.0, max(0.0, (char_offset - self.char_offsets[index]) / length)) if length else 0.0
+        return round(self.starts[index] + (self.ends[index] - self.starts[index]) * fraction, 3)
+    
+    def close(self):
+        for view in (self.starts, self.ends, self.byte_offsets, self.char_offsets, self._view):
+            view.release()
+        self._map.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SegmentStore:
+    def __init__(self, folder: str = SEGMENTS_FOLDER):
+        """Initialize segment storage in the given folder"""
+        self.folder = folder
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+    
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.folder, f"{job_id}.seg")
+    
+    def save(self, job_id: str, segments: List[Dict]):
+        """Atomically write a job's segments ({start, end, text} dicts in time order)"""
+        starts = array('f', (segment['start'] for segment in segments))
+        ends = array('f', (segment['end'] for segment in segments))
+        byte_offsets = array('I', [0])
+        char_offsets = array('I', [0])
+        blobs = []
+        for segment in segments:
+            encoded = segment['text'].encode('utf-8')
+            blobs.append(encoded)
+            byte_offsets.append(byte_offsets[-1] + len(encoded))
+            char_offsets.append(char_offsets[-1] + len(segment['text']))
+        
+        path = self._path(job_id)
+        tmp_path = f"{path}.tmp"
+        # Collected by the janitor if this process dies before the job is reaped
+        track_upload_file(path)
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(segments), byte_offsets[-1]))
+            for values in (starts, ends, byte_offsets, char_offsets):
+                values.tofile(f)
+            f.write(b''.join(blobs))
+        os.replace(tmp_path, path)
+    
+    def open(self, job_id: str) -> Optional[Segments]:
+        """Memory-map a job's segments, or None if it has none"""
+        try:
+            return Segments(self._path(job_id))
+        except (FileNotFoundError, ValueError):
+            return None
+    
+    def delete(self, job_id: str):
+        """Remove a job's segments once the job is gone"""
+        try:
+            os.remove(self._path(job_id))
+        except FileNotFoundError:
+            pass
+
+
+# Global segment store instance
+segment_store = SegmentStore()
@@ -0,0 +1,80 @@
+"""
+Soak test for JobQueue memory bounds
+
+Usage:
+    python soak_job_queue.py [--jobs 10000] [--transcript-kb 20] [--max-growth-mb 10]
+
+Pushes jobs through the full queued -> processing -> complete cycle, each
+holding a transcript about the size of a 20-minute call, and samples the
+process RSS as it goes. Results spill to a scratch folder. The run fails
+(exit status 1) if RSS grows by more than --max-growth-mb between the first
+sample taken once the queue is full (JOB_MAX_ENTRIES jobs) and the end.
+"""
+import os
+import sys
+import argparse
+import resource
+import tempfile
+
+
+def _rss_mb():
+    """Current resident set size, falling back to the peak where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that JobQueue memory stays flat over many jobs')
+    parser.add_argument('--jobs', type=int, default=10000)
+    parser.add_argument('--transcript-kb', type=int, default=20, help='transcript size per job')
+    parser.add_argument('--samples', type=int, default=10)
+    parser.add_argument('--max-growth-mb', type=float, default=10)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as folder:
+        # Spilled results, segment files and checkpoints go to the scratch folder, not the working tree
+        os.environ['RESULTS_FOLDER'] = os.path.join(folder, 'results')
+        os.environ['SEGMENTS_FOLDER'] = os.path.join(folder, 'segments')
+        os.environ['CHECKPOINT_FOLDER'] = os.path.join(folder, 'job_checkpoints')
+        from job_queue import JobQueue, JOB_MAX_ENTRIES
+        
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_transcripts.md')) as f:
+            sample = f.read()
+        transcript = (sample * (args.transcript_kb * 1024 // len(sample) + 1))[:args.transcript_kb * 1024]
+        
+        queue = JobQueue()
+        every = max(1, args.jobs // args.samples)
+        samples = []
+        for i in range(args.jobs):
+            job_id = queue.create_job('soak')
+            queue.update_job(job_id, status='processing', progress=30)
+            queue.update_job(job_id, status='complete', progress=100, result={
+                'success': True,
+                # Unique per job so nothing is shared between results
+                'transcript': f"{i}\n{transcript}",
+                'analysis': {'motivation_score': i % 10, 'key_phrases': [f"phrase {i}"] * 50}
+            })
+            if (i + 1) % every == 0:
+                samples.append((i + 1, _rss_mb(), queue.get_stats()))
+        
+        for done, rss, stats in samples:
+            print(f"{done:>7} jobs  RSS {rss:7.1f} MB  {stats['entries']} entries  "
+                  f"~{stats['approx_bytes'] / (1024 * 1024):.1f} MB accounted  "
+                  f"{stats['spilled_results']} spilled")
+    
+    # Measure growth from when the queue reached its entry budget (before that it is supposed to grow)
+    baseline_done, baseline_rss, _ = next((sample for sample in samples if sample[0] >= JOB_MAX_ENTRIES), samples[0])
+    growth = samples[-1][1] - baseline_rss
+    print(f"RSS growth since {baseline_done} jobs: {growth:+.1f} MB (limit {args.max_growth_mb:g} MB)")
+    if growth > args.max_growth_mb:
+        print('FAIL: memory keeps growing with the number of jobs')
+        sys.exit(1)
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
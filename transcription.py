@@ -0,0 +1,185 @@
+"""
+Chunked parallel transcription for long recordings
+Long audio is split at quiet points into 16 kHz mono WAV chunks that each fit
+the Whisper upload limit, the chunks are transcribed concurrently, and the
+results are stitched back into one verbose_json-style transcript.
+"""
+import os
+import math
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import SimpleNamespace
+from typing import Callable, List, Optional
+
+from audio_processing import decode_frames, speech_threshold, copy_frames, open_wav_writer, FRAME_MS
+
+TRANSCRIBE_CHUNKED = os.environ.get('TRANSCRIBE_CHUNKED', 'true').lower() in ('1', 'true', 'yes')
+# 16 kHz mono WAV is ~1.9MB per minute, so 10 minutes stays well under 25MB
+TRANSCRIBE_MAX_CHUNK_SECONDS = int(os.environ.get('TRANSCRIBE_MAX_CHUNK_SECONDS', 600))
+TRANSCRIBE_MIN_CHUNK_SECONDS = int(os.environ.get('TRANSCRIBE_MIN_CHUNK_SECONDS', 120))
+TRANSCRIBE_MAX_CONCURRENCY = int(os.environ.get('TRANSCRIBE_MAX_CONCURRENCY', 4))
+# Overlap added around a cut that had to be made mid-speech
+TRANSCRIBE_OVERLAP_SECONDS = float(os.environ.get('TRANSCRIBE_OVERLAP_SECONDS', 2))
+
+# How far either side of the ideal boundary to look for a pause
+CUT_SEARCH_SECONDS = 30
+# Length of the quiet stretch a cut is centred on
+CUT_WINDOW_MS = 300
+
+
+def should_chunk(duration_seconds: Optional[float], file_size_mb: float, max_file_size_mb: float) -> bool:
+    """Whether a recording should go through chunked transcription"""
+    if not TRANSCRIBE_CHUNKED:
+        return False
+    if file_size_mb > max_file_size_mb:
+        return True
+    return duration_seconds is not None and duration_seconds > TRANSCRIBE_MAX_CHUNK_SECONDS
+
+
+def transcribe_chunked(transcribe: Callable, filepath: str,
+                       on_progress: Optional[Callable[[int, int], None]] = None,
+                       stop: Optional[threading.Event] = None) -> SimpleNamespace:
+    """
+    Transcribe filepath in parallel chunks
+    
+    transcribe(path) must return a verbose_json transcription (text, duration, segments).
+    Returns the same shape, with segment times on the whole recording's timeline, plus
+    billed_duration: the chunk durations added up, overlaps included, as Whisper bills them.
+    """
+    work_dir = chunk_dir(filepath)
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        raw_path = os.path.join(work_dir, 'audio.pcm')
+        energies = decode_frames(filepath, raw_path, stop)
+        total_frames = len(energies)
+        chunks = _plan_chunks(energies)
+        
+        # Write every chunk before sending any, so no decode work races the uploads
+        chunk_paths = []
+        with open(raw_path, 'rb') as raw:
+            for index, (start, end) in enumerate(chunks):
+                path = os.path.join(work_dir, f"chunk_{index:03d}.wav")
+                with open_wav_writer(path) as out:
+                    copy_frames(raw, out, start, end)
+                chunk_paths.append(path)
+        os.remove(raw_path)
+        
+        results = [None] * len(chunks)
+        done = 0
+        with ThreadPoolExecutor(max_workers=min(TRANSCRIBE_MAX_CONCURRENCY, len(chunks)),
+                                thread_name_prefix='transcribe') as executor:
+            futures = {executor.submit(transcribe, path): index for index, path in enumerate(chunk_paths)}
+            try:
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+                    done += 1
+                    if on_progress:
+                        on_progress(done, len(chunks))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        
+        return _stitch(chunks, results, total_frames)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def chunk_dir(filepath: str) -> str:
+    """Scratch directory transcribe_chunked() uses for filepath's chunks"""
+    return f"{os.path.splitext(filepath)[0]}_chunks"
+
+
+def _plan_chunks(energies) -> List[tuple]:
+    """
+    [(start_frame, end_frame)] covering the recording, cut at pauses near even boundaries
+    Chunk count is rounded up to a multiple of the concurrency cap so every round is full.
+    """
+    total_frames = len(energies)
+    frames_per_second = 1000 // FRAME_MS
+    duration = total_frames / frames_per_second
+    if duration <= TRANSCRIBE_MIN_CHUNK_SECONDS:
+        return [(0, total_frames)]
+    
+    count = math.ceil(duration / TRANSCRIBE_MAX_CHUNK_SECONDS)
+    count = math.ceil(count / TRANSCRIBE_MAX_CONCURRENCY) * TRANSCRIBE_MAX_CONCURRENCY
+    count = max(1, min(count, int(duration // TRANSCRIBE_MIN_CHUNK_SECONDS)))
+    
+    threshold = speech_threshold(energies)
+    window = max(1, CUT_WINDOW_MS // FRAME_MS)
+    search = CUT_SEARCH_SECONDS * frames_per_second
+    overlap = int(TRANSCRIBE_OVERLAP_SECONDS * frames_per_second)
+    
+    # Prefix sums make every window's mean energy O(1)
+    prefix = [0]
+    for energy in energies:
+        prefix.append(prefix[-1] + energy)
+    
+    chunks = []
+    start = 0
+    for index in range(1, count):
+        ideal = round(total_frames * index / count)
+        low = max(start + window, ideal - search)
+        high = min(total_frames - window, ideal + search)
+        best = min(range(low, high), key=lambda i: prefix[i + window] - prefix[i], default=ideal)
+        cut = best + window // 2
+        quiet = (prefix[best + window] - prefix[best]) / window < threshold
+        
+        if quiet:
+            chunks.append((start, cut))
+            start = cut
+        else:
+            # No pause nearby: overlap the chunks and dedupe segments when stitching
+            chunks.append((start, min(total_frames, cut + overlap)))
+            start = max(0, cut - overlap)
+    chunks.append((start, total_frames))
+    return chunks
+
+
+def _stitch(chunks: List[tuple], results: List, total_frames: int) -> SimpleNamespace:
+    """Merge chunk transcriptions, shifting timestamps and dropping overlap duplicates"""
+    frame_seconds = FRAME_MS / 1000
+    segments = []
+    for index, ((start, end), result) in enumerate(zip(chunks, results)):
+        offset = start * frame_seconds
+        previous_end = chunks[index - 1][1] if index else start
+        next_start = chunks[index + 1][0] if index + 1 < len(chunks) else end
+        # Overlapping chunks hand over at the middle of their overlap
+        lower = (start + previous_end) / 2 * frame_seconds if previous_end > start else None
+        upper = (end + next_start) / 2 * frame_seconds if next_start < end else None
+        
+        for segment in (getattr(result, 'segments', None) or []):
+            seg_start = segment.start + offset
+            seg_end = segment.end + offset
+            middle = (seg_start + seg_end) / 2
+            if lower is not None and middle < lower:
+                continue
+            if upper is not None and middle >= upper:
+                continue
+            text = segment.text
+            if segments and _normalize(segments[-1].text) == _normalize(text) and seg_start < segments[-1].end:
+                continue
+            segments.append(SimpleNamespace(start=round(seg_start, 3), end=round(seg_end, 3), text=text))
+        
+        if not getattr(result, 'segments', None) and result.text.strip():
+            segments.append(SimpleNamespace(start=round(offset, 3), end=round(end * frame_seconds, 3),
+                                            text=result.text))
+    
+    # Each chunk is billed in full, so audio in an overlap is paid for twice
+    billed_duration = sum(
+        getattr(result, 'duration', None) or (end - start) * frame_seconds
+        for (start, end), result in zip(chunks, results)
+    )
+    
+    return SimpleNamespace(
+        text=''.join(segment.text for segment in segments).strip(),
+        duration=total_frames * frame_seconds,
+        billed_duration=billed_duration,
+        segments=segments,
+        chunks=len(chunks)
+    )
+
+
+def _normalize(text: str) -> str:
+    return ' '.join(text.lower().split())
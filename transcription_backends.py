@@ -0,0 +1,125 @@
+"""
+Transcription backends
+The OpenAI Whisper API is the default. The local backend runs faster-whisper
+(CTranslate2, int8 on CPU) inside the worker and returns the same verbose_json
+shape, so transcription can move onto our own cores when API latency or cost
+spikes. faster-whisper is only imported when the local backend is used.
+"""
+import os
+import threading
+from types import SimpleNamespace
+from typing import Optional
+
+TRANSCRIPTION_BACKEND = os.environ.get('TRANSCRIPTION_BACKEND', 'openai').lower()
+# Any faster-whisper model name (tiny, base, small, medium, ...) or a local model directory
+LOCAL_WHISPER_MODEL = os.environ.get('LOCAL_WHISPER_MODEL', 'small')
+LOCAL_WHISPER_COMPUTE_TYPE = os.environ.get('LOCAL_WHISPER_COMPUTE_TYPE', 'int8')
+# CPU threads per transcription; 0 lets CTranslate2 use every core
+LOCAL_WHISPER_THREADS = int(os.environ.get('LOCAL_WHISPER_THREADS', 0))
+# Transcriptions run at the same time per worker process; more queue behind them
+LOCAL_WHISPER_WORKERS = int(os.environ.get('LOCAL_WHISPER_WORKERS', 1))
+LOCAL_WHISPER_BEAM_SIZE = int(os.environ.get('LOCAL_WHISPER_BEAM_SIZE', 1))
+LOCAL_WHISPER_LANGUAGE = os.environ.get('LOCAL_WHISPER_LANGUAGE', 'en') or None
+
+
+class TranscriptionCancelled(Exception):
+    pass
+
+
+class TranscriptionBackend:
+    """Turns an audio file into a verbose_json-style transcription (text, duration, segments)"""
+    name = None
+    # Whether files must fit the Whisper API upload limit (and so may be chunked or compressed)
+    size_limited = False
+    
+    def preload(self):
+        """Load anything expensive up front; called once per worker process at startup"""
+    
+    def transcribe(self, filepath: str, client=None, stop: Optional[threading.Event] = None):
+        raise NotImplementedError
+
+
+class OpenAIBackend(TranscriptionBackend):
+    """whisper-1 over the API; cancelled by aborting the client's transport"""
+    name = 'openai'
+    size_limited = True
+    
+    def transcribe(self, filepath: str, client=None, stop: Optional[threading.Event] = None):
+        with open(filepath, 'rb') as audio_data:
+            return client.audio.transcriptions.create(
+                model="whisper-1",
+                file=audio_data,
+                response_format="verbose_json"
+            )
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """faster-whisper on the CPU, one model shared by every job in the process"""
+    name = 'local'
+    
+    def __init__(self, model_name: str = LOCAL_WHISPER_MODEL, compute_type: str = LOCAL_WHISPER_COMPUTE_TYPE,
+                 cpu_threads: int = LOCAL_WHISPER_THREADS, num_workers: int = LOCAL_WHISPER_WORKERS):
+        self.model_name = model_name
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.num_workers = num_workers
+        self.lock = threading.Lock()
+        self._model = None
+    
+    @property
+    def model(self):
+        with self.lock:
+            if self._model is None:
+                from faster_whisper import WhisperModel
+                self._model = WhisperModel(
+                    self.model_name,
+                    device='cpu',
+                    compute_type=self.compute_type,
+                    cpu_threads=self.cpu_threads,
+                    num_workers=self.num_workers
+                )
+            return self._model
+    
+    def preload(self):
+        try:
+            self.model
+            print(f"Loaded local Whisper model {self.model_name} ({self.compute_type})")
+        except Exception as e:
+            # Left for the first job to report
+            print(f"Failed to preload local Whisper model {self.model_name}: {str(e)}")
+    
+    def transcribe(self, filepath: str, client=None, stop: Optional[threading.Event] = None):
+        segments_iter, info = self.model.transcribe(
+            filepath,
+            beam_size=LOCAL_WHISPER_BEAM_SIZE,
+            language=LOCAL_WHISPER_LANGUAGE
+        )
+        # Segments are decoded lazily, so cancellation takes effect between them
+        segments = []
+        for segment in segments_iter:
+            if stop is not None and stop.is_set():
+                raise TranscriptionCancelled()
+            segments.append(SimpleNamespace(start=segment.start, end=segment.end, text=segment.text))
+        
+        return SimpleNamespace(
+            text=''.join(segment.text for segment in segments).strip(),
+            duration=info.duration,
+            language=info.language,
+            segments=segments
+        )
+
+
+BACKENDS = {
+    OpenAIBackend.name: OpenAIBackend,
+    LocalWhisperBackend.name: LocalWhisperBackend
+}
+
+
+def create_backend(name: str) -> TranscriptionBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown TRANSCRIPTION_BACKEND '{name}'. Choose from: {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
+
+
+# Global backend instance
+transcription_backend = create_backend(TRANSCRIPTION_BACKEND)
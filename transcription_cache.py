@@ -0,0 +1,122 @@
+"""
+Persistent transcription cache keyed by audio fingerprint
+The same recording is often uploaded more than once (re-exports of identical
+bytes, voicemails sent twice, renamed files). Transcripts are stored as
+gzip-compressed JSON under the SHA-256 of the uploaded bytes, which the upload
+stream computes anyway, and the least recently used entries are evicted once
+the folder passes its size limit. Shared by every worker through the filesystem.
+"""
+import os
+import gzip
+import json
+import threading
+from typing import Dict, Optional
+
+TRANSCRIPTION_CACHE_ENABLED = os.environ.get('TRANSCRIPTION_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+TRANSCRIPTION_CACHE_FOLDER = os.environ.get('TRANSCRIPTION_CACHE_FOLDER', 'transcription_cache')
+TRANSCRIPTION_CACHE_MAX_BYTES = int(os.environ.get('TRANSCRIPTION_CACHE_MAX_MB', 200)) * 1024 * 1024
+
+
+class TranscriptionCache:
+    """
+    Transcripts on disk, one gzip file per (backend, audio hash)
+    Reads touch the file's mtime, so eviction by oldest mtime is least recently used.
+    """
+    
+    def __init__(self, folder: str = TRANSCRIPTION_CACHE_FOLDER, max_bytes: int = TRANSCRIPTION_CACHE_MAX_BYTES,
+                 enabled: bool = TRANSCRIPTION_CACHE_ENABLED):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if enabled and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+    
+    def _path(self, audio_sha256: str, backend: str) -> str:
+        # Different backends produce different transcripts of the same audio
+        return os.path.join(self.folder, f"{backend}_{audio_sha256}.json.gz")
+    
+    def get(self, audio_sha256: Optional[str], backend: str) -> Optional[Dict]:
+        """Cached transcription ({transcript, segments, duration_minutes}), or None"""
+        if not self.enabled or not audio_sha256:
+            return None
+        path = self._path(audio_sha256, backend)
+        try:
+            with open(path, 'rb') as f:
+                entry = json.loads(gzip.decompress(f.read()))
+            os.utime(path)
+        except (OSError, ValueError):
+            # Missing, evicted by another worker mid-read, or corrupt
+            entry = None
+        
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+    
+    def put(self, audio_sha256: Optional[str], backend: str, entry: Dict):
+        """Store a transcription, evicting old entries if the cache is over its limit"""
+        if not self.enabled or not audio_sha256:
+            return
+        path = self._path(audio_sha256, backend)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(gzip.compress(json.dumps(entry).encode('utf-8'), compresslevel=6, mtime=0))
+            os.replace(tmp_path, path)
+            self._evict()
+        except OSError as e:
+            # Caching only saves money; never fail the job over it
+            print(f"Failed to cache transcription {audio_sha256[:12]}: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    def _entries(self):
+        """[(mtime, size, path)] of every cached transcription, oldest first"""
+        entries = []
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if not entry.name.endswith('.json.gz'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        return entries
+    
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+    
+    def get_stats(self) -> Dict:
+        """Hit rate for this process, plus the size of the shared cache"""
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        entries = self._entries() if self.enabled else []
+        return {
+            'enabled': self.enabled,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes
+        }
+
+
+# Global cache instance
+transcription_cache = TranscriptionCache()
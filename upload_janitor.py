@@ -0,0 +1,353 @@
+"""
+Background cleanup of the upload folder
+Workers delete their files on the happy and error paths, but crashes, restarts
+and abandoned intermediates (trimmed, compressed or chunked copies) leave files
+behind. Every file written to the upload folder is recorded in an append-only
+manifest, so each janitor pass reads only the entries added since the last one.
+New entries are stat'ed while they may still be written, then kept in a heap
+ordered by expiry with a running byte total, so a pass otherwise only looks at
+the files that are due; the folder itself is walked once, to seed the manifest
+the first time. Files older than the age limit are removed, and the oldest go
+first while the folder is over its quota. Files belonging to a job that still
+has a checkpoint are never touched.
+
+The same janitor collects spilled results and segment files (results/ and
+segments/) that a crashed worker never got to delete.
+"""
+import os
+import re
+import time
+import fcntl
+import heapq
+import shutil
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from job_checkpoints import checkpoint_store
+
+UPLOAD_MAX_AGE_SECONDS = int(float(os.environ.get('UPLOAD_MAX_AGE_HOURS', 24)) * 3600)
+UPLOAD_QUOTA_BYTES = int(os.environ.get('UPLOAD_QUOTA_MB', 2048)) * 1024 * 1024
+UPLOAD_JANITOR_INTERVAL_SECONDS = int(os.environ.get('UPLOAD_JANITOR_INTERVAL_SECONDS', 300))
+
+# Files this new may still be streaming in; the quota never takes them
+UPLOAD_GRACE_SECONDS = 600
+
+MANIFEST_NAME = '.manifest'
+MANIFEST_LOCK_NAME = '.manifest.lock'
+
+# Upload names and every copy derived from them start with the upload's stem
+UPLOAD_STEM = re.compile(r'^(audio_\d{8}_\d{6}(?:_[0-9a-f]{8})?)')
+
+
+def track_upload_file(path: str):
+    """
+    Record a file (or directory) about to be written in the upload folder
+    Safe to call before the file exists and from any process.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    line = f"{int(time.time())}\t{os.path.basename(path)}\n".encode('utf-8')
+    lock_fd = os.open(os.path.join(folder, MANIFEST_LOCK_NAME), os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        # Shared: appends from many writers interleave by line; compaction takes it exclusively
+        fcntl.flock(lock_fd, fcntl.LOCK_SH)
+        fd = os.open(os.path.join(folder, MANIFEST_NAME), os.O_CREAT | os.O_WRONLY | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    finally:
+        os.close(lock_fd)
+
+
+def _stem(name: str) -> str:
+    match = UPLOAD_STEM.match(name)
+    return match.group(1) if match else os.path.splitext(name)[0]
+
+
+def _size(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                total += entry.stat().st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+class UploadJanitor:
+    def __init__(self, folder: str, max_age_seconds: int = UPLOAD_MAX_AGE_SECONDS,
+                 quota_bytes: Optional[int] = UPLOAD_QUOTA_BYTES):
+        self.folder = folder
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        self.max_age_seconds = max_age_seconds
+        # None for no quota (age limit only)
+        self.quota_bytes = quota_bytes
+        self.manifest_path = os.path.join(folder, MANIFEST_NAME)
+        self.lock_path = os.path.join(folder, MANIFEST_LOCK_NAME)
+        self.lock = threading.Lock()
+        # name -> time it was registered
+        self.tracked: Dict[str, float] = {}
+        # Entries that may not exist yet or may still be growing; stat'ed every pass
+        self.settling: Set[str] = set()
+        # name -> size and expiry time of the files seen on disk
+        self.sizes: Dict[str, int] = {}
+        self.expiry: Dict[str, float] = {}
+        # (expiry, name), oldest first; entries whose expiry has since changed are skipped
+        self.expiry_heap: List[Tuple[float, str]] = []
+        # Includes files their workers deleted after settling, until they come due or are recounted
+        self.tracked_bytes = 0
+        self.manifest_inode = None
+        self.manifest_offset = 0
+        self.manifest_lines = 0
+        self.deleted_files = 0
+        self.deleted_bytes = 0
+        self.last_checked = 0
+        self.recounts = 0
+        self.last_run = None
+        self._thread = None
+        self._stop = threading.Event()
+    
+    def start(self, interval: int = UPLOAD_JANITOR_INTERVAL_SECONDS):
+        """Start the background cleanup thread (idempotent)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), name='upload-janitor', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+    
+    def _run(self, interval: int):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error cleaning {self.folder} folder: {str(e)}")
+            if self._stop.wait(interval):
+                return
+    
+    def run_once(self) -> int:
+        """One cleanup pass; returns the number of files removed"""
+        with self.lock:
+            if not os.path.exists(self.manifest_path):
+                self._seed_manifest()
+            self._read_manifest()
+            
+            now = time.time()
+            self.last_checked = 0
+            self._settle(now)
+            removed = self._expire(now)
+            if self.quota_bytes is not None and self.tracked_bytes > self.quota_bytes:
+                removed += self._enforce_quota(now)
+            
+            self.last_run = datetime.now().isoformat()
+            if self.manifest_lines > 2 * len(self.tracked) + 1000:
+                self._compact_manifest()
+            if len(self.expiry_heap) > 2 * len(self.expiry) + 1000:
+                self._rebuild_heap()
+            return removed
+    
+    def _stat(self, name: str) -> Optional[Tuple[float, int]]:
+        """(mtime, size) of a tracked file or directory, or None if it doesn't exist"""
+        self.last_checked += 1
+        path = os.path.join(self.folder, name)
+        try:
+            return os.stat(path).st_mtime, _size(path)
+        except FileNotFoundError:
+            return None
+    
+    def _record(self, name: str, mtime: float, size: int):
+        self.tracked_bytes += size - self.sizes.get(name, 0)
+        self.sizes[name] = size
+        expires_at = mtime + self.max_age_seconds
+        if self.expiry.get(name) != expires_at:
+            self.expiry[name] = expires_at
+            heapq.heappush(self.expiry_heap, (expires_at, name))
+    
+    def _forget(self, name: str):
+        self.tracked.pop(name, None)
+        self.settling.discard(name)
+        self.expiry.pop(name, None)
+        self.tracked_bytes -= self.sizes.pop(name, 0)
+    
+    def _settle(self, now: float):
+        """Stat new and recently written entries until their size is final"""
+        for name in list(self.settling):
+            info = self._stat(name)
+            if info is None:
+                if now - self.tracked[name] > UPLOAD_GRACE_SECONDS:
+                    # Already cleaned up by its worker (or never created)
+                    self._forget(name)
+                continue
+            mtime, size = info
+            self._record(name, mtime, size)
+            if now - mtime > UPLOAD_GRACE_SECONDS:
+                self.settling.discard(name)
+    
+    def _expire(self, now: float) -> int:
+        """Remove files past the age limit; only entries that are due are looked at"""
+        removed = 0
+        active = None
+        deferred = []
+        while self.expiry_heap and self.expiry_heap[0][0] <= now:
+            expires_at, name = heapq.heappop(self.expiry_heap)
+            if self.expiry.get(name) != expires_at:
+                continue
+            info = self._stat(name)
+            if info is None:
+                self._forget(name)
+                continue
+            mtime, size = info
+            if mtime + self.max_age_seconds > now:
+                # Written to since it was recorded
+                self._record(name, mtime, size)
+                continue
+            if active is None:
+                active = self._active_stems()
+            if _stem(name) in active:
+                # An unfinished job still needs it; look again later
+                deferred.append(name)
+                continue
+            self._delete(name, size)
+            removed += 1
+        
+        for name in deferred:
+            self.expiry[name] = now + UPLOAD_GRACE_SECONDS
+            heapq.heappush(self.expiry_heap, (self.expiry[name], name))
+        return removed
+    
+    def _enforce_quota(self, now: float) -> int:
+        """Remove the oldest files until the folder is back under its quota"""
+        # The running total may still count files their workers deleted; recount before removing anything
+        for name in list(self.tracked):
+            if name in self.settling:
+                continue
+            info = self._stat(name)
+            if info is None:
+                self._forget(name)
+            else:
+                self._record(name, *info)
+        self._rebuild_heap()
+        self.recounts += 1
+        
+        removed = 0
+        active = self._active_stems()
+        for expires_at, name in sorted(self.expiry_heap):
+            if self.tracked_bytes <= self.quota_bytes:
+                break
+            mtime = expires_at - self.max_age_seconds
+            if now - mtime <= UPLOAD_GRACE_SECONDS or _stem(name) in active:
+                continue
+            self._delete(name, self.sizes[name])
+            removed += 1
+        return removed
+    
+    def _rebuild_heap(self):
+        self.expiry_heap = [(expires_at, name) for name, expires_at in self.expiry.items()]
+        heapq.heapify(self.expiry_heap)
+    
+    def _delete(self, name: str, size: int):
+        path = os.path.join(self.folder, name)
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+        else:
+            self.deleted_files += 1
+            self.deleted_bytes += size
+            print(f"Janitor removed {path} ({size / (1024 * 1024):.1f}MB)")
+        self._forget(name)
+    
+    def _active_stems(self) -> Set[str]:
+        """Stems of uploads that unfinished jobs (in any worker) still need"""
+        stems = set()
+        for job_id in checkpoint_store.list_job_ids():
+            checkpoint = checkpoint_store.load(job_id)
+            if checkpoint and checkpoint.get('filepath'):
+                stems.add(_stem(os.path.basename(checkpoint['filepath'])))
+        return stems
+    
+    def _read_manifest(self):
+        """Pick up entries appended since the last pass"""
+        try:
+            f = open(self.manifest_path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != self.manifest_inode:
+                # Compacted (possibly by another worker): start over from the new file
+                self.manifest_inode = inode
+                self.manifest_offset = 0
+                self.manifest_lines = 0
+            f.seek(self.manifest_offset)
+            data = f.read()
+        
+        # A line still being appended is left for the next pass
+        complete = data[:data.rfind(b'\n') + 1]
+        self.manifest_offset += len(complete)
+        for line in complete.decode('utf-8', errors='replace').splitlines():
+            registered_at, _, name = line.partition('\t')
+            if name and name not in (MANIFEST_NAME, MANIFEST_LOCK_NAME):
+                if name not in self.tracked:
+                    self.tracked[name] = float(registered_at or 0)
+                    self.settling.add(name)
+                self.manifest_lines += 1
+    
+    def _seed_manifest(self):
+        """Track whatever is already in the folder (first start only)"""
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.name not in (MANIFEST_NAME, MANIFEST_LOCK_NAME):
+                    track_upload_file(entry.path)
+    
+    def _compact_manifest(self):
+        """Rewrite the manifest with only the files still tracked"""
+        lock_fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker is compacting, or a writer is mid-append; try next pass
+                return
+            # Entries appended since this pass read the manifest must survive
+            self._read_manifest()
+            tmp_path = f"{self.manifest_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                for name, registered_at in self.tracked.items():
+                    f.write(f"{int(registered_at)}\t{name}\n")
+            os.replace(tmp_path, self.manifest_path)
+            self.manifest_inode = os.stat(self.manifest_path).st_ino
+            self.manifest_offset = os.path.getsize(self.manifest_path)
+            self.manifest_lines = len(self.tracked)
+        finally:
+            os.close(lock_fd)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        usage = shutil.disk_usage(self.folder)
+        with self.lock:
+            return {
+                'tracked_files': len(self.tracked),
+                'tracked_bytes': self.tracked_bytes,
+                'last_pass_checked_files': self.last_checked,
+                'recounts': self.recounts,
+                'quota_bytes': self.quota_bytes,
+                'max_age_hours': self.max_age_seconds / 3600,
+                'deleted_files': self.deleted_files,
+                'deleted_bytes': self.deleted_bytes,
+                'disk_total_bytes': usage.total,
+                'disk_free_bytes': usage.free,
+                'last_run': self.last_run
+            }
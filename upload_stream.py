@@ -0,0 +1,213 @@
+"""
+Streaming upload ingest
+Multipart file parts are written in chunks straight to their final location in
+the upload folder, hashed and counted as they arrive, and rejected part-way
+through once a per-user or global limit is exceeded. A request takes one upload
+slot however many files it carries, and all of its files count against one byte
+allowance.
+"""
+import os
+import uuid
+import hashlib
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from flask import Request
+from werkzeug.exceptions import HTTPException
+from werkzeug.utils import secure_filename
+
+from upload_janitor import track_upload_file
+
+# Concurrent uploads allowed per user (per worker process)
+UPLOAD_MAX_PER_USER = int(os.environ.get('UPLOAD_MAX_PER_USER', 2))
+# Bytes of uploads in progress across all users (per worker process)
+UPLOAD_MAX_INFLIGHT_BYTES = int(os.environ.get('UPLOAD_MAX_INFLIGHT_MB', 512)) * 1024 * 1024
+
+
+class UploadRejected(HTTPException):
+    """Raised while the body is still streaming so the rest of it is never written"""
+    
+    def __init__(self, code: int, description: str):
+        super().__init__(description)
+        self.code = code
+
+
+class UploadLimiter:
+    """Tracks uploads in progress so limits can be enforced before a body is complete"""
+    
+    def __init__(self, max_per_user: int = UPLOAD_MAX_PER_USER,
+                 max_inflight_bytes: int = UPLOAD_MAX_INFLIGHT_BYTES):
+        self.max_per_user = max_per_user
+        self.max_inflight_bytes = max_inflight_bytes
+        self.lock = threading.Lock()
+        self.inflight_bytes = 0
+        self.per_user: Dict[str, int] = {}
+    
+    def start(self, user_id: str):
+        """Register a new upload request for user_id"""
+        with self.lock:
+            if self.per_user.get(user_id, 0) >= self.max_per_user:
+                raise UploadRejected(429, f'Too many uploads in progress. At most {self.max_per_user} at a time.')
+            self.per_user[user_id] = self.per_user.get(user_id, 0) + 1
+    
+    def add_bytes(self, size: int):
+        with self.lock:
+            if self.inflight_bytes + size > self.max_inflight_bytes:
+                raise UploadRejected(503, 'Server is busy receiving other uploads. Please retry shortly.')
+            self.inflight_bytes += size
+    
+    def release_bytes(self, size: int):
+        with self.lock:
+            self.inflight_bytes -= size
+    
+    def finish(self, user_id: str):
+        """Return an upload request's slot"""
+        with self.lock:
+            self.per_user[user_id] -= 1
+            if not self.per_user[user_id]:
+                del self.per_user[user_id]
+    
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'uploads_in_progress': sum(self.per_user.values()),
+                'inflight_bytes': self.inflight_bytes,
+                'max_inflight_bytes': self.max_inflight_bytes
+            }
+
+
+class StreamedUpload:
+    """
+    File-like sink for one multipart file part
+    Unless claim()ed by the view, the file is deleted when the request ends.
+    """
+    
+    def __init__(self, path: str, request: 'StreamingRequest'):
+        self.path = path
+        self.request = request
+        self.limiter = request.limiter
+        self.size = 0
+        self.claimed = False
+        self.finished = False
+        self._hash = hashlib.sha256()
+        
+        track_upload_file(path)
+        self.file = open(path, 'w+b')
+    
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+    
+    def write(self, data: bytes) -> int:
+        self.request.count_upload_bytes(len(data))
+        self.limiter.add_bytes(len(data))
+        self.size += len(data)
+        self._hash.update(data)
+        return self.file.write(data)
+    
+    def read(self, size: int = -1) -> bytes:
+        return self.file.read(size)
+    
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if offset == 0 and whence == 0:
+            # Werkzeug rewinds once the part is complete; make sure it's on disk
+            self.file.flush()
+        return self.file.seek(offset, whence)
+    
+    def tell(self) -> int:
+        return self.file.tell()
+    
+    def flush(self):
+        self.file.flush()
+    
+    def close(self):
+        self.file.close()
+    
+    def claim(self):
+        """Keep the file after the request ends (it now belongs to a job)"""
+        self.file.flush()
+        self.claimed = True
+    
+    def finish(self):
+        """Release limits and delete the file unless it was claimed (idempotent)"""
+        if self.finished:
+            return
+        self.finished = True
+        self.file.close()
+        self.limiter.release_bytes(self.size)
+        if not self.claimed and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class StreamingRequest(Request):
+    """
+    Request whose uploaded files stream to upload_folder instead of a spooled temp file
+    Form fields aren't parsed yet when files arrive, so uploads are limited as the user
+    from ?user_id= or X-User-Id, or as the client IP when neither is sent.
+    """
+    upload_folder = 'uploads'
+    limiter = UploadLimiter()
+    # Returns how many bytes a user may still upload, or None for no limit
+    user_byte_limit: Optional[Callable[[str], Optional[int]]] = None
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.streamed_uploads: List[StreamedUpload] = []
+        # Set when the first file part arrives; one slot and allowance cover every part
+        self.upload_limit_key: Optional[str] = None
+        self.upload_max_bytes: Optional[int] = None
+        self.upload_bytes = 0
+    
+    @property
+    def upload_user_id(self) -> Optional[str]:
+        """
+        The user from ?user_id= or X-User-Id, or None if neither was sent
+        Raises UploadRejected if both are sent and name different users.
+        """
+        query_user_id = self.args.get('user_id')
+        header_user_id = self.headers.get('X-User-Id')
+        if query_user_id and header_user_id and query_user_id != header_user_id:
+            raise UploadRejected(400, 'user_id in the URL and the X-User-Id header must match')
+        return query_user_id or header_user_id
+    
+    def count_upload_bytes(self, size: int):
+        """Charge size bytes to this request's allowance, across all of its files"""
+        if self.upload_max_bytes is not None and self.upload_bytes + size > self.upload_max_bytes:
+            raise UploadRejected(429, 'Upload exceeds your remaining monthly audio allowance.')
+        self.upload_bytes += size
+    
+    def _start_upload(self):
+        user_id = self.upload_user_id
+        if user_id:
+            key = user_id
+            if StreamingRequest.user_byte_limit:
+                self.upload_max_bytes = StreamingRequest.user_byte_limit(user_id)
+        else:
+            # The billed user is only known once the form is parsed; minutes are checked then
+            key = f"ip:{self.access_route[-1] if self.access_route else ''}"
+        self.limiter.start(key)
+        self.upload_limit_key = key
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.upload_limit_key is None:
+            self._start_upload()
+        
+        extension = secure_filename(filename.rsplit('.', 1)[-1]) if filename and '.' in filename else ''
+        name = f"audio_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.{extension or 'bin'}"
+        
+        upload = StreamedUpload(os.path.join(self.upload_folder, name), self)
+        self.streamed_uploads.append(upload)
+        return upload
+    
+    def close(self):
+        try:
+            super().close()
+        finally:
+            try:
+                for upload in self.streamed_uploads:
+                    upload.finish()
+            finally:
+                if self.upload_limit_key is not None:
+                    self.limiter.finish(self.upload_limit_key)
+                    self.upload_limit_key = None
@@ -5,8 +5,36 @@ Tracks audio transcription minutes and analysis counts per user per month
 
 import json
 import os
+import glob
+import collections
+import uuid
+import fcntl
+import atexit
+import sqlite3
+import time
+import threading
 from datetime import datetime
-from typing import Dict, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
+
+USAGE_DB = os.environ.get('USAGE_DB', 'usage.db')
+# Reservations of jobs that never settled (e.g. lost in a crash) stop counting after this
+USAGE_RESERVATION_TTL_SECONDS = int(os.environ.get('USAGE_RESERVATION_TTL_SECONDS', 24 * 3600))
+# Write-behind mode: buffer increments in memory (behind a journal) and write them in batches
+USAGE_WRITE_BEHIND = os.environ.get('USAGE_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+USAGE_FLUSH_INTERVAL_SECONDS = float(os.environ.get('USAGE_FLUSH_INTERVAL_SECONDS', 1.0))
+USAGE_FLUSH_MAX_PENDING = int(os.environ.get('USAGE_FLUSH_MAX_PENDING', 500))
+# Usage stats are served from memory for this long (this worker's writes invalidate them at once)
+USAGE_STATS_CACHE_SECONDS = float(os.environ.get('USAGE_STATS_CACHE_SECONDS', 5))
+USAGE_STATS_CACHE_MAX_USERS = 10000
+
+# User ids per IN (...) lookup, within SQLite's default bound-parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+# Usage counters per (user_id, month); buffered totals keep this order (followed by last_updated)
+INCREMENT_FIELDS = ('audio_minutes', 'analysis_count', 'trimmed_minutes', 'cached_minutes')
+
+# Users without an assigned plan are counted under this one
+DEFAULT_PLAN = 'default'
 
 class UsageTracker:
     def __init__(self, data_file='usage_data.json'):
@@ -14,6 +42,17 @@ class UsageTracker:
         self.data_file = data_file
         self.monthly_audio_limit = 500  # minutes per user per month
         self.monthly_analysis_limit = 200  # analyses per user per month
+        # reservation_id -> (user_id, minutes) held for jobs still running
+        self.reservations: Dict[str, Tuple[str, float]] = {}
+        self.reservation_lock = threading.Lock()
+        # user_id -> (expires_at, stats), least recently used first
+        self.stats_cache: collections.OrderedDict = collections.OrderedDict()
+        self.stats_cache_lock = threading.Lock()
+        self.stats_cache_seconds = USAGE_STATS_CACHE_SECONDS
+        # Bumped by every write; stats computed across a write are not cached
+        self.stats_writes = 0
+        self.stats_cache_hits = 0
+        self.stats_cache_misses = 0
         self.data = self._load_data()
     
     def _load_data(self) -> Dict:
@@ -50,36 +89,96 @@ class UsageTracker:
         
         return self.data[user_id][current_month]
     
+    def _lookup_user_data(self, user_id: str) -> Dict:
+        """Current month's usage without creating an entry for it (zeros if there is none)"""
+        month_data = self.data.get(user_id, {}).get(self._get_current_month())
+        if month_data is None:
+            return {'audio_minutes': 0.0, 'analysis_count': 0}
+        return month_data
+    
+    def _lookup_users_data(self, user_ids: List[str]) -> Dict[str, Dict]:
+        return {user_id: self._lookup_user_data(user_id) for user_id in user_ids}
+    
+    def _invalidate_stats(self, user_id: Optional[str] = None):
+        """Drop cached stats after a write (every user's if user_id is None)"""
+        with self.stats_cache_lock:
+            self.stats_writes += 1
+            if user_id is None:
+                self.stats_cache.clear()
+            else:
+                self.stats_cache.pop(user_id, None)
+    
     def check_audio_limit(self, user_id: str, duration_minutes: float) -> Tuple[bool, float]:
         """
         Check if user can transcribe audio of given duration
         Returns: (can_proceed, remaining_minutes)
         """
-        user_data = self._get_user_data(user_id)
-        used_minutes = user_data['audio_minutes']
+        user_data = self._lookup_user_data(user_id)
+        used_minutes = user_data['audio_minutes'] + self._reserved_minutes(user_id)
         remaining = self.monthly_audio_limit - used_minutes
         
         can_proceed = (used_minutes + duration_minutes) <= self.monthly_audio_limit
         return can_proceed, remaining
     
+    def reserve_audio_minutes(self, user_id: str, duration_minutes: float, reservation_id: str) -> Tuple[bool, float]:
+        """
+        Hold duration_minutes of the user's allowance for a job until it is settled or released
+        Returns: (reserved, remaining_minutes before the reservation)
+        """
+        with self.reservation_lock:
+            can_proceed, remaining = self.check_audio_limit(user_id, duration_minutes)
+            if can_proceed:
+                self.reservations[reservation_id] = (user_id, duration_minutes)
+                self._invalidate_stats(user_id)
+            return can_proceed, remaining
+    
+    def commit_audio_reservation(self, reservation_id: str, user_id: str, duration_minutes: float,
+                                 trimmed_minutes: float = 0.0, cached_minutes: float = 0.0):
+        """Replace a reservation with the usage actually incurred"""
+        with self.reservation_lock:
+            self.reservations.pop(reservation_id, None)
+            self.record_audio_usage(user_id, duration_minutes, trimmed_minutes=trimmed_minutes,
+                                    cached_minutes=cached_minutes)
+    
+    def release_audio_reservation(self, reservation_id: str):
+        """Give back a reservation whose job failed or was cancelled (no-op once settled)"""
+        with self.reservation_lock:
+            reservation = self.reservations.pop(reservation_id, None)
+        if reservation:
+            self._invalidate_stats(reservation[0])
+    
+    def _reserved_minutes(self, user_id: str) -> float:
+        return sum(minutes for owner, minutes in list(self.reservations.values()) if owner == user_id)
+    
+    def _reserved_minutes_many(self, user_ids: List[str]) -> Dict[str, float]:
+        return {user_id: self._reserved_minutes(user_id) for user_id in user_ids}
+    
     def check_analysis_limit(self, user_id: str) -> Tuple[bool, int]:
         """
         Check if user can perform another analysis
         Returns: (can_proceed, remaining_analyses)
         """
-        user_data = self._get_user_data(user_id)
+        user_data = self._lookup_user_data(user_id)
         used_count = user_data['analysis_count']
         remaining = self.monthly_analysis_limit - used_count
         
         can_proceed = used_count < self.monthly_analysis_limit
         return can_proceed, remaining
     
-    def record_audio_usage(self, user_id: str, duration_minutes: float):
-        """Record audio transcription usage"""
+    def record_audio_usage(self, user_id: str, duration_minutes: float, trimmed_minutes: float = 0.0,
+                           cached_minutes: float = 0.0):
+        """
+        Record audio transcription usage
+        trimmed_minutes: silence cut before transcription; cached_minutes: audio served
+        from the transcription cache. Neither counts towards the limit.
+        """
         user_data = self._get_user_data(user_id)
         user_data['audio_minutes'] += duration_minutes
+        user_data['trimmed_minutes'] = user_data.get('trimmed_minutes', 0.0) + trimmed_minutes
+        user_data['cached_minutes'] = user_data.get('cached_minutes', 0.0) + cached_minutes
         user_data['last_updated'] = datetime.now().isoformat()
         self._save_data()
+        self._invalidate_stats(user_id)
     
     def record_analysis_usage(self, user_id: str):
         """Record analysis usage"""
@@ -87,15 +186,71 @@ class UsageTracker:
         user_data['analysis_count'] += 1
         user_data['last_updated'] = datetime.now().isoformat()
         self._save_data()
+        self._invalidate_stats(user_id)
     
     def get_usage_stats(self, user_id: str) -> Dict:
-        """Get current usage statistics for user"""
-        user_data = self._get_user_data(user_id)
+        """Get current usage statistics for user (read-only, briefly cached)"""
+        now = time.monotonic()
+        with self.stats_cache_lock:
+            writes = self.stats_writes
+            cached = self.stats_cache.get(user_id)
+            if cached and cached[0] > now:
+                self.stats_cache.move_to_end(user_id)
+                self.stats_cache_hits += 1
+                return dict(cached[1])
+        
+        stats = self._usage_stats(self._lookup_user_data(user_id), self._reserved_minutes(user_id))
+        self._cache_stats({user_id: stats}, writes, now)
+        return dict(stats)
+    
+    def get_usage_stats_many(self, user_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Current usage statistics for several users
+        Recently read users come from the stats cache; the rest are looked up together.
+        """
+        now = time.monotonic()
+        stats = {}
+        with self.stats_cache_lock:
+            writes = self.stats_writes
+            for user_id in user_ids:
+                cached = self.stats_cache.get(user_id)
+                if cached and cached[0] > now:
+                    self.stats_cache.move_to_end(user_id)
+                    stats[user_id] = cached[1]
+            self.stats_cache_hits += len(stats)
+        
+        missing = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in stats]
+        if missing:
+            users_data = self._lookup_users_data(missing)
+            reserved = self._reserved_minutes_many(missing)
+            fresh = {user_id: self._usage_stats(users_data[user_id], reserved[user_id]) for user_id in missing}
+            self._cache_stats(fresh, writes, now)
+            stats.update(fresh)
         
+        # Copies, so callers can't change what is cached
+        return {user_id: dict(stats[user_id]) for user_id in user_ids}
+    
+    def _cache_stats(self, fresh: Dict[str, Dict], writes: int, now: float):
+        """Cache stats read since the write count was `writes`"""
+        with self.stats_cache_lock:
+            self.stats_cache_misses += len(fresh)
+            # A write landed while these were read; they may already be stale
+            if self.stats_writes != writes or self.stats_cache_seconds <= 0:
+                return
+            for user_id, user_stats in fresh.items():
+                self.stats_cache[user_id] = (now + self.stats_cache_seconds, user_stats)
+                self.stats_cache.move_to_end(user_id)
+            while len(self.stats_cache) > USAGE_STATS_CACHE_MAX_USERS:
+                self.stats_cache.popitem(last=False)
+    
+    def _usage_stats(self, user_data: Dict, reserved_minutes: float) -> Dict:
         return {
             'audio_minutes_used': user_data['audio_minutes'],
-            'audio_minutes_remaining': self.monthly_audio_limit - user_data['audio_minutes'],
+            'audio_minutes_reserved': reserved_minutes,
+            'audio_minutes_remaining': self.monthly_audio_limit - user_data['audio_minutes'] - reserved_minutes,
             'audio_minutes_limit': self.monthly_audio_limit,
+            'audio_minutes_trimmed': user_data.get('trimmed_minutes', 0.0),
+            'audio_minutes_cached': user_data.get('cached_minutes', 0.0),
             'analyses_used': user_data['analysis_count'],
             'analyses_remaining': self.monthly_analysis_limit - user_data['analysis_count'],
             'analyses_limit': self.monthly_analysis_limit,
@@ -117,3 +272,772 @@ class UsageTracker:
                 }
         
         return all_stats
+
+    def get_stats(self) -> Dict:
+        """Storage and stats cache metrics for /api/metrics"""
+        return dict(self._stats_cache_stats(), write_behind=False)
+    
+    def _stats_cache_stats(self) -> Dict:
+        with self.stats_cache_lock:
+            lookups = self.stats_cache_hits + self.stats_cache_misses
+            return {
+                'stats_cache_users': len(self.stats_cache),
+                'stats_cache_hits': self.stats_cache_hits,
+                'stats_cache_misses': self.stats_cache_misses,
+                'stats_cache_hit_rate': round(self.stats_cache_hits / lookups, 3) if lookups else None
+            }
+
+
+class SQLiteUsageTracker(UsageTracker):
+    """
+    UsageTracker backed by SQLite, shared by every gunicorn worker
+    Each record is a single atomic upsert, so concurrent workers and threads never
+    overwrite each other's increments. An existing usage JSON file is imported once.
+    Monthly totals are kept current by triggers, so history is queried page by page
+    from the database and never held in memory.
+    """
+    
+    def __init__(self, data_file='usage_data.json', db_path: str = USAGE_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS usage (
+                user_id TEXT NOT NULL,
+                month TEXT NOT NULL,
+                audio_minutes REAL NOT NULL DEFAULT 0,
+                analysis_count INTEGER NOT NULL DEFAULT 0,
+                trimmed_minutes REAL NOT NULL DEFAULT 0,
+                cached_minutes REAL NOT NULL DEFAULT 0,
+                last_updated TEXT,
+                PRIMARY KEY (user_id, month)
+            )
+        """)
+        conn.execute("CREATE TABLE IF NOT EXISTS usage_meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS usage_reservations (
+                reservation_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                minutes REAL NOT NULL,
+                settled INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_reservations_user ON usage_reservations (user_id, settled)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_month ON usage (month, audio_minutes)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS usage_plans (
+                user_id TEXT PRIMARY KEY,
+                plan TEXT NOT NULL,
+                updated_at TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS usage_monthly (
+                month TEXT PRIMARY KEY,
+                users INTEGER NOT NULL DEFAULT 0,
+                audio_minutes REAL NOT NULL DEFAULT 0,
+                analysis_count INTEGER NOT NULL DEFAULT 0,
+                trimmed_minutes REAL NOT NULL DEFAULT 0,
+                cached_minutes REAL NOT NULL DEFAULT 0
+            )
+        """)
+        # Rollups move with every upsert into usage (rows are only ever inserted or incremented)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS usage_monthly_insert AFTER INSERT ON usage BEGIN
+                INSERT INTO usage_monthly
+                    (month, users, audio_minutes, analysis_count, trimmed_minutes, cached_minutes)
+                VALUES (NEW.month, 1, NEW.audio_minutes, NEW.analysis_count, NEW.trimmed_minutes, NEW.cached_minutes)
+                ON CONFLICT (month) DO UPDATE SET
+                    users = users + 1,
+                    audio_minutes = audio_minutes + excluded.audio_minutes,
+                    analysis_count = analysis_count + excluded.analysis_count,
+                    trimmed_minutes = trimmed_minutes + excluded.trimmed_minutes,
+                    cached_minutes = cached_minutes + excluded.cached_minutes;
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS usage_monthly_update AFTER UPDATE ON usage BEGIN
+                UPDATE usage_monthly SET
+                    audio_minutes = audio_minutes + NEW.audio_minutes - OLD.audio_minutes,
+                    analysis_count = analysis_count + NEW.analysis_count - OLD.analysis_count,
+                    trimmed_minutes = trimmed_minutes + NEW.trimmed_minutes - OLD.trimmed_minutes,
+                    cached_minutes = cached_minutes + NEW.cached_minutes - OLD.cached_minutes
+                WHERE month = NEW.month;
+            END
+        """)
+        super().__init__(data_file)
+        self._migrate_json()
+        self._build_rollups()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread; WAL lets workers read while another writes"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def _load_data(self) -> Dict:
+        # Nothing is held in memory; every read goes to the database
+        return {}
+    
+    def _save_data(self):
+        pass
+    
+    def _migrate_json(self):
+        """Import the JSON file written by UsageTracker (once, whichever worker gets there first)"""
+        if not os.path.exists(self.data_file):
+            return
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM usage_meta WHERE key = 'migrated_json'").fetchone():
+                conn.execute("COMMIT")
+                return
+            data = UsageTracker._load_data(self)
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO usage
+                    (user_id, month, audio_minutes, analysis_count, trimmed_minutes, cached_minutes, last_updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (user_id, month, usage.get('audio_minutes', 0.0), usage.get('analysis_count', 0),
+                     usage.get('trimmed_minutes', 0.0), usage.get('cached_minutes', 0.0), usage.get('last_updated'))
+                    for user_id, months in data.items()
+                    for month, usage in months.items()
+                ]
+            )
+            conn.execute(
+                "INSERT INTO usage_meta (key, value) VALUES ('migrated_json', ?)",
+                (datetime.now().isoformat(),)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        print(f"Imported usage for {len(data)} users from {self.data_file}")
+    
+    def _build_rollups(self):
+        """Compute the monthly rollups from scratch (once, for databases created before them)"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM usage_meta WHERE key = 'rollups_built'").fetchone():
+                conn.execute("COMMIT")
+                return
+            conn.execute("DELETE FROM usage_monthly")
+            conn.execute("""
+                INSERT INTO usage_monthly
+                    (month, users, audio_minutes, analysis_count, trimmed_minutes, cached_minutes)
+                SELECT month, COUNT(*), SUM(audio_minutes), SUM(analysis_count),
+                       SUM(trimmed_minutes), SUM(cached_minutes)
+                FROM usage GROUP BY month
+            """)
+            conn.execute(
+                "INSERT INTO usage_meta (key, value) VALUES ('rollups_built', ?)",
+                (datetime.now().isoformat(),)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def _get_user_data(self, user_id: str) -> Dict:
+        """Current month's usage for user_id (a snapshot; zeros if there is none yet)"""
+        row = self._connect().execute(
+            """
+            SELECT audio_minutes, analysis_count, trimmed_minutes, cached_minutes, last_updated
+            FROM usage WHERE user_id = ? AND month = ?
+            """,
+            (user_id, self._get_current_month())
+        ).fetchone()
+        if row is None:
+            return {'audio_minutes': 0.0, 'analysis_count': 0}
+        return {
+            'audio_minutes': row[0],
+            'analysis_count': row[1],
+            'trimmed_minutes': row[2],
+            'cached_minutes': row[3],
+            'last_updated': row[4]
+        }
+    
+    def _lookup_user_data(self, user_id: str) -> Dict:
+        # Reads never create rows here
+        return self._get_user_data(user_id)
+    
+    def _lookup_users_data(self, user_ids: List[str]) -> Dict[str, Dict]:
+        """Current month's usage for many users, a few hundred per query"""
+        users_data = {user_id: {'audio_minutes': 0.0, 'analysis_count': 0} for user_id in user_ids}
+        conn = self._connect()
+        for start in range(0, len(user_ids), LOOKUP_CHUNK_SIZE):
+            chunk = user_ids[start:start + LOOKUP_CHUNK_SIZE]
+            rows = conn.execute(
+                f"""
+                SELECT user_id, audio_minutes, analysis_count, trimmed_minutes, cached_minutes, last_updated
+                FROM usage WHERE month = ? AND user_id IN ({', '.join('?' * len(chunk))})
+                """,
+                (self._get_current_month(), *chunk)
+            ).fetchall()
+            for user_id, *values in rows:
+                users_data[user_id] = dict(zip(INCREMENT_FIELDS + ('last_updated',), values))
+        return users_data
+    
+    def _increment(self, user_id: str, audio_minutes: float = 0.0, analysis_count: int = 0,
+                   trimmed_minutes: float = 0.0, cached_minutes: float = 0.0,
+                   month: str = None, last_updated: str = None):
+        self._connect().execute(
+            """
+            INSERT INTO usage
+                (user_id, month, audio_minutes, analysis_count, trimmed_minutes, cached_minutes, last_updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, month) DO UPDATE SET
+                audio_minutes = audio_minutes + excluded.audio_minutes,
+                analysis_count = analysis_count + excluded.analysis_count,
+                trimmed_minutes = trimmed_minutes + excluded.trimmed_minutes,
+                cached_minutes = cached_minutes + excluded.cached_minutes,
+                last_updated = excluded.last_updated
+            """,
+            (user_id, month or self._get_current_month(), audio_minutes, analysis_count,
+             trimmed_minutes, cached_minutes, last_updated or datetime.now().isoformat())
+        )
+    
+    def record_audio_usage(self, user_id: str, duration_minutes: float, trimmed_minutes: float = 0.0,
+                           cached_minutes: float = 0.0):
+        self._increment(user_id, audio_minutes=duration_minutes, trimmed_minutes=trimmed_minutes,
+                        cached_minutes=cached_minutes)
+        self._invalidate_stats(user_id)
+    
+    def record_analysis_usage(self, user_id: str):
+        self._increment(user_id, analysis_count=1)
+        self._invalidate_stats(user_id)
+    
+    def reserve_audio_minutes(self, user_id: str, duration_minutes: float, reservation_id: str) -> Tuple[bool, float]:
+        """Check and hold in one transaction, so concurrent submissions (from any worker) can't overshoot"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM usage_reservations WHERE created_at < ?",
+                (now - USAGE_RESERVATION_TTL_SECONDS,)
+            )
+            used_minutes = self._get_user_data(user_id)['audio_minutes'] + self._reserved_minutes(user_id)
+            remaining = self.monthly_audio_limit - used_minutes
+            can_proceed = used_minutes + duration_minutes <= self.monthly_audio_limit
+            if can_proceed:
+                conn.execute(
+                    """
+                    INSERT OR IGNORE INTO usage_reservations (reservation_id, user_id, minutes, settled, created_at)
+                    VALUES (?, ?, ?, 0, ?)
+                    """,
+                    (reservation_id, user_id, duration_minutes, now)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if can_proceed:
+            self._invalidate_stats(user_id)
+        return can_proceed, remaining
+    
+    def commit_audio_reservation(self, reservation_id: str, user_id: str, duration_minutes: float,
+                                 trimmed_minutes: float = 0.0, cached_minutes: float = 0.0):
+        """
+        Settle a reservation to the actual usage in one transaction
+        Settling twice (a job resumed after a crash) records the usage only once.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT settled FROM usage_reservations WHERE reservation_id = ?",
+                (reservation_id,)
+            ).fetchone()
+            if row is None or not row[0]:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO usage_reservations (reservation_id, user_id, minutes, settled, created_at)
+                    VALUES (?, ?, 0, 1, ?)
+                    """,
+                    (reservation_id, user_id, time.time())
+                )
+                self._increment(user_id, audio_minutes=duration_minutes, trimmed_minutes=trimmed_minutes,
+                                cached_minutes=cached_minutes)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._invalidate_stats(user_id)
+    
+    def release_audio_reservation(self, reservation_id: str):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT user_id FROM usage_reservations WHERE reservation_id = ? AND settled = 0",
+            (reservation_id,)
+        ).fetchone()
+        if row is None:
+            # Already settled (the usual case once a job has finished) or never reserved
+            return
+        conn.execute(
+            "DELETE FROM usage_reservations WHERE reservation_id = ? AND settled = 0",
+            (reservation_id,)
+        )
+        self._invalidate_stats(row[0])
+    
+    def _reserved_minutes(self, user_id: str) -> float:
+        row = self._connect().execute(
+            """
+            SELECT COALESCE(SUM(minutes), 0) FROM usage_reservations
+            WHERE user_id = ? AND settled = 0 AND created_at >= ?
+            """,
+            (user_id, time.time() - USAGE_RESERVATION_TTL_SECONDS)
+        ).fetchone()
+        return row[0]
+    
+    def _reserved_minutes_many(self, user_ids: List[str]) -> Dict[str, float]:
+        reserved = dict.fromkeys(user_ids, 0.0)
+        conn = self._connect()
+        for start in range(0, len(user_ids), LOOKUP_CHUNK_SIZE):
+            chunk = user_ids[start:start + LOOKUP_CHUNK_SIZE]
+            rows = conn.execute(
+                f"""
+                SELECT user_id, SUM(minutes) FROM usage_reservations
+                WHERE settled = 0 AND created_at >= ? AND user_id IN ({', '.join('?' * len(chunk))})
+                GROUP BY user_id
+                """,
+                (time.time() - USAGE_RESERVATION_TTL_SECONDS, *chunk)
+            ).fetchall()
+            reserved.update(rows)
+        return reserved
+    
+    def get_all_usage(self) -> Dict:
+        rows = self._connect().execute(
+            "SELECT user_id, audio_minutes, analysis_count, last_updated FROM usage WHERE month = ?",
+            (self._get_current_month(),)
+        ).fetchall()
+        return {
+            user_id: {
+                'audio_minutes': audio_minutes,
+                'analysis_count': analysis_count,
+                'last_updated': last_updated or 'Unknown'
+            }
+            for user_id, audio_minutes, analysis_count, last_updated in rows
+        }
+    
+    def set_user_plan(self, user_id: str, plan: str):
+        """Assign the plan a user's usage is totalled under"""
+        self._connect().execute(
+            "INSERT OR REPLACE INTO usage_plans (user_id, plan, updated_at) VALUES (?, ?, ?)",
+            (user_id, plan, datetime.now().isoformat())
+        )
+    
+    def get_usage_page(self, start_month: str, end_month: str, limit: int = 100,
+                       after: Optional[str] = None) -> List[Dict]:
+        """
+        Per-user usage summed over start_month..end_month (inclusive, YYYY-MM), by user_id
+        Pass the last user_id of a page as `after` to get the next one. The unary +
+        keeps SQLite off the month index, so the page walks the primary key from
+        `after` and stops once it has `limit` users.
+        """
+        rows = self._connect().execute(
+            """
+            SELECT u.user_id, COALESCE(p.plan, ?), SUM(u.audio_minutes), SUM(u.analysis_count),
+                   SUM(u.trimmed_minutes), SUM(u.cached_minutes), MAX(u.last_updated)
+            FROM usage u LEFT JOIN usage_plans p ON p.user_id = u.user_id
+            WHERE u.user_id > ? AND +u.month BETWEEN ? AND ?
+            GROUP BY u.user_id ORDER BY u.user_id LIMIT ?
+            """,
+            (DEFAULT_PLAN, after or '', start_month, end_month, limit)
+        ).fetchall()
+        return [_usage_row(row) for row in rows]
+    
+    def iter_usage(self, start_month: str, end_month: str, page_size: int = 1000) -> Iterator[Dict]:
+        """Every user's usage over the range, a page at a time"""
+        after = None
+        while True:
+            page = self.get_usage_page(start_month, end_month, limit=page_size, after=after)
+            yield from page
+            if len(page) < page_size:
+                return
+            after = page[-1]['user_id']
+    
+    def get_top_users(self, start_month: str, end_month: str, order_by: str = 'audio_minutes',
+                      limit: int = 10, offset: int = 0) -> List[Dict]:
+        """Heaviest users over the range by one of INCREMENT_FIELDS"""
+        if order_by not in INCREMENT_FIELDS:
+            raise ValueError(f"Cannot rank users by {order_by}")
+        where, months = _month_clause(start_month, end_month)
+        rows = self._connect().execute(
+            f"""
+            SELECT u.user_id, COALESCE(p.plan, ?), SUM(u.audio_minutes) AS audio_minutes,
+                   SUM(u.analysis_count) AS analysis_count, SUM(u.trimmed_minutes) AS trimmed_minutes,
+                   SUM(u.cached_minutes) AS cached_minutes, MAX(u.last_updated)
+            FROM usage u LEFT JOIN usage_plans p ON p.user_id = u.user_id
+            WHERE {where}
+            GROUP BY u.user_id ORDER BY {order_by} DESC, u.user_id LIMIT ? OFFSET ?
+            """,
+            (DEFAULT_PLAN, *months, limit, offset)
+        ).fetchall()
+        return [_usage_row(row) for row in rows]
+    
+    def get_monthly_totals(self, start_month: str, end_month: str) -> List[Dict]:
+        """Precomputed totals for each month in the range, oldest first"""
+        rows = self._connect().execute(
+            f"""
+            SELECT month, users, {', '.join(INCREMENT_FIELDS)} FROM usage_monthly
+            WHERE month BETWEEN ? AND ? ORDER BY month
+            """,
+            (start_month, end_month)
+        ).fetchall()
+        return [dict(zip(('month', 'users') + INCREMENT_FIELDS, row)) for row in rows]
+    
+    def get_plan_totals(self, start_month: str, end_month: str) -> List[Dict]:
+        """Usage over the range totalled by plan (by each user's current plan)"""
+        where, months = _month_clause(start_month, end_month)
+        rows = self._connect().execute(
+            f"""
+            SELECT COALESCE(p.plan, ?) AS plan, COUNT(*), SUM(audio_minutes), SUM(analysis_count),
+                   SUM(trimmed_minutes), SUM(cached_minutes)
+            FROM (
+                SELECT u.user_id, SUM(u.audio_minutes) AS audio_minutes, SUM(u.analysis_count) AS analysis_count,
+                       SUM(u.trimmed_minutes) AS trimmed_minutes, SUM(u.cached_minutes) AS cached_minutes
+                FROM usage u WHERE {where} GROUP BY u.user_id
+            ) totals LEFT JOIN usage_plans p ON p.user_id = totals.user_id
+            GROUP BY plan ORDER BY plan
+            """,
+            (DEFAULT_PLAN, *months)
+        ).fetchall()
+        return [dict(zip(('plan', 'users') + INCREMENT_FIELDS, row)) for row in rows]
+
+
+class BufferedUsageTracker(SQLiteUsageTracker):
+    """
+    SQLiteUsageTracker that keeps usage writes off the request path
+    Each increment is appended to this process's journal (fsync'd, so it survives a
+    crash) and added to an in-memory buffer; a background thread writes the buffer
+    to the database in one transaction every flush interval, or sooner once
+    max_pending increments are waiting. Reads add the buffered increments to the
+    stored totals, so limits in this process stay exact; another worker's buffer is
+    seen once it flushes. Journals left by a process that died are replayed by the
+    next one to start.
+    
+    Reservations are still settled synchronously, since a settle must be atomic
+    with the reservation it replaces.
+    """
+    
+    def __init__(self, data_file='usage_data.json', db_path: str = USAGE_DB,
+                 flush_interval: float = USAGE_FLUSH_INTERVAL_SECONDS, max_pending: int = USAGE_FLUSH_MAX_PENDING):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # Guards the buffer and the journal, which always change together
+        self.lock = threading.Lock()
+        # Held while a batch moves from the buffer into the database, so reads never count it twice
+        self.flush_lock = threading.Lock()
+        # (user_id, month) -> [audio_minutes, analysis_count, trimmed_minutes, cached_minutes, last_updated]
+        self.pending: Dict[Tuple[str, str], list] = {}
+        self.pending_count = 0
+        self.journal_prefix = f"{db_path}.wb-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.journal_seq = 0
+        self.journal = None
+        # Journals rotated out whose increments are not in the database yet: [(path, fd)]
+        self.sealed: List[Tuple[str, int]] = []
+        # Group commit: one fdatasync covers every line written before it started
+        self.sync_lock = threading.Lock()
+        self.journal_written = 0
+        self.journal_synced = 0
+        self.flushed_batches = 0
+        self.flushed_increments = 0
+        self.last_flush = None
+        super().__init__(data_file, db_path)
+        
+        self._replay_journals()
+        self._open_journal()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='usage-flush', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+    
+    def _open_journal(self):
+        self.journal_seq += 1
+        path = f"{self.journal_prefix}-{self.journal_seq}.journal"
+        fd = os.open(path, os.O_CREAT | os.O_WRONLY | os.O_APPEND, 0o644)
+        # Held for the life of the file; replay skips journals whose owner is still running
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        self.journal = (path, fd)
+    
+    def _buffer(self, user_id: str, audio_minutes: float = 0.0, analysis_count: int = 0,
+                trimmed_minutes: float = 0.0, cached_minutes: float = 0.0):
+        month = self._get_current_month()
+        last_updated = datetime.now().isoformat()
+        line = json.dumps([user_id, month, audio_minutes, analysis_count, trimmed_minutes,
+                           cached_minutes, last_updated]) + '\n'
+        with self.lock:
+            os.write(self.journal[1], line.encode('utf-8'))
+            self.journal_written += 1
+            position = self.journal_written
+            _add(self.pending, (user_id, month), audio_minutes, analysis_count, trimmed_minutes,
+                 cached_minutes, last_updated)
+            self.pending_count += 1
+            if self.pending_count >= self.max_pending:
+                self._wake.set()
+        self._invalidate_stats(user_id)
+        
+        # Not acknowledged until the line is on disk; threads that arrive during a sync share the next one
+        with self.sync_lock:
+            if self.journal_synced >= position:
+                return
+            with self.lock:
+                target, fd = self.journal_written, self.journal[1]
+            os.fdatasync(fd)
+            self.journal_synced = max(self.journal_synced, target)
+    
+    def record_audio_usage(self, user_id: str, duration_minutes: float, trimmed_minutes: float = 0.0,
+                           cached_minutes: float = 0.0):
+        self._buffer(user_id, audio_minutes=duration_minutes, trimmed_minutes=trimmed_minutes,
+                     cached_minutes=cached_minutes)
+    
+    def record_analysis_usage(self, user_id: str):
+        self._buffer(user_id, analysis_count=1)
+    
+    def _get_user_data(self, user_id: str) -> Dict:
+        """Stored usage plus whatever this process has buffered"""
+        return self._lookup_users_data([user_id])[user_id]
+    
+    def _lookup_users_data(self, user_ids: List[str]) -> Dict[str, Dict]:
+        current_month = self._get_current_month()
+        with self.flush_lock:
+            if len(user_ids) == 1:
+                users_data = {user_ids[0]: super()._get_user_data(user_ids[0])}
+            else:
+                users_data = super()._lookup_users_data(user_ids)
+            with self.lock:
+                pending = {user_id: list(self.pending[user_id, current_month]) for user_id in user_ids
+                           if (user_id, current_month) in self.pending}
+        for user_id, values in pending.items():
+            user_data = users_data[user_id]
+            for field, value in zip(INCREMENT_FIELDS, values):
+                user_data[field] = user_data.get(field, 0) + value
+            user_data['last_updated'] = values[-1]
+        return users_data
+    
+    def get_all_usage(self) -> Dict:
+        current_month = self._get_current_month()
+        with self.flush_lock:
+            all_stats = super().get_all_usage()
+            with self.lock:
+                pending = {user_id: list(values) for (user_id, month), values in self.pending.items()
+                           if month == current_month}
+        for user_id, values in pending.items():
+            stats = all_stats.setdefault(user_id, {'audio_minutes': 0.0, 'analysis_count': 0})
+            stats['audio_minutes'] += values[0]
+            stats['analysis_count'] += values[1]
+            stats['last_updated'] = values[-1]
+        return all_stats
+    
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing usage: {str(e)}")
+    
+    def flush(self) -> int:
+        """Write buffered increments to the database in one transaction; returns how many"""
+        with self.lock:
+            if not self.pending_count and not self.sealed:
+                return 0
+        
+        conn = self._connect()
+        batch, count = {}, 0
+        # Database lock first, then flush_lock: a reservation check holds them in that order too
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            with self.flush_lock:
+                with self.lock:
+                    batch, count = self.pending, self.pending_count
+                    self.pending, self.pending_count = {}, 0
+                    if count:
+                        previous = self.journal
+                        # Lines written to it are all durable before a new journal takes over
+                        os.fdatasync(previous[1])
+                        self.journal_synced = self.journal_written
+                        self._open_journal()
+                        self.sealed.append(previous)
+                    sealed = list(self.sealed)
+                self._apply(conn, batch, [path for path, _ in sealed])
+                conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            with self.lock:
+                # Still journaled in the sealed files; retried on the next flush
+                for key, values in batch.items():
+                    _add(self.pending, key, *values)
+                self.pending_count += count
+            raise
+        
+        with self.sync_lock:
+            # A sync in progress may still be using a sealed journal's descriptor
+            for path, fd in sealed:
+                self._discard_journal(path)
+                os.close(fd)
+        with self.lock:
+            self.sealed = self.sealed[len(sealed):]
+            self.flushed_batches += 1
+            self.flushed_increments += count
+            self.last_flush = datetime.now().isoformat()
+        return count
+    
+    def _apply(self, conn: sqlite3.Connection, batch: Dict, journal_paths: List[str]):
+        """Add a batch inside the caller's transaction and mark its journals as applied"""
+        for (user_id, month), values in batch.items():
+            self._increment(user_id, *values[:4], month=month, last_updated=values[4])
+        conn.executemany(
+            "INSERT OR REPLACE INTO usage_meta (key, value) VALUES (?, ?)",
+            [(f"journal:{os.path.basename(path)}", datetime.now().isoformat()) for path in journal_paths]
+        )
+    
+    def _discard_journal(self, path: str):
+        """Remove an applied journal, then its applied marker"""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        self._connect().execute("DELETE FROM usage_meta WHERE key = ?", (f"journal:{os.path.basename(path)}",))
+    
+    def _replay_journals(self):
+        """Apply journals left behind by processes that exited before flushing them"""
+        for path in sorted(glob.glob(f"{glob.escape(self.db_path)}.wb-*.journal")):
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Its process is still running
+                    continue
+                if not os.path.exists(path) or os.stat(path).st_ino != os.fstat(fd).st_ino:
+                    # Replayed by another worker while we waited
+                    continue
+                self._replay_journal(path)
+            except Exception as e:
+                print(f"Error replaying usage journal {path}: {str(e)}")
+            finally:
+                os.close(fd)
+    
+    def _replay_journal(self, path: str):
+        with open(path, 'rb') as f:
+            data = f.read()
+        batch, count = {}, 0
+        for line in data.splitlines():
+            try:
+                user_id, month, *values = json.loads(line)
+            except ValueError:
+                # A line cut short by the crash was never acknowledged
+                continue
+            _add(batch, (user_id, month), *values)
+            count += 1
+        
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            applied = conn.execute(
+                "SELECT 1 FROM usage_meta WHERE key = ?",
+                (f"journal:{os.path.basename(path)}",)
+            ).fetchone()
+            if not applied:
+                self._apply(conn, batch, [path])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._discard_journal(path)
+        if not applied:
+            print(f"Replayed {count} usage increments from {os.path.basename(path)}")
+    
+    def close(self):
+        """Stop the flush thread and write out everything still buffered"""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        try:
+            self.flush()
+        except Exception as e:
+            # Left in the journal for the next start to replay
+            print(f"Error flushing usage: {str(e)}")
+            return
+        with self.lock:
+            path, fd = self.journal
+            if not os.fstat(fd).st_size:
+                self._discard_journal(path)
+                os.close(fd)
+    
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {
+                **self._stats_cache_stats(),
+                'write_behind': True,
+                'pending_increments': self.pending_count,
+                'sealed_journals': len(self.sealed),
+                'flushed_batches': self.flushed_batches,
+                'flushed_increments': self.flushed_increments,
+                'last_flush': self.last_flush,
+                'flush_interval_seconds': self.flush_interval,
+                'max_pending': self.max_pending
+            }
+
+
+def _add(batch: Dict, key: Tuple[str, str], audio_minutes: float, analysis_count: int,
+         trimmed_minutes: float, cached_minutes: float, last_updated: str):
+    """Fold one increment into a {(user_id, month): [totals..., last_updated]} batch"""
+    totals = batch.get(key)
+    if totals is None:
+        batch[key] = [audio_minutes, analysis_count, trimmed_minutes, cached_minutes, last_updated]
+        return
+    totals[0] += audio_minutes
+    totals[1] += analysis_count
+    totals[2] += trimmed_minutes
+    totals[3] += cached_minutes
+    totals[4] = max(totals[4], last_updated)
+
+
+def _month_clause(start_month: str, end_month: str) -> Tuple[str, tuple]:
+    """
+    WHERE clause (and parameters) selecting usage u rows in a month range
+    One month is read through idx_usage_month. Longer ranges walk the primary key
+    instead (the unary + keeps SQLite off the month index), which arrives grouped
+    by user rather than sorting every row in the range.
+    """
+    if start_month == end_month:
+        return "u.month = ?", (start_month,)
+    return "+u.month BETWEEN ? AND ?", (start_month, end_month)
+
+
+def _usage_row(row: tuple) -> Dict:
+    user_id, plan, audio_minutes, analysis_count, trimmed_minutes, cached_minutes, last_updated = row
+    return {
+        'user_id': user_id,
+        'plan': plan,
+        'audio_minutes': audio_minutes,
+        'analysis_count': analysis_count,
+        'trimmed_minutes': trimmed_minutes,
+        'cached_minutes': cached_minutes,
+        'last_updated': last_updated
+    }
+
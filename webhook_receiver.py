@@ -0,0 +1,84 @@
+"""
+Local webhook receiver for testing completion callbacks
+
+Usage:
+    WEBHOOK_SECRET=devsecret python webhook_receiver.py --port 9000 [--fail-first 2]
+
+Then run the app with the same WEBHOOK_SECRET and WEBHOOK_ALLOW_PRIVATE_URLS=true
+(callbacks to localhost are refused otherwise), submit a job with
+callback_url=http://localhost:9000/hook and watch the deliveries (and their
+signature check) arrive here.
+"""
+import os
+import sys
+import json
+import hmac
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from webhooks import sign_payload
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    secret = ''
+    fail_first = 0
+    received = 0
+    
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        WebhookHandler.received += 1
+        
+        signature = self.headers.get('X-Webhook-Signature')
+        if self.secret:
+            expected = sign_payload(self.secret, self.headers.get('X-Webhook-Timestamp', ''), body)
+            verified = bool(signature) and hmac.compare_digest(signature, expected)
+        else:
+            verified = None
+        
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = {}
+        
+        print(
+            f"#{self.received} {self.headers.get('X-Webhook-Event')} "
+            f"id={self.headers.get('X-Webhook-Id')} attempt={self.headers.get('X-Webhook-Attempt')} "
+            f"job={payload.get('job_id')} status={payload.get('status')} "
+            f"signature={'ok' if verified else 'BAD' if verified is False else 'unchecked'}"
+        )
+        sys.stdout.flush()
+        
+        if verified is False:
+            self.send_response(401)
+        elif self.received <= self.fail_first:
+            # Simulate an outage so retries can be observed
+            self.send_response(503)
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+    
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print incoming job webhooks')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--fail-first', type=int, default=0,
+                        help='answer the first N deliveries with 503')
+    args = parser.parse_args()
+    
+    WebhookHandler.secret = os.environ.get('WEBHOOK_SECRET', '')
+    WebhookHandler.fail_first = args.fail_first
+    
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), WebhookHandler)
+    print(f"Listening for webhooks on http://127.0.0.1:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+"""
+Job completion webhooks
+Deliveries are queued in SQLite so they survive restarts, and are sent by a
+background worker with pooled connections, HMAC signatures and exponential backoff
+"""
+import os
+import json
+import time
+import hmac
+import socket
+import hashlib
+import sqlite3
+import ipaddress
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+WEBHOOK_DB = os.environ.get('WEBHOOK_DB', 'webhooks.db')
+# Callbacks are only accepted when deliveries can be signed
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+# Only for local development (e.g. webhook_receiver.py on 127.0.0.1); never set in production
+WEBHOOK_ALLOW_PRIVATE_URLS = os.environ.get('WEBHOOK_ALLOW_PRIVATE_URLS', 'false').lower() in ('1', 'true', 'yes')
+WEBHOOK_TIMEOUT_SECONDS = float(os.environ.get('WEBHOOK_TIMEOUT_SECONDS', 10))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 8))
+WEBHOOK_BACKOFF_BASE_SECONDS = float(os.environ.get('WEBHOOK_BACKOFF_BASE_SECONDS', 5))
+WEBHOOK_BACKOFF_MAX_SECONDS = float(os.environ.get('WEBHOOK_BACKOFF_MAX_SECONDS', 900))
+WEBHOOK_MAX_WORKERS = int(os.environ.get('WEBHOOK_MAX_WORKERS', 4))
+WEBHOOK_POLL_SECONDS = 1.0
+WEBHOOK_MAX_URL_LENGTH = 2048
+
+# Delivered rows are kept this long for inspection before being purged
+WEBHOOK_RETENTION_SECONDS = 24 * 3600
+
+# Client errors that mean "try again later" rather than "never going to work"
+RETRYABLE_CLIENT_ERRORS = (408, 425, 429)
+
+
+def validate_callback_url(url: str) -> Optional[str]:
+    """Return an error message if url can't be used as a callback, else None"""
+    if not WEBHOOK_SECRET:
+        return 'callback_url is not available: the server has no WEBHOOK_SECRET to sign deliveries with'
+    if len(url) > WEBHOOK_MAX_URL_LENGTH:
+        return f'callback_url must be at most {WEBHOOK_MAX_URL_LENGTH} characters'
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        return 'callback_url must be an absolute http(s) URL'
+    return check_callback_host(url)
+
+
+def check_callback_host(url: str) -> Optional[str]:
+    """
+    Resolve the callback host and return an error message unless every address is public
+    Loopback, private, link-local (including 169.254.169.254 metadata), shared, reserved
+    and multicast addresses are refused so callbacks can't reach internal services.
+    """
+    try:
+        return _non_public_address(url)
+    except ValueError:
+        return 'callback_url has an invalid port'
+    except (socket.gaierror, UnicodeError):
+        return f'callback_url host {urlparse(url).hostname!r} could not be resolved'
+
+
+def _non_public_address(url: str) -> Optional[str]:
+    """Error message if the url's host resolves to any non-public address (raises if it doesn't resolve)"""
+    if WEBHOOK_ALLOW_PRIVATE_URLS:
+        return None
+    parsed = urlparse(url)
+    port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    for info in socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP):
+        ip = ipaddress.ip_address(info[4][0].split('%', 1)[0])
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if not ip.is_global or ip.is_multicast:
+            return f'callback_url host {parsed.hostname!r} resolves to a non-public address ({ip})'
+    return None
+
+
+def sign_payload(secret: str, timestamp: str, body: bytes) -> str:
+    """HMAC-SHA256 over "<timestamp>.<body>", as sent in X-Webhook-Signature"""
+    message = timestamp.encode('utf-8') + b'.' + body
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+
+class WebhookQueue:
+    def __init__(self, db_path: str = WEBHOOK_DB, secret: str = WEBHOOK_SECRET,
+                 max_workers: int = WEBHOOK_MAX_WORKERS):
+        """Initialize the delivery queue and create its table if needed"""
+        self.db_path = db_path
+        self.secret = secret
+        self.max_workers = max_workers
+        self._local = threading.local()
+        
+        # One pooled client for every delivery from this process
+        self.client = httpx.Client(
+            timeout=WEBHOOK_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=max_workers * 2, max_keepalive_connections=max_workers),
+            follow_redirects=False
+        )
+        
+        self.stats_lock = threading.Lock()
+        self.delivered = 0
+        self.failed_attempts = 0
+        self.failed_permanently = 0
+        self.latencies = deque(maxlen=500)
+        
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+        
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS webhook_deliveries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                url TEXT NOT NULL,
+                event TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                lease_until REAL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                delivered_at REAL
+            )
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_webhook_due ON webhook_deliveries (status, next_attempt_at)"
+        )
+    
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread; WAL lets workers read while another writes"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def enqueue(self, job_id: str, url: str, event: str, payload: Dict[str, Any]):
+        """Persist a delivery and wake the worker"""
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO webhook_deliveries (job_id, url, event, payload, status, next_attempt_at, created_at) "
+            "VALUES (?, ?, ?, ?, 'pending', ?, ?)",
+            (job_id, url, event, json.dumps(payload), now, now)
+        )
+        self._wake.set()
+    
+    def _claim(self, limit: int) -> List[tuple]:
+        """
+        Atomically take up to limit due deliveries
+        A lease stops other gunicorn workers from sending the same row; if this
+        process dies mid-delivery the lease runs out and the row is retried.
+        """
+        now = time.time()
+        conn = self._connect()
+        
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, job_id, url, event, payload, attempts, created_at FROM webhook_deliveries "
+                "WHERE (status = 'pending' AND next_attempt_at <= ?) "
+                "OR (status = 'delivering' AND lease_until < ?) "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (now, now, limit)
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE webhook_deliveries SET status = 'delivering', lease_until = ? WHERE id = ?",
+                    [(now + WEBHOOK_TIMEOUT_SECONDS * 3, row[0]) for row in rows]
+                )
+            conn.execute(
+                "DELETE FROM webhook_deliveries WHERE status IN ('delivered', 'failed') AND created_at < ?",
+                (now - WEBHOOK_RETENTION_SECONDS,)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        
+        return rows
+    
+    def _deliver(self, row):
+        """Send one delivery and record the outcome"""
+        delivery_id, job_id, url, event, payload, attempts, created_at = row
+        attempts += 1
+        
+        body = payload.encode('utf-8')
+        timestamp = str(int(time.time()))
+        headers = {
+            'Content-Type': 'application/json',
+            'User-Agent': 'SellerMotivationDetector-Webhooks/1.0',
+            'X-Webhook-Event': event,
+            'X-Webhook-Id': str(delivery_id),
+            'X-Webhook-Timestamp': timestamp,
+            'X-Webhook-Attempt': str(attempts)
+        }
+        
+        # Never send unsigned payloads; re-check the host since its DNS may have changed since registration
+        try:
+            error = 'WEBHOOK_SECRET is not configured' if not self.secret else _non_public_address(url)
+        except (OSError, ValueError, UnicodeError) as e:
+            self._record_failure(delivery_id, job_id, attempts, f"DNS lookup failed: {e}", retryable=True)
+            return
+        if error:
+            self._record_failure(delivery_id, job_id, attempts, error, retryable=False)
+            return
+        headers['X-Webhook-Signature'] = sign_payload(self.secret, timestamp, body)
+        
+        retryable = True
+        try:
+            response = self.client.post(url, content=body, headers=headers)
+            if response.is_success:
+                self._record_success(delivery_id, attempts, created_at)
+                return
+            error = f"HTTP {response.status_code}"
+            retryable = response.status_code >= 500 or response.status_code in RETRYABLE_CLIENT_ERRORS
+        except httpx.HTTPError as e:
+            error = f"{type(e).__name__}: {e}"
+        
+        self._record_failure(delivery_id, job_id, attempts, error, retryable)
+    
+    def _record_success(self, delivery_id: int, attempts: int, created_at: float):
+        now = time.time()
+        self._connect().execute(
+            "UPDATE webhook_deliveries SET status = 'delivered', attempts = ?, delivered_at = ?, "
+            "lease_until = NULL, last_error = NULL WHERE id = ?",
+            (attempts, now, delivery_id)
+        )
+        with self.stats_lock:
+            self.delivered += 1
+            self.latencies.append(now - created_at)
+    
+    def _record_failure(self, delivery_id: int, job_id: str, attempts: int, error: str, retryable: bool):
+        with self.stats_lock:
+            self.failed_attempts += 1
+        
+        if not retryable or attempts >= WEBHOOK_MAX_ATTEMPTS:
+            self._connect().execute(
+                "UPDATE webhook_deliveries SET status = 'failed', attempts = ?, last_error = ?, "
+                "lease_until = NULL WHERE id = ?",
+                (attempts, error, delivery_id)
+            )
+            with self.stats_lock:
+                self.failed_permanently += 1
+            print(f"Webhook for job {job_id} failed permanently after {attempts} attempts: {error}")
+            return
+        
+        # Exponential backoff: base, 2x base, 4x base, ... capped
+        delay = min(WEBHOOK_BACKOFF_BASE_SECONDS * (2 ** (attempts - 1)), WEBHOOK_BACKOFF_MAX_SECONDS)
+        self._connect().execute(
+            "UPDATE webhook_deliveries SET status = 'pending', attempts = ?, last_error = ?, "
+            "next_attempt_at = ?, lease_until = NULL WHERE id = ?",
+            (attempts, error, time.time() + delay, delivery_id)
+        )
+    
+    def start(self):
+        """Start the background delivery worker (idempotent)"""
+        if self._thread and self._thread.is_alive():
+            return
+        if not self.secret:
+            print("WEBHOOK_SECRET is not set: callback_url will be rejected and queued deliveries will fail")
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='webhook')
+        self._thread = threading.Thread(target=self._run, name='webhook-delivery', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Stop the delivery worker; undelivered rows stay queued for the next start"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=WEBHOOK_TIMEOUT_SECONDS + 5)
+            self._thread = None
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+    
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                rows = self._claim(self.max_workers)
+            except sqlite3.Error as e:
+                print(f"Webhook queue error: {e}")
+                rows = []
+            
+            if rows:
+                # Deliver this round in parallel, then look for more straight away
+                list(self._executor.map(self._deliver, rows))
+                continue
+            
+            self._wake.wait(WEBHOOK_POLL_SECONDS)
+            self._wake.clear()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Delivery counters for this process plus queue depth shared by all workers"""
+        counts = dict(self._connect().execute(
+            "SELECT status, COUNT(*) FROM webhook_deliveries GROUP BY status"
+        ).fetchall())
+        
+        with self.stats_lock:
+            latencies = sorted(self.latencies)
+            stats = {
+                'delivered': self.delivered,
+                'failed_attempts': self.failed_attempts,
+                'failed_permanently': self.failed_permanently
+            }
+        
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3)
+        
+        stats.update({
+            'queued': counts.get('pending', 0) + counts.get('delivering', 0),
+            'by_status': counts,
+            'latency_p50_seconds': percentile(0.5),
+            'latency_p95_seconds': percentile(0.95),
+            'latency_max_seconds': round(latencies[-1], 3) if latencies else None
+        })
+        return stats